@@ -1,82 +1,18 @@
+from concurrent.futures import ProcessPoolExecutor
+from typing import NamedTuple
 from pathlib import Path
 import argparse
+import copy
+import os
+import sys
 
-
-class Parser:
-
-    def __init__(self, input_file: Path):
-        with open(input_file, 'r') as file:
-            self.preprocessed = self.preprocessing(file.readlines())
-        self.index = 0
-        self.current_line = self.preprocessed[0]
-
-    @staticmethod
-    def preprocessing(lines: list) -> list:
-        """
-        Preprocesses the vm code by removing comments, whitespace, and empty lines.
-
-        Iterates through the lines of the vm code, discards comments and trims
-        unnecessary whitespace.
-
-        Args:
-            lines (list): A list containing all the raw lines from the input vm code file.
-
-        Returns:
-             list: the cleaned instructions
-        """
-        preprocessed = []
-        for line in lines:
-            cmd, *comments = line.split('//')
-            instruction = cmd.strip()
-            if instruction != "":
-                preprocessed.append(instruction)
-        return preprocessed
-
-    def has_more_commands(self) -> bool:
-        return self.index < len(self.preprocessed)
-
-    def advance(self) -> None:
-        self.current_line = self.preprocessed[self.index]
-        self.index += 1
-
-    def get_command_type(self) -> str:
-        cmd_type = self.current_line.split()[0]
-        match cmd_type:
-            case "push":
-                return "C_PUSH"
-            case "pop":
-                return "C_POP"
-            case "label":
-                return "C_LABEL"
-            case "goto":
-                return "C_GOTO"
-            case "if-goto":
-                return "C_IF"
-            case "function":
-                return "C_FUNCTION"
-            case "call":
-                return "C_CALL"
-            case "return":
-                return "C_RETURN"
-            case default:
-                if cmd_type in ["add", "sub", "neg", "eq", "lt", "gt", "and", "or", "not"]:
-                    return "C_ARITHMETIC"
-
-        raise SyntaxError(f"Unknown command type: {cmd_type}.")
-
-    def arg1(self) -> str:
-        if self.get_command_type() == "C_RETURN":
-            raise Exception("arg1 should not be called with C_RETURN command.")
-
-        if self.get_command_type() == "C_ARITHMETIC":
-            return self.current_line.split()[0]
-        return self.current_line.split()[1]
-
-    def arg2(self) -> int:
-        if self.get_command_type() in ["C_PUSH", "C_POP", "C_FUNCTION", "C_CALL"]:
-            return int(self.current_line.split()[2])
-
-        raise Exception(f"arg2 should only be called with C_PUSH, C_POP, C_FUNCTION or C_CALL but was called with {self.get_command_type()}")
+from size_report import SizeReport
+from vm_optimizer import VMOptimizer
+from vm_constant_folder import ConstantFolder
+from vm_tree_shaker import TreeShaker
+from vm_inliner import Inliner
+from vm_ir import (VMProgram, COMMANDS, SEGMENTS, CONSTANT, SUB, NOT, EQ, LT, PUSH, POP, LABEL, GOTO, IF_GOTO, FUNCTION,
+                   CALL, RETURN)
 
 
 class CodeWriter:
@@ -104,11 +40,128 @@ class CodeWriter:
         "or":   "M=D|M"
     }
 
-    def __init__(self, output_file_name: str, path: Path):
+    # compact calling convention: shared call and return routines, written with the bootstrap
+    call_routine = "$CALL"
+    return_routine = "$RETURN"
+    # smallest number of local variables zeroed by a loop rather than unrolled in compact mode
+    locals_loop = 4
+
+    # shared comparison routines, written with the bootstrap: return address in D, then R13
+    comparison_routine = {
+        "eq": "$EQ",
+        "gt": "$GT",
+        "lt": "$LT"
+    }
+
+    # costs of the comparisons measured on the emitted code by `comparison_costs`, once
+    measured_comparison_costs = None
+
+    # largest indexes of a segment reached by incrementing A rather than adding them to the base
+    chained_push_index = 2
+    chained_pop_index = 8
+
+    # calls of the JACK_OS translated into Hack sequences (function -> number of arguments); multiply
+    # and divide call shared routines written after the program if it uses them: return address in D
+    intrinsic_functions = {
+        "Math.multiply": 2,
+        "Math.divide": 2,
+        "Memory.peek": 1,
+        "Memory.poke": 2
+    }
+    multiply_routine = "$MULTIPLY"
+    divide_routine = "$DIVIDE"
+
+    # tail calls of other functions: shared routine written after the program if it has any,
+    # R13 = n_args, R14 = function
+    tail_call_routine = "$TAILCALL"
+
+    # standard translation of the commands, keyed by (command, segment): instruction lines with {holes},
+    # comments ("//") and labels ("("), compiled into one format string per command (see `compile_templates`)
+    templates = {
+        ("push", "constant"): ("// push constant {index}", "@{index}", "D=A", "@SP", "A=M", "M=D", "@SP", "M=M+1"),
+        **{("push", segment): (f"// push {segment} {{index}}", "@{index}", "D=A", f"@{pointer}", "A=D+M", "D=M",
+                               "@SP", "M=M+1", "A=M-1", "M=D")
+           for segment, pointer in segment_pointer.items()},
+        ("push", "temp"): ("// push temp {index}", "@{index}", "D=A", "@5", "A=D+A", "D=M",
+                           "@SP", "M=M+1", "A=M-1", "M=D"),
+        ("push", "static"): ("// push static {index}", "@{file}.{index}", "D=M", "@SP", "M=M+1", "A=M-1", "M=D"),
+        ("push", "pointer"): ("// push pointer {index}", "@{pointer}", "D=M", "@SP", "M=M+1", "A=M-1", "M=D"),
+        # pop: D = addr + val, then A = D - val = addr and M = D - addr = val
+        **{("pop", segment): (f"// pop {segment} {{index}}", "@{index}", "D=A", f"@{pointer}", "D=D+M",
+                              "@SP", "AM=M-1", "D=D+M", "A=D-M", "M=D-A")
+           for segment, pointer in segment_pointer.items()},
+        ("pop", "temp"): ("// pop temp {index}", "@{index}", "D=A", "@5", "D=D+A",
+                          "@SP", "AM=M-1", "D=D+M", "A=D-M", "M=D-A"),
+        ("pop", "static"): ("// pop static {index}", "@SP", "AM=M-1", "D=M", "@{file}.{index}", "M=D"),
+        ("pop", "pointer"): ("// pop pointer {index}", "@SP", "AM=M-1", "D=M", "@{pointer}", "M=D"),
+        **{(instruction, None): (f"// {instruction}", "@SP", "AM=M-1", "D=M", "A=A-1", comp)
+           for instruction, comp in {**add_sub_instruction, **logic_instruction}.items()},
+        ("neg", None): ("// neg", "@SP", "A=M-1", "M=-M"),
+        ("not", None): ("// not", "@SP", "A=M-1", "M=!M"),
+        # D = x - y, *[SP-1] = -1 (true), unless the jump is not taken: *[SP-1] = 0 (false)
+        **{(instruction, None): (f"// {instruction}", "@SP", "AM=M-1", "D=M", "A=A-1", "D=M-D", "M=-1",
+                                 "@INSTRUCTION_END_{label}", jump, "@SP", "A=M-1", "M=0", "(INSTRUCTION_END_{label})")
+           for instruction, jump in comparison_instruction.items()},
+        ("label", None): ("// label {label}", "({scope}${label})"),
+        ("goto", None): ("// goto {label}", "@{scope}${label}", "0;JMP"),
+        ("if-goto", None): ("// if-goto {label}", "@SP", "M=M-1", "A=M", "D=M", "@{scope}${label}", "D;JNE"),
+        ("call", None): ("// call {callee} {n_args}",
+                         "// push return address", "@{return_label}", "D=A", "@SP", "A=M", "M=D", "@SP", "M=M+1",
+                         "// push LCL, ARG, THIS and THAT of caller",
+                         "@LCL", "D=M", "@SP", "A=M", "M=D", "@SP", "M=M+1",
+                         "@ARG", "D=M", "@SP", "A=M", "M=D", "@SP", "M=M+1",
+                         "@THIS", "D=M", "@SP", "A=M", "M=D", "@SP", "M=M+1",
+                         "@THAT", "D=M", "@SP", "A=M", "M=D", "@SP", "AM=M+1",
+                         "// ARG = SP - 5 - n_args", "D=A", "@5", "D=D-A", "@{n_args}", "D=D-A", "@ARG", "M=D",
+                         "// LCL = SP", "@SP", "D=M", "@LCL", "M=D",
+                         "@{callee}", "0;JMP",
+                         "({return_label})"),
+        ("return", None): ("// return",
+                           "// end_frame = LCL", "@LCL", "D=M", "@R13", "M=D",
+                           "// return_address = *(end_frame - 5)", "@5", "A=D-A", "D=M", "@R14", "M=D",
+                           "// *ARG = pop()", "@SP", "A=M-1", "D=M", "@ARG", "A=M", "M=D",
+                           "// SP = ARG + 1", "@ARG", "D=M+1", "@SP", "M=D",
+                           "// THAT = *(end_frame - 1)", "@R13", "A=M-1", "D=M", "@THAT", "M=D",
+                           "// THIS = *(end_frame - 2)", "@R13", "A=M-1", "A=A-1", "D=M", "@THIS", "M=D",
+                           "// ARG = *(end_frame - 3)", "@R13", "D=M", "@3", "A=D-A", "D=M", "@ARG", "M=D",
+                           "// LCL = *(end_frame - 4)", "@R13", "D=M", "@4", "A=D-A", "D=M", "@LCL", "M=D",
+                           "// goto return_address", "@R14", "A=M", "0;JMP"),
+    }
+    # compiled templates, with and without comments and blank lines (lean)
+    compiled_templates = {}
+
+    # fused compare-and-branch: jump of `<cmp>; if-goto` and of `<cmp>; not; if-goto` on D = x - y
+    # (`sub; if-goto`, as vm_optimizer rewrites `eq; not; if-goto`, jumps if x != y)
+    branch_jump = {
+        "eq":  ("D;JEQ", "D;JNE"),
+        "gt":  ("D;JGT", "D;JLE"),
+        "lt":  ("D;JLT", "D;JGE"),
+        "sub": ("D;JNE", None)
+    }
+
+    def __init__(self, output_file_name: str, path: Path, compact: bool = False, shared_comparisons: bool = False,
+                 cache_top: bool = False, intrinsics=(), fuse_branches: bool = False, lean: bool = False,
+                 tail_calls: bool = False):
         self.output_file_name = output_file_name
         self.output_path = path
+        self.compact = compact
+        self.shared_comparisons = shared_comparisons
+        # top-of-stack caching: while top_in_d, the top of the stack is in D and not in RAM (SP excludes it)
+        self.cache_top = cache_top
+        self.top_in_d = False
+        self.intrinsics = frozenset(intrinsics)
+        self.fuse_branches = fuse_branches
+        self.tail_calls = tail_calls
+        # lean: no comments, blank lines nor indentation in the output
+        self.lean = lean
+        if lean not in CodeWriter.compiled_templates:
+            CodeWriter.compiled_templates[lean] = CodeWriter.compile_templates(lean)
+        self.compiled = CodeWriter.compiled_templates[lean]
+        self.comparisons = 0
         self.output = []
         self.next_instruction = 0
+        # shared routines the output jumps to, written once after the program (see `write_used_routines`)
+        self.routines = set()
         self.call_dictionary = {}
         self.current_function = ".."
         self.current_filename = None
@@ -117,10 +170,35 @@ class CodeWriter:
         self.current_filename = filename
 
     def write(self, string: str = "", tab: bool = True) -> None:
-        s = "    " if tab else ""
+        if self.lean:
+            if string and not string.lstrip().startswith("//"):
+                self.output.append(string + '\n')
+            return
+        s = "    " if tab and string else ""
         s += string + '\n'
         self.output.append(s)
 
+    @staticmethod
+    def compile_templates(lean: bool) -> dict:
+        """Joins the lines of every template into one format string, laid out as `write` does."""
+        compiled = {}
+        for key, lines in CodeWriter.templates.items():
+            text = []
+            for i, line in enumerate(lines):
+                if line.startswith("//"):
+                    if not lean:
+                        text.append(("        " if i == 0 else "    ") + line + "\n")
+                elif line.startswith("(") or lean:
+                    text.append(line + "\n")
+                else:
+                    text.append("    " + line + "\n")
+            compiled[key] = "".join(text) + ("" if lean else "\n")
+        return compiled
+
+    def emit(self, command: str, segment: str = None, **holes) -> None:
+        """Appends the compiled template of a command to the output, its holes filled with `holes`."""
+        self.output.append(self.compiled[(command, segment)].format(**holes))
+
     def write_init(self) -> None:
         self.write("    // bootstrap")
         # set SP to 256
@@ -131,30 +209,75 @@ class CodeWriter:
         # call Sys.init
         self.write_call("Sys.init", 0)
         self.write()
+        if self.compact:
+            self.write_call_routine()
+            self.write_return_routine()
+        if self.shared_comparisons:
+            self.write_comparison_routines()
+
+    def spill(self) -> None:
+        """Writes the cached top of the stack back to RAM, where labels, calls and returns expect it."""
+        if self.top_in_d:
+            self.write("@SP")
+            self.write("M=M+1")
+            self.write("A=M-1")
+            self.write("M=D")
+            self.top_in_d = False
+
+    def fill(self) -> None:
+        """Pops the top of the stack into D if it is not cached yet."""
+        if not self.top_in_d:
+            self.write("@SP")
+            self.write("AM=M-1")
+            self.write("D=M")
+            self.top_in_d = True
 
     def write_label(self, label: str) -> None:
-        self.write(f"    // label {label}")
-        self.write(f"({self.current_function}${label})", tab=False)
+        self.spill()
+        self.emit("label", scope=self.current_function, label=label)
 
     def write_goto(self, label: str) -> None:
-        self.write(f"    // goto {label}")
-        self.write(f"@{self.current_function}${label}")
-        self.write("0;JMP")
-        self.write()
+        self.spill()
+        self.emit("goto", scope=self.current_function, label=label)
 
     def write_if(self, label: str) -> None:
-        self.write(f"    // if-goto {label}")
+        if self.cache_top:
+            self.write(f"    // if-goto {label}")
+            self.fill()
+            self.write(f"@{self.current_function}${label}")
+            self.write("D;JNE")
+            self.write()
+            self.top_in_d = False
+            return
+        self.emit("if-goto", scope=self.current_function, label=label)
+
+    def write_compare_branch(self, instruction: str, label: str, negated: bool = False) -> None:
+        """Writes `instruction` (a comparison or sub), then `not` if negated, then `if-goto label`, as one jump."""
+        commands = [instruction] + (["not"] if negated else []) + [f"if-goto {label}"]
+        self.write(f"    // {'; '.join(commands)}")
+        if self.cache_top:
+            self.fill()
+        else:
+            self.write("@SP")
+            self.write("AM=M-1")
+            self.write("D=M")       # y
         self.write("@SP")
-        self.write("M=M-1")         # SP = SP-1 => "pops" STACK TOP
-        self.write("A=M")           # goes to STACK TOP
-        self.write("D=M")
+        self.write("AM=M-1")
+        self.write("D=M-D")         # x - y
         self.write(f"@{self.current_function}${label}")
-        self.write("D;JNE")         # if STACK TOP != 0 => JMP
+        self.write(CodeWriter.branch_jump[instruction][negated])
         self.write()
+        self.top_in_d = False
 
     def write_function(self, function: str, n_var: int):
+        self.spill()
         self.write(f"    // function {function} {n_var}")
         self.write(f"({function})", tab=False)
+        self.current_function = function
+        if self.compact:
+            self.write_compact_locals(function, n_var)
+            self.write()
+            return
         # function initialisation set all local variables to 0
         self.write("@SP")
         self.write("A=M")
@@ -164,346 +287,864 @@ class CodeWriter:
             self.write("AM=M+1")
         # function start
         self.write()
-        self.current_function = function
 
-    def write_call(self, function: str, n_args: int):
-        # get call number for return address
-        return_number = self.call_dictionary.get(function, 0)
-        self.call_dictionary[function] = return_number + 1
-        self.write(f"    // call {function} {n_args}")
-        # push return address
-        self.write(f"@{function}$ret.{return_number}")
+    def write_compact_locals(self, function: str, n_var: int) -> None:
+        if n_var < CodeWriter.locals_loop:
+            # unrolled: 3 instructions per local variable
+            if n_var:
+                self.write("@SP")
+                self.write("A=M")
+            for i in range(n_var):
+                self.write("M=0")
+                self.write("@SP")
+                self.write("AM=M+1")
+            return
+        # loop: 8 instructions whatever the number of local variables
+        self.write(f"@{n_var}")
         self.write("D=A")
+        self.write(f"($locals.{function})", tab=False)
         self.write("@SP")
-        self.write("A=M")
+        self.write("AM=M+1")
+        self.write("A=A-1")
+        self.write("M=0")
+        self.write(f"@$locals.{function}")
+        self.write("D=D-1;JGT")
+
+    def return_label(self) -> str:
+        """The next return address label of a call or shared comparison, numbered per calling function."""
+        # numbered per caller so that files translate independently; outside any function (bootstrap, or
+        # commands before the first function of a file) the caller is prefixed with the file name
+        caller = self.current_function
+        if caller == ".." and self.current_filename:
+            caller = self.current_filename + caller
+        return_number = self.call_dictionary.get(caller, 0)
+        self.call_dictionary[caller] = return_number + 1
+        return f"{caller}$ret.{return_number}"
+
+    def write_call(self, function: str, n_args: int):
+        return_label = self.return_label()
+        self.spill()
+        if self.compact:
+            self.write(f"    // call {function} {n_args}")
+            # R13 = n_args, R14 = function, D = return address
+            if n_args in (0, 1):
+                self.write("@R13")
+                self.write(f"M={n_args}")
+            else:
+                self.write(f"@{n_args}")
+                self.write("D=A")
+                self.write("@R13")
+                self.write("M=D")
+            self.write(f"@{function}")
+            self.write("D=A")
+            self.write("@R14")
+            self.write("M=D")
+            self.write(f"@{return_label}")
+            self.write("D=A")
+            self.write(f"@{CodeWriter.call_routine}")
+            self.write("0;JMP")
+            self.write(f"({return_label})", tab=False)
+            self.write()
+            return
+        self.emit("call", callee=function, n_args=n_args, return_label=return_label)
+
+    def write_tail_call(self, function: str, n_args: int) -> None:
+        """
+        Writes `call function n_args` followed by `return` as a jump reusing the frame of the current function.
+
+        The arguments overwrite those of the current function, and the function is entered with the
+        saved return address and segment pointers of the caller's frame, to which it returns directly.
+        A recursive call keeps the frame in place (the function is called with the same number of
+        arguments, as the Jack compiler does): its arguments are popped into `argument` and its local
+        variables are reset. Other calls go through `$TAILCALL`, which also moves the saved frame
+        right after the new arguments when their number differs.
+        """
+        if function == self.current_function:
+            for i in reversed(range(n_args)):
+                self.write_pop("argument", i)
+            self.spill()
+            self.write(f"    // tail call {function} {n_args}")
+            self.write("@LCL")
+            self.write("D=M")
+            self.write("@SP")
+            self.write("M=D")
+            self.write(f"@{function}")
+            self.write("0;JMP")
+            self.write()
+            return
+        self.spill()
+        self.write(f"    // tail call {function} {n_args}")
+        if n_args in (0, 1):
+            self.write("@R13")
+            self.write(f"M={n_args}")
+        else:
+            self.write(f"@{n_args}")
+            self.write("D=A")
+            self.write("@R13")
+            self.write("M=D")
+        self.write(f"@{function}")
+        self.write("D=A")
+        self.write("@R14")
         self.write("M=D")
-        self.write("@SP")
-        self.write("M=M+1")
-        self.write("")
-        self.write("")
-        self.write("")
-        # save LCL of caller
-        self.write("@LCL")
+        self.write(f"@{CodeWriter.tail_call_routine}")
+        self.write("0;JMP")
+        self.write()
+        self.routines.add(CodeWriter.tail_call_routine)
+
+    def write_tail_call_routine(self) -> None:
+        """
+        Writes the shared routine of tail calls: R13 = n_args, R14 = function.
+
+        The arguments are copied from the top of the stack down to ARG, then the saved frame right after
+        them. When the calling function has as many arguments, the frame is already there; otherwise it
+        is first saved above the stack (SP + 1 to SP + 5), as the arguments may overwrite it. Every
+        copy goes to lower addresses, so that overlaps do not matter.
+        """
+        routine = CodeWriter.tail_call_routine
+        self.write(f"    // {routine}")
+        self.write(f"({routine})", tab=False)
+        # RAM[SP] = function
+        self.write("@R14")
         self.write("D=M")
         self.write("@SP")
         self.write("A=M")
         self.write("M=D")
-        self.write("@SP")
-        self.write("M=M+1")
-        # save ARG of caller
+        # frame in place if LCL - 5 == ARG + n_args
         self.write("@ARG")
         self.write("D=M")
+        self.write("@R13")
+        self.write("D=D+M")
+        self.write("@5")
+        self.write("D=D+A")
+        self.write("@LCL")
+        self.write("D=M-D")
+        self.write(f"@{routine}.arguments")
+        self.write("D;JEQ")
+        # RAM[SP + 1 + i] = RAM[LCL - 5 + i]
+        for i in range(5):
+            self.write("@LCL")
+            self.write("D=M")
+            self.write(f"@{5 - i}")
+            self.write("A=D-A")
+            self.write("D=M")
+            self.write("@SP")
+            self.write("A=M+1")
+            for _ in range(i):
+                self.write("A=A+1")
+            self.write("M=D")
+        # R14 = SP - n_args (source), R15 = ARG (destination)
+        self.write(f"({routine}.arguments)", tab=False)
         self.write("@SP")
-        self.write("A=M")
-        self.write("M=D")
-        self.write("@SP")
-        self.write("M=M+1")
-        # save THIS of caller
-        self.write("@THIS")
         self.write("D=M")
-        self.write("@SP")
-        self.write("A=M")
+        self.write("@R13")
+        self.write("D=D-M")
+        self.write("@R14")
         self.write("M=D")
-        self.write("@SP")
-        self.write("M=M+1")
-        # save THAT of caller
-        self.write("@THAT")
+        self.write("@ARG")
         self.write("D=M")
-        self.write("@SP")
-        self.write("A=M")
+        self.write("@R15")
         self.write("M=D")
-        self.write("@SP")
+        self.write(f"({routine}.loop)", tab=False)
+        self.write("@R13")
+        self.write("MD=M-1")
+        self.write(f"@{routine}.frame")
+        self.write("D;JLT")
+        self.write("@R14")
         self.write("AM=M+1")
-        # ARG = SP - 5 - n_args
-        self.write("D=A")       # SP
-        self.write("@5")
-        self.write("D=D-A")     # SP - 5
-        self.write(f"@{n_args}")
-        self.write("D=D-A")     # SP - 5 - n_args
-        self.write("@ARG")
-        self.write("M=D")
-        # LCL = SP
-        self.write("@SP")
+        self.write("A=A-1")
         self.write("D=M")
-        self.write("@LCL")
+        self.write("@R15")
+        self.write("AM=M+1")
+        self.write("A=A-1")
         self.write("M=D")
-        # goto function
-        self.write(f"@{function}")
+        self.write(f"@{routine}.loop")
         self.write("0;JMP")
-        # return address label
-        self.write(f"({function}$ret.{return_number})", tab=False)
-        self.write()
-
-    def write_return(self):
-        self.write("    // return")
-        # temp var: end_frame = LCL
-        self.write("// end_frame")
+        # R15 = ARG + n_args: the frame goes there, unless it is already
+        self.write(f"({routine}.frame)", tab=False)
         self.write("@LCL")
         self.write("D=M")
-        self.write("@R13")
-        self.write("M=D")
-        # temp var: return_address = end_frame - 5
-        self.write("// return_address")
         self.write("@5")
-        self.write("A=D-A")     # A: end_frame - 5
+        self.write("D=D-A")
+        self.write("@R15")
+        self.write("D=D-M")
+        self.write(f"@{routine}.enter")
+        self.write("D;JEQ")
+        for i in range(5):
+            self.write("@SP")
+            self.write("A=M+1")
+            for _ in range(i):
+                self.write("A=A+1")
+            self.write("D=M")
+            self.write("@R15")
+            self.write("A=M")
+            for _ in range(i):
+                self.write("A=A+1")
+            self.write("M=D")
+        # LCL = SP = ARG + n_args + 5, goto function
+        self.write(f"({routine}.enter)", tab=False)
+        self.write("@SP")
+        self.write("A=M")
         self.write("D=M")
         self.write("@R14")
         self.write("M=D")
-        # set CALLER STACK TOP to pop() (CALLEE STACK TOP)
-        self.write("// pop()")
-        self.write("@SP")
-        self.write("A=M-1")
+        self.write("@R15")
         self.write("D=M")
-        self.write("@ARG")
-        self.write("A=M")
+        self.write("@5")
+        self.write("D=D+A")
+        self.write("@LCL")
         self.write("M=D")
-        # SP = ARG + 1
-        self.write("// SP = ARG+1")
-        self.write("@ARG")
-        self.write("D=M+1")
         self.write("@SP")
         self.write("M=D")
-        # THAT = *(end_frame-1)
-        self.write("// THAT = *(end_frame-1)")
-        self.write("@R13")
-        self.write("A=M-1")
-        self.write("D=M")
-        self.write("@THAT")
+        self.write("@R14")
+        self.write("A=M")
+        self.write("0;JMP")
+        self.write()
+
+    def write_call_routine(self) -> None:
+        """Writes the shared routine of compact calls: D = return address, R13 = n_args, R14 = function."""
+        self.write(f"    // {CodeWriter.call_routine}")
+        self.write(f"({CodeWriter.call_routine})", tab=False)
+        # push return address
+        self.write("@SP")
+        self.write("A=M")
         self.write("M=D")
-        # THIS = *(end_frame-2)
-        self.write("// THAT = *(end_frame-1)")
-        self.write("@R13")
-        self.write("A=M-1")     # -1
-        self.write("A=A-1")     # -1
-        self.write("D=M")
-        self.write("@THIS")
+        # push LCL, ARG, THIS and THAT of caller
+        for pointer in ("LCL", "ARG", "THIS", "THAT"):
+            self.write(f"@{pointer}")
+            self.write("D=M")
+            self.write("@SP")
+            self.write("AM=M+1")
+            self.write("M=D")
+        # LCL = SP
+        self.write("@SP")
+        self.write("MD=M+1")
+        self.write("@LCL")
         self.write("M=D")
-        # ARG = *(end_frame-3)
-        self.write("// THAT = *(end_frame-1)")
+        # ARG = SP - 5 - n_args
         self.write("@R13")
-        self.write("D=M")
-        self.write("@3")
-        self.write("A=D-A")     # end_frame - 3
-        self.write("D=M")
+        self.write("D=D-M")
+        self.write("@5")
+        self.write("D=D-A")
         self.write("@ARG")
         self.write("M=D")
-        # LCL = *(end_frame-4)
-        self.write("// THAT = *(end_frame-1)")
-        self.write("@R13")
-        self.write("D=M")
-        self.write("@4")
-        self.write("A=D-A")     # end_frame - 4
-        self.write("D=M")
-        self.write("@LCL")
-        self.write("M=D")
-        # goto return address
-        self.write("// goto return_address")
+        # goto function
         self.write("@R14")
         self.write("A=M")
         self.write("0;JMP")
         self.write()
 
+    def write_return_routine(self) -> None:
+        """Writes the shared routine of compact returns."""
+        self.write(f"    // {CodeWriter.return_routine}")
+        self.write(f"({CodeWriter.return_routine})", tab=False)
+        self.emit("return")
+
+    def write_return(self):
+        self.spill()
+        if self.compact:
+            self.write("    // return")
+            self.write(f"@{CodeWriter.return_routine}")
+            self.write("0;JMP")
+            self.write()
+            return
+        self.emit("return")
+
     def write_arithmetic(self, instruction: str) -> None:
-        if instruction in CodeWriter.add_sub_instruction:
-            instr = CodeWriter.add_sub_instruction[instruction]
+        if self.cache_top and not (instruction in CodeWriter.comparison_instruction and self.shared_comparisons):
+            self.write_cached_arithmetic(instruction)
+            return
+        self.spill()
+        if instruction in CodeWriter.comparison_instruction and self.shared_comparisons:
+            self.comparisons += 1
+            return_label = self.return_label()
             self.write(f"    // {instruction}")
-            self.write("@SP")
-            self.write("AM=M-1")       # STACK TOP
-            self.write("D=M")
-            self.write("A=A-1")     # STACK SECOND
-            self.write(instr)
-            self.write()
-        elif instruction == "neg":
-            self.write("    // neg")
-            self.write("@SP")
-            self.write("A=M-1")
-            self.write("M=-M")
+            self.write(f"@{return_label}")
+            self.write("D=A")
+            self.write(f"@{CodeWriter.comparison_routine[instruction]}")
+            self.write("0;JMP")
+            self.write(f"({return_label})", tab=False)
             self.write()
         elif instruction in CodeWriter.comparison_instruction:
-            comp = CodeWriter.comparison_instruction[instruction]
-            self.write(f"   // {instruction}")
+            self.comparisons += 1
+            self.emit(instruction, label=self.file_label())
+            self.next_instruction += 1
+        else:
+            self.emit(instruction)
+
+    def file_label(self) -> str:
+        """Suffix of the labels of the next comparison, scoped by the file so that files translate independently."""
+        return f"{self.current_filename}${self.next_instruction}"
+
+    def write_comparison_routines(self) -> None:
+        """Writes the shared eq, gt and lt routines: D = return address, the result replaces the two operands."""
+        routines = list(CodeWriter.comparison_routine.items())
+        for i, (instruction, routine) in enumerate(routines):
+            self.write(f"    // {routine}")
+            self.write(f"({routine})", tab=False)
+            self.write("@R13")
+            self.write("M=D")
             self.write("@SP")
             self.write("AM=M-1")       # STACK TOP
             self.write("D=M")
             self.write("A=A-1")     # STACK SECOND
             self.write("D=M-D")     # D = X - Y
             self.write("M=-1")      # *[SP-1] = -1 TRUE
-            self.write(f"@INSTRUCTION_END_{self.next_instruction}")
-            self.write(comp)        # jump if TRUE
-            self.write("@SP")
-            self.write("A=M-1")
-            self.write("M=0")      # *[SP-1] = 0; FALSE
-            self.write(f"(INSTRUCTION_END_{self.next_instruction})", tab=False)
-            self.write()
-            self.next_instruction += 1
-        elif instruction in CodeWriter.logic_instruction:
-            logic = CodeWriter.logic_instruction[instruction]
-            self.write(f"    // {instruction}")
-            self.write("@SP")
-            self.write("AM=M-1")       # STACK TOP
-            self.write("D=M")       # Y
-            self.write("A=A-1")     # STACK SECOND  (M is X)
-            self.write(logic)
-            self.write()
-        elif instruction == "not":
-            self.write("    // not")
-            self.write("@SP")
-            self.write("A=M-1")     # STACK TOP
-            self.write("M=!M")
-            self.write()
+            self.write("@$COMPARE.true")
+            self.write(CodeWriter.comparison_instruction[instruction])
+            if i + 1 < len(routines):
+                self.write("@$COMPARE.false")
+                self.write("0;JMP")
+        self.write("($COMPARE.false)", tab=False)
+        self.write("@SP")
+        self.write("A=M-1")
+        self.write("M=0")      # *[SP-1] = 0; FALSE
+        self.write("($COMPARE.true)", tab=False)
+        self.write("@R13")
+        self.write("A=M")
+        self.write("0;JMP")
+        self.write()
 
-    def write_push(self, segment: str, index: int) -> None:
-        if segment == "constant":
-            self.write(f"    // push constant {index}")
-            self.write(f"@{index}")
+    @staticmethod
+    def trace_cycles(lines: list, taken: bool) -> int:
+        """
+        Counts the instructions executed by emitted code from its first line until it leaves the code
+        or jumps to a computed address (the return of a routine).
+
+        Args:
+            lines (list): The emitted lines.
+            taken (bool): Whether the conditional jumps are taken.
+
+        Returns:
+            int: The number of cycles.
+        """
+        instructions = [line.strip() for line in "\n".join(lines).splitlines()]
+        instructions = [line for line in instructions if line and not line.startswith("//")]
+        labels = {line[1:-1]: i for i, line in enumerate(instructions) if line.startswith("(")}
+        cycles, i, target = 0, 0, None
+        while i < len(instructions):
+            instruction = instructions[i]
+            i += 1
+            if instruction.startswith("("):
+                continue
+            cycles += 1
+            if instruction.startswith("@"):
+                target = instruction[1:]
+            elif ";" in instruction and (taken or instruction.endswith("JMP")):
+                if target not in labels:
+                    break
+                i = labels[target]
+        return cycles
+
+    @staticmethod
+    def comparison_costs() -> dict:
+        """
+        Measures the comparisons on the code emitted for them.
+
+        Returns:
+            dict: For "inline" and "shared": comparison -> (words per site, cycles when true, cycles
+                when false); for "routines": the words of the shared routines.
+        """
+        if CodeWriter.measured_comparison_costs is None:
+            routines = CodeWriter("", Path())
+            routines.write_comparison_routines()
+            costs = {"routines": CodeWriter.count_instructions(routines.output)}
+            for mode, shared in (("inline", False), ("shared", True)):
+                costs[mode] = {}
+                for instruction in CodeWriter.comparison_routine:
+                    site = CodeWriter("", Path(), shared_comparisons=shared)
+                    site.write_arithmetic(instruction)
+                    lines = site.output + (routines.output if shared else [])
+                    costs[mode][instruction] = (CodeWriter.count_instructions(site.output),
+                                                CodeWriter.trace_cycles(lines, True),
+                                                CodeWriter.trace_cycles(lines, False))
+            CodeWriter.measured_comparison_costs = costs
+        return CodeWriter.measured_comparison_costs
+
+    def comparison_report(self) -> str:
+        """Compares the size and speed of the comparisons of the program, inline and through shared routines."""
+        costs = CodeWriter.comparison_costs()
+        lines = [f"comparisons: {self.comparisons} sites"]
+        for mode, extra in (("inline", 0), ("shared", costs["routines"])):
+            words = costs[mode]["eq"][0] * self.comparisons + extra
+            cycles = ", ".join(f"{instruction} {true}/{false}" for instruction, (_, true, false) in costs[mode].items())
+            lines.append(f"  {mode}: {words} words, {cycles} cycles (true/false)")
+        return "\n".join(lines)
+
+    def write_intrinsic(self, function: str, n_args: int) -> bool:
+        """Writes an enabled intrinsic instead of `call function n_args`; returns False if there is none."""
+        if function not in self.intrinsics or CodeWriter.intrinsic_functions[function] != n_args:
+            return False
+        self.write(f"    // intrinsic {function}")
+        if function == "Memory.peek":
+            if self.cache_top:
+                self.fill()
+            else:
+                self.write("@SP")
+                self.write("A=M-1")
+                self.write("D=M")
+            self.write("A=D")
+            self.write("D=M")
+            if not self.cache_top:
+                self.write("@SP")
+                self.write("A=M-1")
+                self.write("M=D")
+        elif function == "Memory.poke":
+            # the address is replaced by the return value 0 of the void function
+            if self.cache_top:
+                self.fill()
+                self.write("@SP")
+                self.write("AM=M-1")
+                self.write("A=M")
+                self.write("M=D")
+                self.write("D=0")
+            else:
+                self.write("@SP")
+                self.write("AM=M-1")
+                self.write("D=M")
+                self.write("A=A-1")
+                self.write("A=M")
+                self.write("M=D")
+                self.write("@SP")
+                self.write("A=M-1")
+                self.write("M=0")
+        else:
+            self.spill()
+            routine = CodeWriter.multiply_routine if function == "Math.multiply" else CodeWriter.divide_routine
+            self.routines.add(routine)
+            self.write(f"@INTRINSIC_END_{self.file_label()}")
             self.write("D=A")
+            self.write(f"@{routine}")
+            self.write("0;JMP")
+            self.write(f"(INTRINSIC_END_{self.file_label()})", tab=False)
+            self.next_instruction += 1
+        self.write()
+        return True
+
+    def write_multiply_constant(self, constant: int) -> None:
+        """Multiplies the top of the stack by a constant (0 to 32767): shift-add over its bits, in D."""
+        self.write(f"    // intrinsic Math.multiply by {constant}")
+        if self.cache_top:
+            self.fill()
+        else:
             self.write("@SP")
-            self.write("A=M")
+            self.write("A=M-1")
+            self.write("D=M")
+        bits = bin(constant)[2:]
+        if constant == 0:
+            self.write("D=0")
+        elif bits.count("1") > 1:
+            self.write("@R13")
             self.write("M=D")
+        for bit in bits[1:]:
+            self.write("A=D")
+            self.write("D=D+A")
+            if bit == "1":
+                self.write("@R13")
+                self.write("D=D+M")
+        if not self.cache_top:
             self.write("@SP")
-            self.write("M=M+1")
-            self.write()
-        elif segment in CodeWriter.segment_pointer:
-            seg = CodeWriter.segment_pointer[segment]
-            self.write(f"    // push {segment} {index}")
-            # addr = seg + i
-            self.write(f"@{index}")
-            self.write("D=A")
-            self.write(f"@{seg}")
-            self.write("A=D+M")
-            self.write("D=M")       # Value of seg(i)
-            # SP ++
-            self.write("@SP")
-            self.write("M=M+1")
-            # *[SP-1] = *addr
-            self.write("A=M-1")     # STACK TOP
+            self.write("A=M-1")
             self.write("M=D")
-            self.write()
-        elif segment == "temp":
-            self.write(f"    // push temp {index}")
-            # addr = seg + i
-            self.write(f"@{index}")
-            self.write("D=A")
-            self.write("@5")
-            self.write("A=D+A")     # A=D+A instead of D+M because 5 is hard coded and not stored in memory
+        self.write()
+
+    def write_multiply_routine(self) -> None:
+        """Writes the shared multiplication: unrolled shift-add over the 16 bits of y, from the highest."""
+        routine = CodeWriter.multiply_routine
+        self.write(f"    // {routine}")
+        self.write(f"({routine})", tab=False)
+        self.write("@R15")
+        self.write("M=D")       # return address
+        self.write("@SP")
+        self.write("AM=M-1")
+        self.write("D=M")
+        self.write("@R14")
+        self.write("M=D")       # y
+        self.write("@R13")
+        self.write("M=0")       # product
+        for bit in range(16):
+            if bit:
+                self.write("@R13")
+                self.write("D=M")
+                self.write("M=D+M")
+            # D = y, next bit in the sign of y
+            self.write("@R14")
             self.write("D=M")
-            # SP ++
+            if bit < 15:
+                self.write("M=D+M")
+            self.write(f"@{routine}.{bit}")
+            self.write("D;JGE")
             self.write("@SP")
+            self.write("A=M-1")
+            self.write("D=M")   # x
+            self.write("@R13")
+            self.write("M=D+M")
+            self.write(f"({routine}.{bit})", tab=False)
+        self.write("@R13")
+        self.write("D=M")
+        self.write("@SP")
+        self.write("A=M-1")
+        self.write("M=D")
+        self.write("@R15")
+        self.write("A=M")
+        self.write("0;JMP")
+        self.write()
+
+    def write_divide_routine(self) -> None:
+        """
+        Writes the shared division, truncated toward 0 as `Math.divide`: restoring division of |x| by |y|.
+
+        |x| is shifted out of R13 from its highest bit while the quotient is shifted in, into the
+        remainder R14; R15 holds |y|. The return address and the sign of the result are kept in the
+        free stack cells above the operands. A division by 0 jumps to `$DIVIDE.error`, written after
+        the program by `write_divide_error`.
+        """
+        routine = CodeWriter.divide_routine
+        self.write(f"    // {routine}")
+        self.write(f"({routine})", tab=False)
+        self.write("@R13")
+        self.write("M=D")       # return address, moved to the cell of y
+        self.write("@SP")
+        self.write("AM=M-1")
+        self.write("D=M")
+        self.write("@R15")
+        self.write("M=D")       # y
+        self.write(f"@{routine}.error")
+        self.write("D;JEQ")
+        self.write("@R13")
+        self.write("D=M")
+        self.write("@SP")
+        self.write("A=M")
+        self.write("M=D")
+        self.write("A=A+1")
+        self.write("M=0")       # sign, in the next cell
+        self.write("@R15")
+        self.write("D=M")
+        self.write(f"@{routine}.y")
+        self.write("D;JGE")
+        self.write("@R15")
+        self.write("M=-M")
+        self.write("@SP")
+        self.write("A=M+1")
+        self.write("M=!M")
+        self.write(f"({routine}.y)", tab=False)
+        self.write("@SP")
+        self.write("A=M-1")
+        self.write("D=M")       # x
+        self.write(f"@{routine}.x")
+        self.write("D;JGE")
+        self.write("@SP")
+        self.write("A=M+1")
+        self.write("M=!M")
+        self.write("D=-D")
+        self.write(f"({routine}.x)", tab=False)
+        self.write("@R13")
+        self.write("M=D")
+        self.write("@R14")
+        self.write("M=0")       # remainder
+        for bit in range(16):
+            self.write("@R14")
+            self.write("D=M")
+            self.write("M=D+M")
+            self.write("@R13")
+            self.write("D=M")
+            self.write("M=D+M")
+            self.write(f"@{routine}.{bit}.shifted")
+            self.write("D;JGE")
+            self.write("@R14")
             self.write("M=M+1")
-            # *[SP-1] = *addr
-            self.write("A=M-1")     # STACK TOP
+            self.write(f"({routine}.{bit}.shifted)", tab=False)
+            # remainder - y, exact in 16 bits since the remainder is below 2 * y
+            self.write("@R15")
+            self.write("D=M")
+            self.write("@R14")
+            self.write("D=M-D")
+            self.write(f"@{routine}.{bit}")
+            self.write("D;JLT")
+            self.write("@R14")
             self.write("M=D")
-            self.write()
-        elif segment == "static":
-            # stored in global space as symbolic variables @Foo.i
-            self.write(f"    // push static {index}")
-            self.write(f"@{self.current_filename}.{index}")
-            self.write("D=M")       # Value of static(i)
-            # SP++
-            self.write("@SP")
+            self.write("@R13")
             self.write("M=M+1")
-            # *[SP-1]
-            self.write("A=M-1")
-            self.write("M=D")
+            self.write(f"({routine}.{bit})", tab=False)
+        self.write("@SP")
+        self.write("A=M+1")
+        self.write("D=M")
+        self.write(f"@{routine}.positive")
+        self.write("D;JEQ")
+        self.write("@R13")
+        self.write("M=-M")
+        self.write(f"({routine}.positive)", tab=False)
+        self.write("@R13")
+        self.write("D=M")
+        self.write("@SP")
+        self.write("A=M-1")
+        self.write("M=D")
+        self.write("@SP")
+        self.write("A=M")
+        self.write("A=M")
+        self.write("0;JMP")
+
+    def write_used_routines(self, sys_error: bool) -> None:
+        """
+        Writes the shared routines of the intrinsics and tail calls that the program jumps to (`routines`), after it.
+
+        Args:
+            sys_error (bool): Whether the program defines `Sys.error`, called on a division by 0.
+        """
+        if CodeWriter.multiply_routine in self.routines:
+            self.write_multiply_routine()
+        if CodeWriter.divide_routine in self.routines:
+            self.write_divide_routine()
+            self.write_divide_error(sys_error)
+        if CodeWriter.tail_call_routine in self.routines:
+            self.write_tail_call_routine()
+
+    def write_divide_error(self, sys_error: bool) -> None:
+        """
+        Writes the division by 0 of the shared division: a call of `Sys.error` as the JACK_OS does, if
+        the program defines it (without it, `@Sys.error` would be a variable), then a halt loop.
+        """
+        routine = CodeWriter.divide_routine
+        self.write(f"({routine}.error)", tab=False)
+        if sys_error:
+            self.write_push("constant", 3)
+            self.write_call("Sys.error", 1)
+        self.write(f"({routine}.halt)", tab=False)
+        self.write(f"@{routine}.halt")
+        self.write("0;JMP")
+        self.write()
+
+    def write_cached_arithmetic(self, instruction: str) -> None:
+        """Arithmetic with the top of the stack (y) in D: binary operations pop x from RAM."""
+        self.write(f"    // {instruction}")
+        self.fill()
+        if instruction in ("neg", "not"):
+            self.write("D=-D" if instruction == "neg" else "D=!D")
             self.write()
-        elif segment == "pointer":
-            if index == 0:
-                point = "THIS"
-            elif index == 1:
-                point = "THAT"
-            else:
-                raise SyntaxError(f"push pointer i command only accepts 0/1 as i but {index} was supplied")
-            self.write(f"    // push pointer {index}")
-            self.write(f"@{point}")
-            self.write("D=M")       # Value of Pointer (This or That)
-            self.write("@SP")
-            self.write("M=M+1")
-            self.write("A=M-1")
-            self.write("M=D")
+            return
+        self.write("@SP")
+        self.write("AM=M-1")
+        if instruction in ("add", "sub", "and", "or"):
+            self.write({"add": "D=D+M", "sub": "D=M-D", "and": "D=D&M", "or": "D=D|M"}[instruction])
             self.write()
+            return
+        # comparison: D = x - y, then D = -1 or 0
+        self.write("D=M-D")
+        self.write(f"@INSTRUCTION_TRUE_{self.file_label()}")
+        self.write(CodeWriter.comparison_instruction[instruction])
+        self.write("D=0")
+        self.write(f"@INSTRUCTION_END_{self.file_label()}")
+        self.write("0;JMP")
+        self.write(f"(INSTRUCTION_TRUE_{self.file_label()})", tab=False)
+        self.write("D=-1")
+        self.write(f"(INSTRUCTION_END_{self.file_label()})", tab=False)
+        self.write()
+        self.next_instruction += 1
 
-    def write_pop(self, segment: str, index: int) -> None:
+    def segment_address(self, segment: str, index: int) -> str:
+        """The symbol holding the address of a fixed segment (temp, static, pointer) entry."""
+        if segment == "temp":
+            return f"R{5 + index}"
+        if segment == "static":
+            return f"{self.current_filename}.{index}"
+        if index not in (0, 1):
+            raise SyntaxError(f"pointer i command only accepts 0/1 as i but {index} was supplied")
+        return "THIS" if index == 0 else "THAT"
+
+    def write_cached_push(self, segment: str, index: int) -> None:
+        self.write(f"    // push {segment} {index}")
+        self.spill()
         if segment == "constant":
-            raise SyntaxError("Cannot pop on constant memory segment")
+            self.write(f"@{index}")
+            self.write("D=A")
         elif segment in CodeWriter.segment_pointer:
             seg = CodeWriter.segment_pointer[segment]
-            self.write(f"    // pop {segment} {index}")
-            # addr = seg(i) -> D
+            if index <= CodeWriter.chained_push_index:
+                self.write(f"@{seg}")
+                self.write("A=M" if index == 0 else "A=M+1")
+                for i in range(1, index):
+                    self.write("A=A+1")
+            else:
+                self.write(f"@{index}")
+                self.write("D=A")
+                self.write(f"@{seg}")
+                self.write("A=D+M")
+            self.write("D=M")
+        else:
+            self.write(f"@{self.segment_address(segment, index)}")
+            self.write("D=M")
+        self.write()
+        self.top_in_d = True
+
+    def write_cached_pop(self, segment: str, index: int) -> None:
+        if segment == "constant":
+            raise SyntaxError("Cannot pop on constant memory segment")
+        self.write(f"    // pop {segment} {index}")
+        self.fill()
+        if segment not in CodeWriter.segment_pointer:
+            self.write(f"@{self.segment_address(segment, index)}")
+            self.write("M=D")
+        elif index <= CodeWriter.chained_pop_index:
+            self.write(f"@{CodeWriter.segment_pointer[segment]}")
+            self.write("A=M" if index == 0 else "A=M+1")
+            for i in range(1, index):
+                self.write("A=A+1")
+            self.write("M=D")
+        else:
+            # the free slot above the stack keeps the value while its address is computed
+            self.write("@SP")
+            self.write("A=M")
+            self.write("M=D")
             self.write(f"@{index}")
             self.write("D=A")
-            self.write(f"@{seg}")
+            self.write(f"@{CodeWriter.segment_pointer[segment]}")
             self.write("D=D+M")
-
             self.write("@SP")
-            self.write("AM=M-1")    # move to STACK TOP
+            self.write("A=M")
             self.write("D=D+M")     # addr + val -> D
-            # write value
             self.write("A=D-M")     # D - val = addr -> A
             self.write("M=D-A")     # D - addr = val -> Ram[addr]
-            self.write()
+        self.write()
+        self.top_in_d = False
 
-        elif segment == "temp":
-            self.write(f"    // pop temp {index}")
-            # addr = seg(i) -> D
-            self.write(f"@{index}")
-            self.write("D=A")
-            self.write(f"@5")
-            self.write("D=D+A")
+    def write_push(self, segment: str, index: int) -> None:
+        if self.cache_top:
+            self.write_cached_push(segment, index)
+            return
+        if segment == "pointer" and index not in (0, 1):
+            raise SyntaxError(f"push pointer i command only accepts 0/1 as i but {index} was supplied")
+        self.emit("push", segment, index=index, file=self.current_filename, pointer="THAT" if index else "THIS")
 
-            self.write("@SP")
-            self.write("AM=M-1")  # move to STACK TOP
-            self.write("D=D+M")  # addr + val -> D
-            # write value
-            self.write("A=D-M")  # D - val = addr -> A
-            self.write("M=D-A")  # D - addr = val -> Ram[addr]
-            self.write()
-        elif segment == "static":
-            # stored in global space as symbolic variables @Foo.i
-            self.write(f"    // pop static {index}")
-            self.write("@SP")
-            self.write("AM=M-1")
-            self.write("D=M")
-            self.write(f"@{self.current_filename}.{index}")
-            self.write("M=D")
-            self.write()
-        elif segment == "pointer":
-            if index == 0:
-                pointer = "THIS"
-            elif index == 1:
-                pointer = "THAT"
-            else:
-                raise SyntaxError(f"pop pointer i command only accepts 0/1 as i but {index} was supplied")
-            self.write(f"    // pop pointer {index}")
-            self.write("@SP")
-            self.write("AM=M-1")
-            self.write("D=M")
-            self.write(f"@{pointer}")
-            self.write("M=D")
-            self.write()
+    def write_pop(self, segment: str, index: int) -> None:
+        if self.cache_top:
+            self.write_cached_pop(segment, index)
+            return
+        if segment == "constant":
+            raise SyntaxError("Cannot pop on constant memory segment")
+        if segment == "pointer" and index not in (0, 1):
+            raise SyntaxError(f"pop pointer i command only accepts 0/1 as i but {index} was supplied")
+        self.emit("pop", segment, index=index, file=self.current_filename, pointer="THAT" if index else "THIS")
+
+    @staticmethod
+    def count_instructions(lines: list) -> int:
+        """Counts the instructions (neither comments, labels nor empty lines) of emitted lines or templates."""
+        count = 0
+        for line in "\n".join(lines).splitlines():
+            instruction = line.strip()
+            if instruction and not instruction.startswith("//") and not instruction.startswith("("):
+                count += 1
+        return count
 
     def write_file(self):
         with open(self.output_path / (self.output_file_name + ".asm"), 'w') as file:
-            file.writelines(self.output)
+            file.write("".join(self.output))
 
 
 class VMTranslator:
-    def __init__(self, input: str):
+    """
+        Translates a .vm file, or a directory of .vm files, into a single .asm file written next to it.
+
+        Given a `SizeReport`, every emitted instruction is accounted to its file, VM function and kind
+        of VM command.
+
+        In compact mode, call sites only pass the return address, the function and the number of
+        arguments to a shared `$CALL` routine, returns jump to a shared `$RETURN` routine, and functions
+        with many local variables zero them in a loop. Both routines are written with the bootstrap:
+        a program translated without it must be linked with one translated with it.
+
+        With shared comparisons, `eq`, `gt` and `lt` call shared `$EQ`, `$GT` and `$LT` routines written
+        with the bootstrap, instead of being expanded at each site.
+
+        With top-of-stack caching, the top of the stack stays in D between straight-line commands
+        (`push constant 2` `add` becomes `@2` `D=A` `@SP` `AM=M-1` `D=D+M`), and is written back to RAM
+        at labels, jumps, calls, returns and function entries.
+
+        With fused branches, a comparison (or `sub`) followed by `if-goto`, or by `not` and `if-goto`, is
+        one conditional jump on x - y: no boolean is written to the stack. Loop and if conditions, as
+        the compiler writes them, are translated this way.
+
+        The standard commands are emitted from `CodeWriter.templates`, compiled once into a format string
+        per command. In lean mode, the output has no comments, blank lines nor indentation.
+
+        With tail calls, a call followed by `return` jumps to the function, which reuses the frame of the
+        calling function and returns to its caller: recursion in tail position runs in constant stack
+        space. Tail calls of other functions go through a shared `$TAILCALL` routine, written with the
+        bootstrap after the program if it has any.
+
+        With intrinsics (some of `CodeWriter.intrinsic_functions`), their calls become Hack sequences:
+        direct RAM accesses for `Memory.peek` and `Memory.poke`, shift-add for a multiplication by a
+        constant pushed just before, and shared `$MULTIPLY` and `$DIVIDE` routines otherwise, written
+        with the bootstrap after the program if it calls them. The library functions themselves are
+        still translated. A division by 0 calls `Sys.error` if the program defines it, and halts otherwise.
+
+        Given an optimizer (e.g. `vm_optimizer.VMOptimizer`, `vm_constant_folder.ConstantFolder`) or a
+        list of optimizers, the `VMProgram` of each file is rewritten by their `optimize` method
+        (`VMProgram` -> `VMProgram`), in order, before being translated.
+
+        Each file is parsed once into a `vm_ir.VMProgram`; given a cache directory, the IR of the
+        files parsed by a previous run is loaded from it instead.
+
+        Generated labels are scoped by file (comparisons) or by calling function (return addresses),
+        so every file is translated independently by its own `CodeWriter`, over a process pool when
+        `max_workers` is not 1. The fragments are merged after the bootstrap in the order of the file
+        paths: the output does not depend on the number of workers.
+
+        Given an inliner (`vm_inliner.Inliner`) or a tree shaker (`vm_tree_shaker.TreeShaker`), all the
+        files are parsed first; small functions are inlined at their call sites, then only the functions
+        reachable from `Sys.init` are translated.
+    """
+
+    def __init__(self, input: str, bootstrap: bool = True, report: SizeReport = None, compact: bool = False,
+                 shared_comparisons: bool = False, optimizer=None, cache_top: bool = False, cache_dir: Path = None,
+                 max_workers: int = 1, shaker=None, inliner=None, intrinsics=(), fuse_branches: bool = False,
+                 lean: bool = False, tail_calls: bool = False):
         if self.is_valid_file(input):
             files = [Path(input)]
         elif self.is_valid_dir(input):
-            files = list(Path(input).glob('**/*.vm'))
+            files = sorted(Path(input).glob('**/*.vm'), key=lambda file: file.relative_to(input).as_posix())
         else:
             raise ValueError(f"Invalid input path: {input} is not a directory or .vm file.")
 
         out_filename = Path(input).stem
         out_directory = Path(input).parent
 
-        self.code_writer = CodeWriter(out_filename, out_directory)
-        self.code_writer.write_init()
-        for file in files:
-            self.parser = Parser(file)
-            self.code_writer.set_curr_filename(file.stem)
-            self.translate()
+        self.report = report
+        self.code_writer = CodeWriter(out_filename, out_directory, compact, shared_comparisons, cache_top, intrinsics,
+                                      fuse_branches, lean, tail_calls)
+        if bootstrap:
+            self.code_writer.write_init()
+            if report is not None:
+                report.add(SizeReport.BOOTSTRAP, SizeReport.BOOTSTRAP, "bootstrap",
+                           CodeWriter.count_instructions(self.code_writer.output))
+
+        sources = [str(file) for file in files]
+        if inliner is not None or shaker is not None:
+            sources = [VMProgram.from_file(file, cache_dir) for file in files]
+            if inliner is not None:
+                sources = inliner.inline(sources)
+            if shaker is not None:
+                sources = shaker.shake(sources)
+        options = {"compact": compact, "shared_comparisons": shared_comparisons, "cache_top": cache_top,
+                   "intrinsics": intrinsics, "fuse_branches": fuse_branches, "lean": lean,
+                   "tail_calls": tail_calls}
+        optimizers = [] if optimizer is None else list(optimizer) if isinstance(optimizer, (list, tuple)) \
+            else [optimizer]
+        jobs = [sources, [options] * len(files), [optimizers] * len(files),
+                [cache_dir] * len(files), [report is not None] * len(files)]
+        if (max_workers or os.cpu_count()) == 1 or len(files) < 2:
+            # in-process: the optimizers are copied as they would be pickled to a worker
+            jobs[2] = [copy.deepcopy(optimizers) for _ in files]
+            fragments = list(map(translate_file_job, *jobs))
+        else:
+            with ProcessPoolExecutor(max_workers=max_workers) as pool:
+                fragments = list(pool.map(translate_file_job, *jobs))
+        for fragment in fragments:
+            self.merge(fragment, optimizers)
+        if bootstrap and self.code_writer.routines:
+            start = len(self.code_writer.output)
+            self.code_writer.write_used_routines(any("Sys.error" in fragment.functions for fragment in fragments))
+            if report is not None:
+                report.add(SizeReport.BOOTSTRAP, SizeReport.BOOTSTRAP, "bootstrap",
+                           CodeWriter.count_instructions(self.code_writer.output[start:]))
 
         self.code_writer.write_file()
 
@@ -521,41 +1162,131 @@ class VMTranslator:
             return True
         return False
 
-    def translate(self):
-        while self.parser.has_more_commands():
-            self.parser.advance()
-            cmd = self.parser.get_command_type()
-            match cmd:
-                case "C_ARITHMETIC":
-                    instruction = self.parser.arg1()
-                    self.code_writer.write_arithmetic(instruction)
-                case "C_PUSH":
-                    segment = self.parser.arg1()
-                    index = self.parser.arg2()
-                    self.code_writer.write_push(segment, index)
-                case "C_POP":
-                    segment = self.parser.arg1()
-                    index = self.parser.arg2()
-                    self.code_writer.write_pop(segment, index)
-                case "C_LABEL":
-                    label = self.parser.arg1()
-                    self.code_writer.write_label(label)
-                case "C_GOTO":
-                    label = self.parser.arg1()
-                    self.code_writer.write_goto(label)
-                case "C_IF":
-                    label = self.parser.arg1()
-                    self.code_writer.write_if(label)
-                case "C_FUNCTION":
-                    function = self.parser.arg1()
-                    n_var = self.parser.arg2()
-                    self.code_writer.write_function(function, n_var)
-                case "C_RETURN":
-                    self.code_writer.write_return()
-                case "C_CALL":
-                    function = self.parser.arg1()
-                    n_args = self.parser.arg2()
-                    self.code_writer.write_call(function, n_args)
+    def merge(self, fragment: "Fragment", optimizers: list = ()) -> None:
+        """Appends the translation of a file to the output, and its statistics to the report and optimizers."""
+        self.code_writer.output.append(fragment.text)
+        self.code_writer.comparisons += fragment.comparisons
+        self.code_writer.routines.update(fragment.routines)
+        if self.report is not None:
+            for (file, function, kind), words in fragment.words.items():
+                self.report.add(file, function, kind, words)
+        for optimizer, optimizer_hits in zip(optimizers, fragment.hits):
+            for name, hits in optimizer_hits.items():
+                optimizer.hits[name] += hits
+
+    @staticmethod
+    def translate(code_writer: CodeWriter, program: VMProgram, report: SizeReport = None) -> None:
+        symbols = program.symbols
+        constants = VMTranslator.constant_multiplications(program) if "Math.multiply" in code_writer.intrinsics else {}
+        skipped = set(constants.values())
+        branches = VMTranslator.compare_branches(program) if code_writer.fuse_branches else {}
+        for i, (if_goto, _) in branches.items():
+            # the commands fused into the comparison: the `not` (if any) and the if-goto
+            skipped.update(range(i + 1, if_goto + 1))
+        for i, (opcode, arg, index) in enumerate(zip(program.opcodes, program.args, program.indexes)):
+            if i in skipped:
+                continue
+            start = len(code_writer.output)
+            if i in branches:
+                if_goto, negated = branches[i]
+                code_writer.write_compare_branch(COMMANDS[opcode], symbols[program.args[if_goto]], negated)
+            elif opcode <= NOT:
+                code_writer.write_arithmetic(COMMANDS[opcode])
+            elif opcode == PUSH:
+                code_writer.write_push(SEGMENTS[arg], index)
+            elif opcode == POP:
+                code_writer.write_pop(SEGMENTS[arg], index)
+            elif opcode == LABEL:
+                code_writer.write_label(symbols[arg])
+            elif opcode == GOTO:
+                code_writer.write_goto(symbols[arg])
+            elif opcode == IF_GOTO:
+                code_writer.write_if(symbols[arg])
+            elif opcode == FUNCTION:
+                code_writer.write_function(symbols[arg], index)
+            elif opcode == CALL:
+                if i in constants:
+                    code_writer.write_multiply_constant(program.indexes[constants[i]])
+                elif not code_writer.write_intrinsic(symbols[arg], index):
+                    if code_writer.tail_calls and i + 1 < len(program) and program.opcodes[i + 1] == RETURN:
+                        code_writer.write_tail_call(symbols[arg], index)
+                        skipped.add(i + 1)
+                    else:
+                        code_writer.write_call(symbols[arg], index)
+            elif opcode == RETURN:
+                code_writer.write_return()
+            if report is not None:
+                VMTranslator.account(code_writer, report, opcode, arg, start)
+
+    @staticmethod
+    def constant_multiplications(program: VMProgram) -> dict:
+        """Calls of Math.multiply with an operand pushed as a constant just before -> the index of that push."""
+        opcodes, args, indexes = program.opcodes, program.args, program.indexes
+        multiply = program.symbol_ids.get("Math.multiply")
+        constants = {}
+        for i in range(1, len(program)):
+            if opcodes[i] != CALL or args[i] != multiply or indexes[i] != 2:
+                continue
+            if opcodes[i - 1] == PUSH and args[i - 1] == CONSTANT:
+                constants[i] = i - 1
+            elif i > 1 and opcodes[i - 1] == PUSH and opcodes[i - 2] == PUSH and args[i - 2] == CONSTANT:
+                constants[i] = i - 2
+        return constants
+
+    @staticmethod
+    def compare_branches(program: VMProgram) -> dict:
+        """Comparisons (or subs) followed by `if-goto`, or by `not` and `if-goto` -> (index of the if-goto, negated)."""
+        opcodes = program.opcodes
+        branches = {}
+        for i in range(len(program) - 1):
+            if not (EQ <= opcodes[i] <= LT or opcodes[i] == SUB):
+                continue
+            if opcodes[i + 1] == IF_GOTO:
+                branches[i] = (i + 1, False)
+            elif opcodes[i] != SUB and opcodes[i + 1] == NOT and i + 2 < len(program) and opcodes[i + 2] == IF_GOTO:
+                branches[i] = (i + 2, True)
+        return branches
+
+    @staticmethod
+    def account(code_writer: CodeWriter, report: SizeReport, opcode: int, arg: int, start: int) -> None:
+        """Adds the instructions emitted for a command, from output line `start`, to the size report."""
+        words = CodeWriter.count_instructions(code_writer.output[start:])
+        if opcode in (PUSH, POP):
+            kind = f"{COMMANDS[opcode]} {SEGMENTS[arg]}"
+        elif EQ <= opcode <= LT:
+            kind = "comparison"
+        else:
+            kind = COMMANDS[opcode]
+        report.add(code_writer.current_filename, code_writer.current_function, kind, words)
+
+
+class Fragment(NamedTuple):
+    """Translation of one .vm file by `translate_file_job`."""
+    source: str
+    text: str
+    comparisons: int
+    words: dict
+    hits: list
+    functions: tuple
+    routines: tuple
+
+
+def translate_file_job(source, options: dict, optimizers: list = (), cache_dir: Path = None,
+                       report: bool = False) -> Fragment:
+    """Translates one .vm file, or its parsed `VMProgram`, with a fresh `CodeWriter` (worker of `VMTranslator`)."""
+    program = source if isinstance(source, VMProgram) else VMProgram.from_file(source, cache_dir)
+    hits = []
+    for optimizer in optimizers:
+        before = dict(optimizer.hits)
+        program = optimizer.optimize(program)
+        hits.append({name: count - before[name] for name, count in optimizer.hits.items()})
+    code_writer = CodeWriter(program.source, Path(), **options)
+    code_writer.set_curr_filename(program.source)
+    size_report = SizeReport() if report else None
+    VMTranslator.translate(code_writer, program, size_report)
+    return Fragment(program.source, "".join(code_writer.output), code_writer.comparisons,
+                    size_report.words if report else {}, hits, tuple(name for name, _, _ in program.functions()),
+                    tuple(sorted(code_writer.routines)))
 
 
 if __name__ == '__main__':
@@ -563,6 +1294,50 @@ if __name__ == '__main__':
     arg_parser = argparse.ArgumentParser(description="Hack VM Translator")
     arg_parser.add_argument('input_file', type=str, nargs="?",
                             default=None, help="Path to the input .asm file")
+    arg_parser.add_argument('--no-bootstrap', action="store_true",
+                            help="Do not emit the bootstrap code (e.g. to build a library object for linker.py)")
+    arg_parser.add_argument('--compact', action="store_true",
+                            help="Share the call and return sequences in routines written with the bootstrap "
+                                 "(smaller ROM, a few more cycles per call)")
+    arg_parser.add_argument('--shared-comparisons', action="store_true",
+                            help="Call shared eq/gt/lt routines written with the bootstrap instead of expanding them")
+    arg_parser.add_argument('--intrinsics', type=str, nargs="*", default=None,
+                            choices=list(CodeWriter.intrinsic_functions),
+                            help="Translate the calls of these JACK_OS functions into Hack sequences "
+                                 "(default, without names: all of them)")
+    arg_parser.add_argument('--fuse-branches', action="store_true",
+                            help="Translate a comparison followed by if-goto (or not and if-goto) into one jump")
+    arg_parser.add_argument('--tail-calls', action="store_true",
+                            help="Translate a call followed by return into a jump reusing the frame of the caller")
+    arg_parser.add_argument('--cache-top', action="store_true",
+                            help="Keep the top of the stack in D between straight-line commands")
+    arg_parser.add_argument('--optimize-vm', action="store_true",
+                            help="Rewrite the VM commands with the rules of vm_optimizer.py before translating them")
+    arg_parser.add_argument('--fold-constants', action="store_true",
+                            help="Propagate and fold constants (vm_constant_folder.py) before translating, "
+                                 "and print the folds")
+    arg_parser.add_argument('--tree-shake', action="store_true",
+                            help="Only translate the functions reachable from the roots, and print what was dropped")
+    arg_parser.add_argument('--roots', type=str, nargs="+", default=None,
+                            help="Tree shake from these functions, called from outside the VM code (default: Sys.init)")
+    arg_parser.add_argument('--inline', action="store_true",
+                            help="Inline small functions at their call sites, and print the inlined sites")
+    arg_parser.add_argument('--inline-max-size', type=int, default=16,
+                            help="With --inline: largest number of commands of an inlined function")
+    arg_parser.add_argument('--inline-max-depth', type=int, default=2,
+                            help="With --inline: largest number of nested inlining levels")
+    arg_parser.add_argument('--lean', action="store_true",
+                            help="Write the .asm file without comments, blank lines nor indentation")
+    arg_parser.add_argument('--cache', type=str, default=None,
+                            help="Directory caching the parsed .vm files (see vm_ir.py), e.g. for the JACK_OS")
+    arg_parser.add_argument('--jobs', type=int, default=None,
+                            help="Number of worker processes translating the files of a directory "
+                                 "(default: number of CPUs; the output does not depend on it)")
+    arg_parser.add_argument('--size-report', action="store_true",
+                            help=f"Print the ROM size per function, command kind and file and save it as {SizeReport.SUFFIX}")
+    arg_parser.add_argument('--budget', type=int, default=None,
+                            help=f"Fail if the program exceeds this ROM budget in words (the ROM holds {SizeReport.ROM_SIZE})")
+    arg_parser.add_argument('--top', type=int, default=20, help="With --size-report: number of rows per section")
 
     args = arg_parser.parse_args()
 
@@ -571,4 +1346,35 @@ if __name__ == '__main__':
     else:
         input_file = args.input_file
 
-    vmt = VMTranslator(input_file)
+    shaker = TreeShaker(args.roots or ("Sys.init",)) if args.tree_shake or args.roots else None
+    # folding first: the rules then simplify its output (e.g. an if-goto on a folded `not`)
+    optimizers = [ConstantFolder()] if args.fold_constants else []
+    if args.optimize_vm:
+        optimizers.append(VMOptimizer())
+    inliner = Inliner(args.inline_max_size, args.inline_max_depth) if args.inline else None
+    size_report = SizeReport() if args.size_report or args.budget is not None else None
+    # --intrinsics without names enables all of them
+    intrinsics = () if args.intrinsics is None else args.intrinsics or list(CodeWriter.intrinsic_functions)
+    vmt = VMTranslator(input_file, bootstrap=not args.no_bootstrap, report=size_report, compact=args.compact,
+                       shared_comparisons=args.shared_comparisons,
+                       optimizer=optimizers, cache_top=args.cache_top,
+                       intrinsics=intrinsics, fuse_branches=args.fuse_branches, lean=args.lean,
+                       tail_calls=args.tail_calls,
+                       cache_dir=args.cache, max_workers=args.jobs, shaker=shaker,
+                       inliner=inliner)
+    if args.fold_constants:
+        print("constant folding: " + ", ".join(f"{hits} {kind}" for kind, hits in optimizers[0].hits.items()))
+    if inliner is not None:
+        print(inliner.report())
+    if shaker is not None:
+        print(shaker.log())
+    if args.size_report:
+        size_report.save(Path(input_file).parent / (Path(input_file).stem + SizeReport.SUFFIX))
+        print(size_report.format(args.top, args.budget or SizeReport.ROM_SIZE))
+        print()
+        print(vmt.code_writer.comparison_report())
+    if args.budget is not None:
+        try:
+            size_report.check(args.budget)
+        except OverflowError as error:
+            sys.exit(f"error: {error}")
@@ -0,0 +1,1180 @@
+import re
+import json
+import math
+import heapq
+import argparse
+from pathlib import Path
+
+from assembler import Assembler
+
+
+INVERTED_JUMP = {"JGT": "JLE", "JEQ": "JNE", "JGE": "JLT", "JLT": "JGE", "JNE": "JEQ", "JLE": "JGT"}
+KBD = Assembler.PRE_DEFINED_SYMBOLS["KBD"]
+
+
+def preprocess(lines) -> list:
+    """Removes comments, whitespace and empty lines from assembly source lines."""
+    instructions = []
+    for line in lines:
+        cmd, *comments = line.split('//')
+        instruction = cmd.strip()
+        if instruction != "":
+            instructions.append(instruction)
+    return instructions
+
+
+def is_label(instruction: str) -> bool:
+    return bool(re.match(Assembler.LABEL_PATTERN, instruction))
+
+
+def split_c_instruction(instruction: str) -> tuple:
+    """Splits a C-instruction into (dest, comp, jump), dest and jump being "" when absent."""
+    dest, _, rest = instruction.rpartition("=")
+    comp, _, jump = rest.partition(";")
+    return dest, comp, jump
+
+
+def format_program(instructions: list) -> list:
+    """Formats instructions as assembly lines: labels flush left, instructions indented."""
+    return [instruction + "\n" if instruction[0] == "(" else "    " + instruction + "\n"
+            for instruction in instructions]
+
+
+class PeepholeOptimizer:
+    """
+        Dataflow-aware peephole optimizer for Hack assembly.
+
+        The program is cut into basic blocks at labels (every jump target is a label) and after
+        unconditional jumps. A forward pass numbers the values held by A, D and the memory cells known
+        in the block; a value is either a constant, a symbol address, an unknown value, or an
+        expression of values, and additions of constants are kept as (base, offset) pairs so that
+        `M=M+1` followed by `M=M-1` is recognized as the identity. With these values:
+
+        - an instruction that only writes values its destinations already hold is dropped
+          (e.g. `@SP` when A already holds SP, `D=M` right after `M=D`),
+        - `@X` followed by a computation giving back the previous A is dropped
+          (e.g. `@SP` `A=M-1` recomputing the current stack top address),
+        - a store to M followed by an instruction writing back the original content is merged
+          into a single read (e.g. `M=M+1` `AM=M-1` becomes `A=M`).
+
+        A backward liveness pass then removes the writes to A or D that are overwritten before being
+        read (A and D are considered live at block ends and jumps). Memory cells are only assumed
+        distinct when that is certain: distinct constant addresses, distinct variables; a write
+        through a pointer forgets everything except its own cell, and the keyboard is never cached.
+        The first `@var` of each variable is never removed: the assembler allocates the variables in the
+        order of their first reference, and the program may rely on their addresses (literal RAM
+        addresses, numbered statics).
+
+        For code produced by the VM translator, `vm_layout` adds the guarantee of the VM memory
+        mapping: pointers (stack, segments, heap) never address the virtual registers R0-R15, so a
+        write through a pointer keeps what is known of SP, LCL, ARG, THIS, THAT, temp and R13-R15.
+
+        Instances Attributes:
+            vm_layout (bool): Trust the VM memory mapping (see above).
+            labels (set): The labels defined in the program (their symbols are ROM addresses).
+            stats (dict): Number of instructions removed by each rule.
+    """
+
+    def __init__(self, vm_layout: bool = False):
+        self.vm_layout = vm_layout
+        self.labels = set()
+        self.stats = {"redundant": 0, "restored_a": 0, "memory_round_trip": 0, "dead_write": 0}
+        self.next_unknown = 0
+
+    @property
+    def removed(self) -> int:
+        """Total number of instructions removed."""
+        return sum(self.stats.values())
+
+    def optimize(self, lines) -> list:
+        """
+        Optimizes an assembly program.
+
+        Args:
+            lines (Iterable[str]): The assembly source lines (comments and whitespace are allowed).
+
+        Returns:
+            list: The optimized instructions and labels, without comments.
+        """
+        instructions = preprocess(lines)
+        self.labels = {instruction[1:-1] for instruction in instructions if is_label(instruction)}
+        while True:
+            removed = self.removed
+            instructions = self.eliminate_dead_writes(self.forward_pass(instructions))
+            if self.removed == removed:
+                return instructions
+
+    # --- values -----------------------------------------------------------------------------------
+
+    def unknown(self) -> tuple:
+        self.next_unknown += 1
+        return ("?", self.next_unknown), 0
+
+    def a_value(self, value: str) -> tuple:
+        if value in Assembler.PRE_DEFINED_SYMBOLS and value not in self.labels:
+            return None, Assembler.PRE_DEFINED_SYMBOLS[value]
+        if re.match(Assembler.SYMBOL_PATTERN, value):
+            return ("s", value), 0
+        return None, int(value) & 0xFFFF
+
+    @staticmethod
+    def add(x: tuple, y: tuple) -> tuple:
+        if x[0] is None:
+            return y[0], (y[1] + x[1]) & 0xFFFF
+        if y[0] is None:
+            return x[0], (x[1] + y[1]) & 0xFFFF
+        return ("+",) + tuple(sorted((x, y), key=repr)), 0
+
+    @staticmethod
+    def negate(x: tuple) -> tuple:
+        if x[0] is None:
+            return None, -x[1] & 0xFFFF
+        return ("-", x), 0
+
+    @staticmethod
+    def subtract(x: tuple, y: tuple) -> tuple:
+        if x[0] == y[0]:
+            return None, (x[1] - y[1]) & 0xFFFF
+        if y[0] is None:
+            return x[0], (x[1] - y[1]) & 0xFFFF
+        return PeepholeOptimizer.add(x, PeepholeOptimizer.negate(y))
+
+    @staticmethod
+    def bitwise(operator: str, x: tuple, y: tuple) -> tuple:
+        if x[0] is None and y[0] is None:
+            return None, (x[1] & y[1] if operator == "&" else x[1] | y[1])
+        return (operator,) + tuple(sorted((x, y), key=repr)), 0
+
+    @staticmethod
+    def evaluate(comp: str, d: tuple, y: tuple) -> tuple:
+        """Symbolic evaluation of a comp mnemonic, y being the value of A or M."""
+        x = d
+        if "A" in comp or "M" in comp:
+            comp = comp.replace("A", "Y").replace("M", "Y")
+        match comp:
+            case "0" | "1":
+                return None, int(comp)
+            case "-1":
+                return None, 0xFFFF
+            case "D":
+                return x
+            case "Y":
+                return y
+            case "!D" | "!Y":
+                operand = x if comp == "!D" else y
+                return (None, ~operand[1] & 0xFFFF) if operand[0] is None else (("!", operand), 0)
+            case "-D":
+                return PeepholeOptimizer.negate(x)
+            case "-Y":
+                return PeepholeOptimizer.negate(y)
+            case "D+1":
+                return PeepholeOptimizer.add(x, (None, 1))
+            case "Y+1":
+                return PeepholeOptimizer.add(y, (None, 1))
+            case "D-1":
+                return PeepholeOptimizer.subtract(x, (None, 1))
+            case "Y-1":
+                return PeepholeOptimizer.subtract(y, (None, 1))
+            case "D+Y":
+                return PeepholeOptimizer.add(x, y)
+            case "D-Y":
+                return PeepholeOptimizer.subtract(x, y)
+            case "Y-D":
+                return PeepholeOptimizer.subtract(y, x)
+            case "D&Y":
+                return PeepholeOptimizer.bitwise("&", x, y)
+            case "D|Y":
+                return PeepholeOptimizer.bitwise("|", x, y)
+        raise SyntaxError(f"C-instruction: unknown comp: {comp}")
+
+    # --- memory model -----------------------------------------------------------------------------
+
+    def is_variable(self, address: tuple) -> bool:
+        return address[0] is not None and address[0][0] == "s" and address[1] == 0 \
+            and address[0][1] not in self.labels
+
+    def may_alias(self, x: tuple, y: tuple) -> bool:
+        """Tells whether two address values may designate the same RAM cell."""
+        if x == y:
+            return True
+        if x[0] is None and y[0] is None:
+            return False
+        if self.is_variable(x) and self.is_variable(y):
+            return False
+        for other, constant in ((x, y), (y, x)):
+            if constant[0] is not None:
+                continue
+            # variables are allocated from 16 upwards, below the screen
+            if self.is_variable(other) and not 16 <= constant[1] < 16384:
+                return False
+            if self.vm_layout and constant[1] < 16:
+                return False
+        return False if x[0] == y[0] and x[0][0] == "s" else True
+
+    def is_cacheable(self, address: tuple) -> bool:
+        """Content read at these addresses can be remembered: fixed cells that are not the keyboard."""
+        return (address[0] is None and address[1] != KBD) or self.is_variable(address)
+
+    def first_references(self, instructions: list) -> set:
+        """The positions of the first `@var` of each variable, which pin the addresses of the variables."""
+        positions, seen = set(), set()
+        for i, instruction in enumerate(instructions):
+            symbol = instruction[1:]
+            if instruction[0] == "@" and symbol not in seen and symbol not in Assembler.PRE_DEFINED_SYMBOLS \
+                    and symbol not in self.labels and re.match(Assembler.SYMBOL_PATTERN, symbol):
+                positions.add(i)
+                seen.add(symbol)
+        return positions
+
+    # --- passes -----------------------------------------------------------------------------------
+
+    def forward_pass(self, instructions: list) -> list:
+        """Value-numbering pass removing and merging redundant instructions inside basic blocks."""
+        output = []     # (instruction, A before it, content of the addressed cell before it)
+        a, d, memory = self.unknown(), self.unknown(), {}
+        block_start = 0
+        first_references = self.first_references(instructions)
+        pinned = set()  # positions in output of the first references
+        for i, instruction in enumerate(instructions):
+            if is_label(instruction):
+                output.append((instruction, None, None))
+                a, d, memory = self.unknown(), self.unknown(), {}
+                block_start = len(output)
+                continue
+
+            if instruction[0] == "@":
+                value = self.a_value(instruction[1:])
+                if i in first_references:
+                    pinned.add(len(output))
+                elif value == a:
+                    self.stats["redundant"] += 1
+                    continue
+                output.append((instruction, a, None))
+                a = value
+                continue
+
+            dest, comp, jump = split_c_instruction(instruction)
+            content = memory.get(a)
+            if "M" in comp and content is None:
+                content = self.unknown()
+                if self.is_cacheable(a):
+                    memory[a] = content
+            result = self.evaluate(comp, d, content if "M" in comp else a)
+            previous = output[-1] if len(output) > block_start else None
+
+            if not jump and ("A" not in dest or a == result) and ("D" not in dest or d == result) \
+                    and ("M" not in dest or memory.get(a) == result):
+                self.stats["redundant"] += 1
+                continue
+
+            if not jump and dest == "A" and previous is not None and previous[0][0] == "@" \
+                    and previous[1] == result and len(output) - 1 not in pinned:
+                # `@X` followed by a computation giving back the previous A
+                output.pop()
+                self.stats["restored_a"] += 2
+                a = result
+                continue
+
+            if not jump and "M" in dest and previous is not None and previous[0][0] != "@" \
+                    and split_c_instruction(previous[0])[0] == "M" and not split_c_instruction(previous[0])[2] \
+                    and previous[2] is not None and previous[2] == result:
+                # the previous instruction only wrote M, and this one writes the original content back
+                output.pop()
+                registers = dest.replace("M", "")
+                memory[a] = result
+                if registers:
+                    output.append((f"{registers}=M", a, result))
+                    self.stats["memory_round_trip"] += 1
+                else:
+                    self.stats["memory_round_trip"] += 2
+                if "D" in registers:
+                    d = result
+                if "A" in registers:
+                    a = result
+                continue
+
+            output.append((instruction, a, content))
+            if "M" in dest:
+                for address in [address for address in memory if self.may_alias(address, a)]:
+                    del memory[address]
+                memory[a] = result
+            if "D" in dest:
+                d = result
+            if "A" in dest:
+                a = result
+            if jump == "JMP":
+                a, d, memory = self.unknown(), self.unknown(), {}
+                block_start = len(output)
+        return [instruction for instruction, _, _ in output]
+
+    def eliminate_dead_writes(self, instructions: list) -> list:
+        """Backward liveness pass removing writes to A or D that are never read."""
+        keep = [True] * len(instructions)
+        first_references = self.first_references(instructions)
+        live_a = live_d = True
+        for i in range(len(instructions) - 1, -1, -1):
+            instruction = instructions[i]
+            if is_label(instruction):
+                live_a = live_d = True
+                continue
+            if instruction[0] == "@":
+                if not live_a and i not in first_references:
+                    keep[i] = False
+                    self.stats["dead_write"] += 1
+                live_a = False
+                continue
+            dest, comp, jump = split_c_instruction(instruction)
+            if jump:
+                live_a = live_d = True
+            elif "M" not in dest and ("A" not in dest or not live_a) and ("D" not in dest or not live_d):
+                keep[i] = False
+                self.stats["dead_write"] += 1
+                continue
+            if "A" in dest:
+                live_a = False
+            if "D" in dest:
+                live_d = False
+            live_a = live_a or "A" in comp or "M" in comp or "M" in dest or bool(jump)
+            live_d = live_d or "D" in comp
+        return [instruction for instruction, kept in zip(instructions, keep) if kept]
+
+
+class BasicBlock:
+    """
+        Basic block of a Hack assembly program, as seen by the `JumpOptimizer`.
+
+        A direct jump is an `@label` immediately followed by a jump instruction that does not write A;
+        every other jump (return, computed goto) is indirect and stays in the body of its block.
+
+        Instances Attributes:
+            index (int): Position of the block in the original program.
+            labels (list): The labels bound to the start of the block.
+            body (list): The instructions, without the direct jump ending the block.
+            kind (str): How the block ends: "fall" (falls through to the next block), "cond" (direct
+                conditional jump), "jump" (direct unconditional jump), "exit" (indirect unconditional
+                jump) or "end" (the empty block standing for the end of the program).
+            closed (bool): The block ends with a jump.
+            jump (str): The jump instruction ending a "cond" or "jump" block.
+            target (BasicBlock): The target of the direct jump.
+            fall (BasicBlock): The successor when the block does not jump.
+            taken (float): Estimated probability that the conditional jump is taken.
+            frequency (float): Estimated execution count of the block.
+    """
+
+    def __init__(self, index: int):
+        self.index = index
+        self.labels = []
+        self.body = []
+        self.kind = "fall"
+        self.jump = None
+        self.target = None
+        self.fall = None
+        self.taken = 0.0
+        self.frequency = 1.0
+        self.closed = False
+
+    def successors(self) -> list:
+        return [block for block in (self.target, self.fall) if block is not None]
+
+    def likely(self):
+        """The successor on the most probable path (None after an indirect jump)."""
+        if self.kind == "jump" or (self.kind == "cond" and self.taken > 0.5):
+            return self.target
+        return self.fall
+
+    def a_dead(self) -> bool:
+        """Tells whether the block overwrites A before reading it, so that it may be entered with any A."""
+        for instruction in self.body:
+            if instruction[0] == "@":
+                return True
+            dest, comp, jump = split_c_instruction(instruction)
+            if "A" in comp or "M" in comp or "M" in dest or jump:
+                return False
+            if "A" in dest:
+                return True
+        return self.kind in ("cond", "jump", "end")
+
+
+class JumpOptimizer:
+    """
+        Jump threading and basic-block layout pass for Hack assembly.
+
+        The program is cut into basic blocks linked by their direct jumps and fall-through edges, then:
+
+        - jumps to a block that only jumps (`goto IF_END_n` landing on `goto WHILE_LOOP_n`) are
+          threaded to their final target, and the blocks no longer reachable are removed,
+        - the blocks are chained so that each one is followed by its most frequent successor: an
+          unconditional jump to the next block disappears, and a conditional jump over an
+          unconditional jump is inverted (`@T` `D;JNE` `@F` `0;JMP` `(T)` becomes `@F` `D;JEQ` `(T)`),
+          which also rotates loops so that the body falls through to the test.
+
+        Frequencies come from an optional profile (label -> execution count, see `emulator.py
+        --profile`) or from a static heuristic: blocks nested in n loops (see `natural_loops`) run 10^n
+        times, backward branches are taken and loop exits are not.
+
+        Changing how a block is entered changes the value of A it sees (the label address after a
+        jump, whatever the previous block left after a fall-through), so an edge is only rewritten
+        when its destination overwrites A before reading it, which holds for every VM command.
+
+        Class Attributes:
+            LOOP_WEIGHT (int): Frequency ratio between a loop body and the code around it.
+            LIKELY (float): Probability of a backward branch being taken (and of a loop exit not being).
+
+        Instances Attributes:
+            profile (dict): Label -> execution count, or None for the static heuristic.
+            entry_points (set): Labels kept reachable in addition to the program start
+                (e.g. functions called from other objects).
+            labels (set): The labels of the program.
+            stats (dict): Number of jumps threaded and inverted, jump instructions and blocks removed.
+            loops (dict): Loop header label -> (cycles before, cycles after) of one iteration along the
+                likely path, calls excluded.
+    """
+
+    LOOP_WEIGHT = 10
+    LIKELY = 0.9
+
+    def __init__(self, profile: dict = None, entry_points=()):
+        self.profile = profile
+        self.entry_points = set(entry_points)
+        self.labels = set()
+        self.stats = {"threaded": 0, "inverted": 0, "branches_removed": 0, "blocks_removed": 0}
+        self.loops = {}
+        self.next_label = 0
+
+    @property
+    def cycles_saved(self) -> dict:
+        """Loop header label -> estimated cycles saved per iteration."""
+        return {label: before - after for label, (before, after) in self.loops.items()}
+
+    def optimize(self, lines) -> list:
+        """
+        Threads the jumps and reorders the basic blocks of an assembly program.
+
+        Args:
+            lines (Iterable[str]): The assembly source lines (comments and whitespace are allowed).
+
+        Returns:
+            list: The optimized instructions and labels, without comments.
+        """
+        instructions = preprocess(lines)
+        self.labels = {instruction[1:-1] for instruction in instructions if is_label(instruction)}
+        blocks = self.build_blocks(instructions)
+        if not blocks:
+            return instructions
+        self.estimate(blocks)
+        loops = self.natural_loops(blocks)
+        before = {header: self.iteration_cycles(header, loop, blocks, JumpOptimizer.original_cycles)
+                  for header, loop in loops.items()}
+
+        self.thread(blocks)
+        reachable = self.reachable(blocks)
+        self.stats["blocks_removed"] += len(blocks) - len(reachable)
+        order = self.layout(reachable)
+        following = {block: order[i + 1] if i + 1 < len(order) else None for i, block in enumerate(order)}
+        output = self.emit(order)
+
+        for header, loop in loops.items():
+            if before[header] is None or header not in following:
+                continue
+            after = self.iteration_cycles(header, loop, reachable,
+                                          lambda block, successor: self.layout_cycles(block, successor,
+                                                                                      following[block]))
+            if after is not None:
+                self.loops[header.labels[0]] = (before[header], after)
+
+        jumps = sum(1 for instruction in instructions if ";" in instruction)
+        self.stats["branches_removed"] += jumps - sum(1 for instruction in output if ";" in instruction)
+        return output
+
+    # --- control-flow graph -----------------------------------------------------------------------
+
+    def build_blocks(self, instructions: list) -> list:
+        """Cuts the program into basic blocks and links them."""
+        blocks = []
+        block = None
+        for instruction in instructions:
+            if is_label(instruction):
+                if block is None or block.body or block.closed:
+                    block = BasicBlock(len(blocks))
+                    blocks.append(block)
+                block.labels.append(instruction[1:-1])
+                continue
+            if block is None or block.closed:
+                block = BasicBlock(len(blocks))
+                blocks.append(block)
+            block.body.append(instruction)
+            if instruction[0] == "@" or ";" not in instruction:
+                continue
+            block.closed = True
+            dest, comp, jump = split_c_instruction(instruction)
+            previous = block.body[-2] if len(block.body) > 1 else ""
+            direct = previous[:1] == "@" and previous[1:] in self.labels and "A" not in dest
+            if direct and (jump != "JMP" or not dest):
+                block.kind = "jump" if jump == "JMP" else "cond"
+                block.jump = instruction
+                block.target = previous[1:]
+                del block.body[-2:]
+            elif jump == "JMP":
+                block.kind = "exit"
+
+        if blocks and blocks[-1].kind in ("fall", "cond"):
+            # explicit end of the program, so that falling off the ROM is a regular successor
+            end = BasicBlock(len(blocks))
+            end.kind = "end"
+            blocks.append(end)
+
+        blocks_by_label = {label: block for block in blocks for label in block.labels}
+        for i, block in enumerate(blocks):
+            if block.target is not None:
+                block.target = blocks_by_label[block.target]
+            if block.kind in ("fall", "cond") and i + 1 < len(blocks):
+                block.fall = blocks[i + 1]
+        return blocks
+
+    def frequencies(self, instructions: list) -> list:
+        """Estimated execution count of each instruction (labels included) of a preprocessed program."""
+        self.labels = {instruction[1:-1] for instruction in instructions if is_label(instruction)}
+        blocks = self.build_blocks(instructions)
+        self.estimate(blocks)
+        frequencies = []
+        for block in blocks:
+            size = len(block.labels) + len(block.body) + (2 if block.kind in ("cond", "jump") else 0)
+            frequencies.extend([block.frequency] * size)
+        return frequencies
+
+    def estimate(self, blocks: list) -> None:
+        """Estimates the frequency of each block and the probability of each conditional jump."""
+        depth = [0] * len(blocks)
+        for loop in self.natural_loops(blocks).values():
+            for block in loop:
+                depth[block.index] += 1
+        counts = self.profile or {}
+        for block in blocks:
+            counted = [counts[label] for label in block.labels if label in counts]
+            if counted:
+                block.frequency = counted[0]
+            elif counts and block.index > 0:
+                block.frequency = blocks[block.index - 1].frequency
+            else:
+                block.frequency = JumpOptimizer.LOOP_WEIGHT ** depth[block.index]
+
+        for block in blocks:
+            if block.kind != "cond":
+                continue
+            target, fall = block.target, block.fall
+            if counts and any(label in counts for label in target.labels) \
+                    and any(label in counts for label in fall.labels) and target.frequency + fall.frequency:
+                block.taken = target.frequency / (target.frequency + fall.frequency)
+            elif target.index <= block.index:
+                block.taken = JumpOptimizer.LIKELY
+            elif depth[target.index] < depth[block.index]:
+                block.taken = 1 - JumpOptimizer.LIKELY
+            else:
+                block.taken = 0.5
+
+    def natural_loops(self, blocks: list) -> dict:
+        """
+        Finds the loops of the program: loop header -> set of the blocks of its loop.
+
+        A jump to a block dominating it is a back edge, and the loop holds the blocks reaching it
+        without going through the header. A block loading the label of the next block before jumping
+        (`@ret` ... `@f` `0;JMP` `(ret)`) is a call: it is considered as falling through to its return
+        address, so that calls to earlier functions are not taken for loops and loops holding calls
+        are found.
+        """
+        blocks_by_label = {label: block for block in blocks for label in block.labels}
+        successors = {block: block.successors() for block in blocks}
+        return_sites = set()
+        for i, block in enumerate(blocks[:-1]):
+            following = blocks[i + 1]
+            if block.kind == "jump" and any(f"@{label}" in block.body for label in following.labels):
+                successors[block].append(following)
+                return_sites.add(following)
+        roots = {blocks[0]} | {blocks_by_label[label] for label in self.entry_points if label in blocks_by_label}
+        roots |= {blocks_by_label[instruction[1:]] for block in blocks for instruction in block.body
+                  if instruction[0] == "@" and instruction[1:] in blocks_by_label} - return_sites
+
+        position = {block: i for i, block in enumerate(blocks)}
+        predecessors = {block: [] for block in blocks}
+        for block in blocks:
+            for successor in successors[block]:
+                predecessors[successor].append(block)
+        everything = (1 << len(blocks)) - 1
+        dominators = [1 << i if block in roots or not predecessors[block] else everything
+                      for i, block in enumerate(blocks)]
+        changed = True
+        while changed:
+            changed = False
+            for i, block in enumerate(blocks):
+                if block in roots or not predecessors[block]:
+                    continue
+                dominated = everything
+                for predecessor in predecessors[block]:
+                    dominated &= dominators[position[predecessor]]
+                dominated |= 1 << i
+                if dominated != dominators[i]:
+                    dominators[i] = dominated
+                    changed = True
+
+        loops = {}
+        for block in blocks:
+            for header in successors[block]:
+                # `(END) @END 0;JMP` is a halt, not a loop
+                if not dominators[position[block]] >> position[header] & 1 or (header is block and not block.body):
+                    continue
+                loop = loops.setdefault(header, {header})
+                pending = [block]
+                while pending:
+                    member = pending.pop()
+                    if member not in loop:
+                        loop.add(member)
+                        pending.extend(predecessors[member])
+        return loops
+
+    # --- passes -----------------------------------------------------------------------------------
+
+    @staticmethod
+    def final_target(block: BasicBlock) -> BasicBlock:
+        """Follows a chain of blocks that only jump."""
+        seen = set()
+        while block.kind == "jump" and not block.body and block not in seen:
+            seen.add(block)
+            block = block.target
+        return block
+
+    def thread(self, blocks: list) -> None:
+        """Retargets the jumps and fall-through edges leading to a jump chain."""
+        for block in blocks:
+            if block.target is not None:
+                target = JumpOptimizer.final_target(block.target)
+                # on the fall-through of a conditional jump, A holds the jump target
+                if target is not block.target and (block.kind == "jump" or block.fall.a_dead()):
+                    block.target = target
+                    self.stats["threaded"] += 1
+            if block.fall is not None:
+                fall = JumpOptimizer.final_target(block.fall)
+                if fall is not block.fall and fall.a_dead():
+                    block.fall = fall
+                    self.stats["threaded"] += 1
+
+    def reachable(self, blocks: list) -> list:
+        """The blocks reachable from the program start, the entry points and the labels used as data."""
+        blocks_by_label = {label: block for block in blocks for label in block.labels}
+        roots = [blocks[0]] + [blocks_by_label[label] for label in self.entry_points if label in blocks_by_label]
+        seen = set(roots)
+        while roots:
+            block = roots.pop()
+            # a label loaded by an instruction other than a direct jump may be jumped to indirectly
+            referenced = [blocks_by_label.get(instruction[1:]) for instruction in block.body if instruction[0] == "@"]
+            for successor in block.successors() + referenced:
+                if successor is not None and successor not in seen:
+                    seen.add(successor)
+                    roots.append(successor)
+        return [block for block in blocks if block in seen]
+
+    def layout(self, blocks: list) -> list:
+        """
+        Orders the blocks by merging chains along the most frequent edges.
+
+        Returns:
+            list: The blocks in their new order, the program start first and the end of the program last.
+        """
+        chains = {block: [block] for block in blocks}
+
+        def merge(block, successor):
+            chain = chains[block]
+            if chain[-1] is not block or chains[successor][0] is not successor \
+                    or chains[successor] is chain or successor is blocks[0] or successor.kind == "end":
+                return
+            chain.extend(chains[successor])
+            for merged in chains[successor]:
+                chains[merged] = chain
+
+        # a fall-through into a block reading A cannot be replaced by a jump
+        for block in blocks:
+            if block.fall is not None and block.fall.index == block.index + 1 and not block.fall.a_dead():
+                merge(block, block.fall)
+
+        edges = []
+        for block in blocks:
+            if block.kind == "fall" and block.fall is not None:
+                edges.append((block.frequency, block.index, 0, block, block.fall))
+            elif block.kind == "jump":
+                edges.append((block.frequency, block.index, 1, block, block.target))
+            elif block.kind == "cond":
+                edges.append((block.frequency * (1 - block.taken), block.index, 0, block, block.fall))
+                if block.target.a_dead() and block.fall.a_dead():
+                    edges.append((block.frequency * block.taken, block.index, 1, block, block.target))
+        edges.sort(key=lambda edge: (-edge[0], edge[1], edge[2]))
+        for _, _, _, block, successor in edges:
+            merge(block, successor)
+
+        for chain in {id(chain): chain for chain in chains.values()}.values():
+            self.rotate(chain, chains, blocks[0])
+
+        # the chain falling into the end of the program goes last, unless it starts the program
+        heads = [block for block in blocks if chains[block][0] is block]
+        heads.sort(key=lambda head: (head.kind == "end",
+                                     head is not blocks[0] and chains[head][-1].fall is not None
+                                     and chains[head][-1].fall.kind == "end", head.index))
+        return [block for head in heads for block in chains[head]]
+
+    def rotate(self, chain: list, chains: dict, entry: BasicBlock) -> None:
+        """
+        Rotates a chain holding a whole loop so that it ends with the loop exit test.
+
+        When the last block of a chain falls back into its first block, the chain is a loop cut at an
+        arbitrary point. Cutting it after a conditional jump leaving the loop instead, inverted so
+        that it jumps back into the loop and falls through to the exit, saves a jump per iteration.
+        """
+        head, tail = chain[0], chain[-1]
+        if len(chain) < 2 or entry in chain or not self.falls_into(tail, head):
+            return
+        exits = [i for i, block in enumerate(chain[:-1])
+                 if block.kind == "cond" and block.fall is chain[i + 1] and block.target not in chain
+                 and chains[block.target][0] is block.target and block.target is not entry
+                 and block.target.kind != "end" and self.invertible(block)]
+        if not exits:
+            return
+        k = min(exits, key=lambda i: chain[i].target.frequency)
+        rotated = chain[k + 1:] + chain[:k + 1] + chains[chain[k].target]
+        chain[:] = rotated
+        for block in rotated:
+            chains[block] = chain
+
+    def falls_into(self, block: BasicBlock, successor: BasicBlock) -> bool:
+        """Tells whether `successor` may directly follow `block` (see `merge` in `layout`)."""
+        if block.kind in ("fall", "cond") and block.fall is successor:
+            return True
+        if block.kind == "jump":
+            return block.target is successor
+        return block.kind == "cond" and block.target is successor and self.invertible(block)
+
+    def label(self, block: BasicBlock) -> str:
+        """Returns a label of the block, creating one if needed."""
+        if not block.labels:
+            while f"$block.{self.next_label}" in self.labels:
+                self.next_label += 1
+            block.labels.append(f"$block.{self.next_label}")
+            self.labels.add(block.labels[0])
+        return block.labels[0]
+
+    def emit(self, order: list) -> list:
+        """Writes the blocks in their new order, with the jumps the layout still needs."""
+        terminators = []
+        for i, block in enumerate(order):
+            following = order[i + 1] if i + 1 < len(order) else None
+            terminators.append(self.terminator(block, following))
+        output = []
+        for block, terminator in zip(order, terminators):
+            output.extend(f"({label})" for label in block.labels)
+            output.extend(block.body)
+            output.extend(terminator)
+        return output
+
+    def terminator(self, block: BasicBlock, following: BasicBlock) -> list:
+        if block.kind in ("exit", "end") or block.fall is following and block.kind == "fall":
+            return []
+        if block.kind == "fall":
+            return [f"@{self.label(block.fall)}", "0;JMP"]
+        if block.kind == "jump":
+            if block.target is not following:
+                return [f"@{self.label(block.target)}", block.jump]
+            return [] if block.target.a_dead() else [f"@{self.label(block.target)}"]
+        if block.fall is following:
+            return [f"@{self.label(block.target)}", block.jump]
+        if block.target is following and self.invertible(block):
+            dest, comp, jump = split_c_instruction(block.jump)
+            self.stats["inverted"] += 1
+            inverted = f"{comp};{INVERTED_JUMP[jump]}"
+            return [f"@{self.label(block.fall)}", f"{dest}={inverted}" if dest else inverted]
+        return [f"@{self.label(block.target)}", block.jump, f"@{self.label(block.fall)}", "0;JMP"]
+
+    @staticmethod
+    def invertible(block: BasicBlock) -> bool:
+        return block.target.a_dead() and block.fall.a_dead()
+
+    # --- cycle estimates --------------------------------------------------------------------------
+
+    @staticmethod
+    def original_cycles(block: BasicBlock, successor: BasicBlock) -> int:
+        """Cycles spent in the jump ending `block` in the original program."""
+        return 2 if block.kind in ("cond", "jump") else 0
+
+    def layout_cycles(self, block: BasicBlock, successor: BasicBlock, following: BasicBlock) -> int:
+        """Cycles spent in the jumps ending `block`, going to `successor`, in the new layout."""
+        if block.kind == "fall":
+            return 0 if block.fall is following else 2
+        if block.kind == "jump":
+            if block.target is not following:
+                return 2
+            return 0 if block.target.a_dead() else 1
+        if block.kind == "cond":
+            if block.fall is following or (block.target is following and self.invertible(block)):
+                return 2
+            return 2 if successor is block.target else 4
+        return 0
+
+    @staticmethod
+    def iteration_cycles(header: BasicBlock, loop: set, blocks: list, jump_cycles) -> int:
+        """
+        Cycles of one loop iteration along the likely path, from the header back to it.
+
+        A jump leaving the loop is considered as a call: the path resumes at the next block of the loop.
+        Returns None if the likely path leaves the loop.
+        """
+        in_loop = [block for block in blocks if block in loop]
+        following = {block: in_loop[i + 1] if i + 1 < len(in_loop) else None for i, block in enumerate(in_loop)}
+        cycles = 0
+        block = header
+        for _ in range(len(in_loop)):
+            successor = block.likely()
+            cycles += len(block.body) + jump_cycles(block, successor)
+            if successor is header:
+                return cycles
+            if successor not in following:
+                if block.kind == "exit":
+                    return None
+                successor = following[block]
+            if successor is None:
+                return None
+            block = successor
+        return None
+
+
+class Outliner:
+    """
+        Procedural abstraction pass: outlines repeated instruction sequences into shared subroutines.
+
+        The VM translator expands every command from a fixed template, so a linked program holds the
+        same straight-line sequences (frame saves of calls, returns, pushes) thousands of times. Every
+        window of `min_length` to `max_length` instructions without labels is hashed, and the
+        sequences occurring several times are outlined greedily, largest saving first:
+
+        - a sequence ending with an unconditional jump (a `return`, the tail of a `call`) becomes a
+          shared body entered by `@body` `0;JMP` (2 words, 2 extra cycles per use),
+        - any other sequence becomes a subroutine ending with `@link` `A=M` `0;JMP`, called by
+          `@ret` `D=A` `@link` `M=D` `@body` `0;JMP` `(ret)` (6 words, 9 extra cycles per use).
+          Such a call clobbers D, A and the link register, so the sequence must write D and A before
+          reading them, A must be dead after each use replaced, and so must the link register before it.
+
+        The extra cycles of each use are weighted by the estimated frequency of its block (see
+        `JumpOptimizer`, with the same optional profile). The size-vs-speed knob is
+        `max_cycles_per_word`, the largest number of extra cycles accepted per ROM word saved; with a
+        `target` size, the cheapest sequences in cycles per word are outlined first and outlining stops
+        as soon as the program fits.
+
+        The link register must not be written through pointers by the program (true of the VM mapping
+        for R13-R15). The translator keeps values in R15 inside its `$MULTIPLY`, `$DIVIDE` and `$TAILCALL`
+        routines: the liveness of the link register is computed over the jumps whose target is a label,
+        computed jumps (returns) being assumed to leave it dead, as they do in translated code.
+
+        Class Attributes:
+            CALL_WORDS (int): Size of a call to a subroutine.
+            RETURN_WORDS (int): Size of the return of a subroutine.
+            TAIL_WORDS (int): Size of a jump to a shared tail.
+            CALL_CYCLES (int): Extra cycles of a use of a subroutine (call and return).
+            TAIL_CYCLES (int): Extra cycles of a use of a shared tail.
+
+        Instances Attributes:
+            min_length, max_length (int): Lengths of the sequences considered.
+            link (str): The register holding the return address of subroutines.
+            target (int): Stop once the program is at most this many instructions (None: outline all).
+            max_cycles_per_word (float): Size-vs-speed knob (None: no limit).
+            profile (dict): Label -> execution count, or None for the static estimate.
+            stats (dict): Subroutines created, uses replaced, words saved, estimated extra cycles.
+    """
+
+    CALL_WORDS = 6
+    RETURN_WORDS = 3
+    TAIL_WORDS = 2
+    CALL_CYCLES = 9
+    TAIL_CYCLES = 2
+
+    def __init__(self, min_length: int = 6, max_length: int = 40, link: str = "R15", target: int = None,
+                 max_cycles_per_word: float = None, profile: dict = None):
+        self.min_length = min_length
+        self.max_length = max_length
+        self.link = link
+        self.target = target
+        self.max_cycles_per_word = max_cycles_per_word
+        self.profile = profile
+        self.labels = set()
+        self.stats = {"subroutines": 0, "uses": 0, "words_saved": 0, "extra_cycles": 0}
+
+    def optimize(self, lines) -> list:
+        """
+        Outlines the repeated sequences of an assembly program.
+
+        Args:
+            lines (Iterable[str]): The assembly source lines (comments and whitespace are allowed).
+
+        Returns:
+            list: The optimized instructions and labels, without comments.
+        """
+        instructions = preprocess(lines)
+        self.labels = {instruction[1:-1] for instruction in instructions if is_label(instruction)}
+        frequencies = JumpOptimizer(self.profile).frequencies(instructions)
+        stop, a_read, d_read = self.analyze(instructions)
+        candidates = self.candidates(instructions, stop, a_read, d_read, self.link_live(instructions))
+
+        # lazy greedy selection: the score of a candidate only gets worse as its windows get taken
+        size = sum(1 for instruction in instructions if not is_label(instruction))
+        used = bytearray(len(instructions))
+        heap = []
+        for i, (starts, length, tail) in enumerate(candidates):
+            score = self.score(starts, length, tail, frequencies)
+            if score is not None:
+                heap.append((-score[0], i))
+        heapq.heapify(heap)
+        outlined = {}   # start -> (subroutine number, length, tail)
+        subroutines = []
+        while heap and (self.target is None or size > self.target):
+            _, i = heapq.heappop(heap)
+            starts, length, tail = candidates[i]
+            starts = self.free_starts(starts, length, tail, used, a_read)
+            score = self.score(starts, length, tail, frequencies)
+            if score is None:
+                continue
+            if heap and score[0] < -heap[0][0]:
+                heapq.heappush(heap, (-score[0], i))
+                continue
+            priority, saving, cycles = score
+            number = len(subroutines)
+            subroutines.append((starts[0], length, tail))
+            for start in starts:
+                outlined[start] = (number, length, tail)
+                used[start:start + length] = b"\x01" * length
+            size -= saving
+            self.stats["subroutines"] += 1
+            self.stats["uses"] += len(starts)
+            self.stats["words_saved"] += saving
+            self.stats["extra_cycles"] += cycles
+        return self.emit(instructions, outlined, subroutines)
+
+    def analyze(self, instructions: list) -> tuple:
+        """
+        Computes, for each position:
+
+        - stop: the end of the longest window starting there (windows contain no label, and no jump
+          but a final unconditional one),
+        - a_read, d_read: the position of the first instruction reading A (resp. D) before writing
+          it, from there on (labels are transparent), or infinity.
+        """
+        n = len(instructions)
+        stop = [n] * (n + 1)
+        a_read = [math.inf] * (n + 1)
+        d_read = [math.inf] * (n + 1)
+        for i in range(n - 1, -1, -1):
+            instruction = instructions[i]
+            if is_label(instruction):
+                stop[i] = i
+                a_read[i], d_read[i] = a_read[i + 1], d_read[i + 1]
+                continue
+            if instruction[0] == "@":
+                stop[i] = stop[i + 1]
+                a_read[i], d_read[i] = math.inf, d_read[i + 1]
+                continue
+            dest, comp, jump = split_c_instruction(instruction)
+            if jump:
+                stop[i] = i + 1 if jump == "JMP" and not dest else i
+            else:
+                stop[i] = stop[i + 1]
+            reads_a = "A" in comp or "M" in comp or "M" in dest or bool(jump)
+            a_read[i] = i if reads_a else (math.inf if "A" in dest else a_read[i + 1])
+            # D may be read at the target of a jump
+            d_read[i] = i if "D" in comp or jump else (math.inf if "D" in dest else d_read[i + 1])
+        return stop, a_read, d_read
+
+    def link_live(self, instructions: list) -> list:
+        """Whether the link register may be read before being written, from each position on."""
+        link_address = Assembler.PRE_DEFINED_SYMBOLS.get(self.link)
+        positions = {instruction[1:-1]: i for i, instruction in enumerate(instructions) if is_label(instruction)}
+        n = len(instructions)
+        reads, writes, successors = [False] * n, [False] * n, [()] * n
+        a = None    # what the last A-instruction of the block loaded
+        for i, instruction in enumerate(instructions):
+            if is_label(instruction):
+                a = None
+                successors[i] = (i + 1,)
+                continue
+            if instruction[0] == "@":
+                a = instruction[1:]
+                successors[i] = (i + 1,)
+                continue
+            dest, comp, jump = split_c_instruction(instruction)
+            at_link = a in (self.link, str(link_address))
+            reads[i] = at_link and "M" in comp
+            writes[i] = at_link and "M" in dest and not reads[i]
+            targets = (positions[a],) if jump and a in positions else ()
+            successors[i] = targets if jump == "JMP" else targets + (i + 1,)
+            if "A" in dest:
+                a = None
+        live = [False] * (n + 1)
+        changed = True
+        while changed:
+            changed = False
+            for i in range(n - 1, -1, -1):
+                value = reads[i] or not writes[i] and any(live[j] for j in successors[i])
+                if value != live[i]:
+                    live[i] = value
+                    changed = True
+        return live
+
+    def candidates(self, instructions: list, stop: list, a_read: list, d_read: list, link_live: list) -> list:
+        """Hashes every valid window and returns the repeated ones as (starts, length, tail)."""
+        ids = {}
+        codes = [ids.setdefault(instruction, len(ids)) for instruction in instructions]
+        link_address = Assembler.PRE_DEFINED_SYMBOLS.get(self.link)
+        link_uses = [0]
+        for instruction in instructions:
+            link_uses.append(link_uses[-1] + (instruction in (f"@{self.link}", f"@{link_address}")))
+
+        candidates = []
+        for length in range(self.min_length, self.max_length + 1):
+            windows = {}
+            for start in range(len(instructions) - length + 1):
+                end = start + length
+                if end > stop[start] or link_uses[end] != link_uses[start] or a_read[start] < end:
+                    continue
+                tail = end == stop[start] and instructions[end - 1][0] != "@" and ";" in instructions[end - 1]
+                if not tail and (d_read[start] < end or link_live[start]):
+                    continue
+                windows.setdefault(tuple(codes[start:end]), []).append(start)
+            for starts in windows.values():
+                if len(starts) > 1:
+                    tail = ";" in instructions[starts[0] + length - 1]
+                    candidates.append((starts, length, tail))
+        return candidates
+
+    @staticmethod
+    def free_starts(starts: list, length: int, tail: bool, used: bytearray, a_read: list) -> list:
+        """The non-overlapping windows still free, A being dead after the use of a subroutine."""
+        free = []
+        end = -1
+        for start in starts:
+            if start < end or any(used[start:start + length]):
+                continue
+            if not tail and a_read[start + length] != math.inf:
+                continue
+            free.append(start)
+            end = start + length
+        return free
+
+    def score(self, starts: list, length: int, tail: bool, frequencies: list):
+        """Returns (priority, words saved, extra cycles) of outlining the windows, or None if it does not pay."""
+        if len(starts) < 2:
+            return None
+        if tail:
+            saving = len(starts) * (length - Outliner.TAIL_WORDS) - length
+            cycles = Outliner.TAIL_CYCLES * sum(frequencies[start] for start in starts)
+        else:
+            saving = len(starts) * (length - Outliner.CALL_WORDS) - length - Outliner.RETURN_WORDS
+            cycles = Outliner.CALL_CYCLES * sum(frequencies[start] for start in starts)
+        if saving <= 0 or (self.max_cycles_per_word is not None and cycles > self.max_cycles_per_word * saving):
+            return None
+        priority = -cycles / saving if self.target is not None else saving
+        return priority, saving, cycles
+
+    def fresh_label(self, name: str) -> str:
+        while name in self.labels:
+            name += "_"
+        self.labels.add(name)
+        return name
+
+    def emit(self, instructions: list, outlined: dict, subroutines: list) -> list:
+        """Replaces the outlined windows by their calls and appends the subroutines."""
+        if not subroutines:
+            return instructions
+        bodies = [self.fresh_label(f"$outline.{number}") for number in range(len(subroutines))]
+        output = []
+        returns = 0
+        i = 0
+        while i < len(instructions):
+            if i not in outlined:
+                output.append(instructions[i])
+                i += 1
+                continue
+            number, length, tail = outlined[i]
+            if tail:
+                output.extend([f"@{bodies[number]}", "0;JMP"])
+            else:
+                label = self.fresh_label(f"{bodies[number]}$ret.{returns}")
+                returns += 1
+                output.extend([f"@{label}", "D=A", f"@{self.link}", "M=D", f"@{bodies[number]}", "0;JMP",
+                               f"({label})"])
+            i += length
+
+        # the subroutines go after the program, which must not fall into them
+        last = next((instruction for instruction in reversed(output) if not is_label(instruction)), "")
+        if split_c_instruction(last)[2] != "JMP" or last[0] == "@":
+            end = self.fresh_label("$outline.end")
+            output.extend([f"({end})", f"@{end}", "0;JMP"])
+        for body, (start, length, tail) in zip(bodies, subroutines):
+            output.append(f"({body})")
+            output.extend(instructions[start:start + length])
+            if not tail:
+                output.extend([f"@{self.link}", "A=M", "0;JMP"])
+        return output
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Hack assembly peephole optimizer")
+    parser.add_argument('input_file', type=str, nargs="?",
+                        default=None, help="Path to the input .asm file")
+    parser.add_argument('--vm', action="store_true",
+                        help="The program comes from the VM translator: trust the VM memory mapping")
+    parser.add_argument('--jumps', action="store_true",
+                        help="Then thread the jumps and reorder the basic blocks")
+    parser.add_argument('--outline', action="store_true",
+                        help="Then outline the repeated instruction sequences into shared subroutines")
+    parser.add_argument('--target', type=int, default=None,
+                        help="With --outline: stop once the program has at most this many instructions")
+    parser.add_argument('--max-cycles-per-word', type=float, default=None,
+                        help="With --outline: largest number of extra cycles accepted per word saved")
+    parser.add_argument('--link', type=str, default="R15",
+                        help="With --outline: register holding the return address of subroutines")
+    parser.add_argument('--profile', type=str, default=None,
+                        help="With --outline or --jumps: JSON label -> execution count (see emulator.py --profile)")
+    parser.add_argument('--entry', type=str, nargs="*", default=[],
+                        help="With --jumps: labels to keep reachable besides the program start")
+    parser.add_argument('-o', '--output', type=str, default=None,
+                        help="Path of the optimized .asm file (default: <input>.opt.asm)")
+
+    args = parser.parse_args()
+
+    if args.input_file is None:
+        input_file = input("Enter the input hack assembly file path\n>")
+    else:
+        input_file = args.input_file
+    output = Path(args.output) if args.output else Path(input_file).with_suffix(".opt.asm")
+
+    with open(input_file, 'r') as file:
+        lines = file.readlines()
+    optimizer = PeepholeOptimizer(args.vm)
+    optimized = optimizer.optimize(lines)
+    profile = None
+    if args.profile:
+        with open(args.profile, 'r') as file:
+            profile = json.load(file)
+    if args.outline:
+        outliner = Outliner(link=args.link, target=args.target, max_cycles_per_word=args.max_cycles_per_word,
+                            profile=profile)
+        optimized = outliner.optimize(optimized)
+    if args.jumps:
+        jump_optimizer = JumpOptimizer(profile, args.entry)
+        optimized = jump_optimizer.optimize(optimized)
+    with open(output, 'w') as file:
+        file.writelines(format_program(optimized))
+
+    before = sum(1 for instruction in preprocess(lines) if not is_label(instruction))
+    after = sum(1 for instruction in optimized if not is_label(instruction))
+    print(f"{before} -> {after} instructions ({optimizer.removed} removed: "
+          + ", ".join(f"{rule} {count}" for rule, count in optimizer.stats.items()) + ")")
+    if args.outline:
+        print("outline: " + ", ".join(f"{stat} {count:g}" for stat, count in outliner.stats.items()))
+    if args.jumps:
+        print("jumps: " + ", ".join(f"{stat} {count}" for stat, count in jump_optimizer.stats.items()))
+        for label, (cycles_before, cycles_after) in jump_optimizer.loops.items():
+            print(f"  loop {label}: {cycles_before} -> {cycles_after} cycles per iteration "
+                  f"({cycles_before - cycles_after} saved)")
@@ -1,6 +1,20 @@
 import re
+import sys
+import json
+import mmap
+import time
 import argparse
+from array import array
 from pathlib import Path
+from typing import NamedTuple
+from concurrent.futures import ProcessPoolExecutor
+
+from size_report import SizeReport, check_rom_budget
+
+try:
+    import numpy as np
+except ImportError:     # optional dependency: only needed by the vectorized backend
+    np = None
 
 
 class Assembler:
@@ -20,6 +34,8 @@ class Assembler:
             JUMP (dict): A dictionary mapping jump mnemonics to their binary representations.
             LABEL_PATTERN (str): Regular expression pattern for detecting label symbols.
             SYMBOL_PATTERN (str): Regular expression pattern for detecting general symbols (without parenthesis).
+            WORD_TYPECODE (str): The array typecode of a packed ROM word (unsigned 16-bit).
+            OUTPUT_FORMATS (dict): Output file suffix of each supported output format.
 
         Instances Attributes:
             asm_source (list): List of lines from the input assembly file.
@@ -101,23 +117,48 @@ class Assembler:
     LABEL_PATTERN = r"^\([a-zA-Z$._:][a-zA-Z0-9$._:]*\)$"
     SYMBOL_PATTERN = r"^[a-zA-Z$._:][a-zA-Z0-9$._:]*$"
 
-    def __init__(self, source_file: str):
-        """Initializes the assembler with default values for instance variables."""
-        if not source_file.endswith(".asm"):
-            raise ValueError(f"The file {input_file} is not of type .asm")
-        filename = Path(input_file).stem
-        directory = Path(input_file).parent
-        output = directory / (filename + ".hack")
+    WORD_TYPECODE = "H"
+    OUTPUT_FORMATS = {
+        "hack": ".hack",    # text: one 16-character binary string per instruction
+        "hackb": ".hackb",  # packed: one little-endian uint16 per instruction
+    }
+
+    def __init__(self, source_file: str = None, output_format: str = "hack", optimizer=None):
+        """
+        Initializes the assembler with default values for instance variables.
+
+        If `source_file` is given, it is translated and the output file is written next to it.
+        Without it, no I/O is done and the instance can be driven method by method.
+        If `optimizer` is given (an `asm_optimizer.PeepholeOptimizer`), the preprocessed program goes
+        through it before the labels are resolved.
+        """
         self.asm_source = None
+        self.optimizer = optimizer
 
-        self.symbols = Assembler.PRE_DEFINED_SYMBOLS
+        # each assembler owns its symbol table: labels and variables must not leak between runs
+        self.symbols = dict(Assembler.PRE_DEFINED_SYMBOLS)
         self.preprocessed = []
+        self.line_numbers = []
         self.unlabeled = []
         self.translated = []
         self.next_variable = 16
+        self.source_file = source_file
+
+        if source_file is None:
+            return
+        if not source_file.endswith(".asm"):
+            raise ValueError(f"The file {source_file} is not of type .asm")
+        if output_format not in Assembler.OUTPUT_FORMATS:
+            raise ValueError(f"Unknown output format: {output_format}")
+        filename = Path(source_file).stem
+        directory = Path(source_file).parent
+        output = directory / (filename + Assembler.OUTPUT_FORMATS[output_format])
 
         self.translate(source_file)
-        self.write_hack_file(output)
+        if output_format == "hackb":
+            self.write_hackb_file(output)
+        else:
+            self.write_hack_file(output)
 
     def translate(self, source_file: str) -> None:
         """
@@ -126,15 +167,20 @@ class Assembler:
         This method performs the full translation process, which includes:
         1. Loading the assembly source code from the specified file.
         2. Preprocessing the source code to remove comments and whitespace.
-        3. Extracting and resolving labels into memory addresses.
-        4. Translating instructions into binary machine code.
+        3. Optimizing the program, if the assembler was given an optimizer.
+        4. Extracting and resolving labels into memory addresses.
+        5. Translating instructions into binary machine code.
 
         Args:
             source_file (str): The path to the input assembly file.
         """
 
+        self.source_file = source_file
         self.load_assembly_file(source_file)
         self.preprocessing()
+        if self.optimizer is not None:
+            self.preprocessed = self.optimizer.optimize(self.preprocessed)
+            self.line_numbers = [0] * len(self.preprocessed)     # the optimized program has no source lines
         self.get_labels()
         self.transcription()
 
@@ -150,14 +196,16 @@ class Assembler:
         Preprocesses the assembly source by removing comments, whitespace, and empty lines.
 
         Iterates through the lines of the assembly source, discards comments and trims
-        unnecessary whitespace. Stores the cleaned instructions in the `preprocessed` list.
+        unnecessary whitespace. Stores the cleaned instructions in the `preprocessed` list
+        and their (1-based) source line numbers in `line_numbers`.
         """
 
-        for line in self.asm_source:
+        for line_number, line in enumerate(self.asm_source, 1):
             cmd, *comments = line.split('//')
             instruction = cmd.strip()
             if instruction != "":
                 self.preprocessed.append(instruction)
+                self.line_numbers.append(line_number)
 
     @staticmethod
     def is_label(instruction: str) -> bool:
@@ -179,9 +227,13 @@ class Assembler:
 
         Labels are defined as instructions enclosed in parentheses, and they are stored in the
         `symbols` dictionary with their line numbers.
+
+        Raises:
+            SyntaxError: If a label is defined more than once.
         """
 
         line_number = -1
+        labels = set()
         for i in range(len(self.preprocessed)):
             instruction = self.preprocessed[i]
 
@@ -190,7 +242,11 @@ class Assembler:
                 line_number += 1
                 self.unlabeled.append(instruction)
             else:
-                self.add_symbol(instruction.strip('()'), line_number + 1)
+                label = instruction.strip('()')
+                if label in labels:
+                    raise SyntaxError(f"Label ({label}) is defined more than once")
+                labels.add(label)
+                self.add_symbol(label, line_number + 1)
 
     def add_symbol(self, symbol: str, reference: int) -> None:
         """Adds a symbol and its reference to the ´symbols´ dictionary."""
@@ -323,17 +379,670 @@ class Assembler:
             self.translated[-1] = self.translated[-1].strip()  # remove last \n
             file.writelines(self.translated)
 
+    def source_map(self):
+        """Builds the `SourceMap` of the translated program (ROM address -> source line and label)."""
+
+        source_map = SourceMap(Path(self.source_file).name if self.source_file else None)
+        for instruction, line_number in zip(self.preprocessed, self.line_numbers):
+            if Assembler.is_label(instruction):
+                source_map.add_label(instruction.strip('()'))
+            else:
+                source_map.add_instruction(line_number)
+        return source_map
+
+    def words(self) -> array:
+        """Returns the translated instructions as an array of unsigned 16-bit words."""
+
+        return Assembler.binary_to_words(self.translated)
+
+    def write_hackb_file(self, output_path: Path) -> None:
+        """Writes the translated instructions to a packed .hackb file (little-endian uint16 per word)."""
+
+        Assembler.write_words(self.words(), output_path)
+
+    @staticmethod
+    def binary_to_words(lines) -> array:
+        """
+        Packs lines of the text .hack format into an array of unsigned 16-bit words.
+
+        Args:
+            lines (Iterable[str]): 16-character binary strings, surrounding whitespace and empty lines are ignored.
+
+        Returns:
+            array: The packed words (typecode 'H').
+
+        Raises:
+            ValueError: If a line is not a 16-bit binary string.
+        """
+        words = array(Assembler.WORD_TYPECODE)
+        for line in lines:
+            line = line.strip()
+            if line == "":
+                continue
+            if len(line) != 16:
+                raise ValueError(f"Expected a 16-bit binary word but found: {line}")
+            words.append(int(line, 2))
+        return words
+
+    @staticmethod
+    def words_to_binary(words) -> list:
+        """Unpacks 16-bit words into the lines of the text .hack format (without line endings)."""
+
+        return [format(word, "016b") for word in words]
+
+    @staticmethod
+    def write_words(words, output_path: Path) -> None:
+        """Writes 16-bit words to a packed .hackb file, always little-endian whatever the host byte order."""
+
+        words = array(Assembler.WORD_TYPECODE, words)
+        if sys.byteorder != "little":
+            words.byteswap()
+        with open(output_path, 'wb') as file:
+            words.tofile(file)
+
+    @staticmethod
+    def load_hack_file(path: Path) -> array:
+        """Loads a text .hack file into an array of 16-bit words."""
+
+        with open(path, 'r') as file:
+            return Assembler.binary_to_words(file)
+
+    @staticmethod
+    def load_hackb_file(path: Path, rom=None) -> memoryview:
+        """
+        Loads a packed .hackb image without any per-word parsing.
+
+        The file is memory-mapped read-only and exposed as a memoryview of unsigned 16-bit words.
+        If a writable `rom` buffer is supplied (e.g. a bytearray or an array('H') sized for the ROM),
+        the image is copied into its beginning in a single block copy and a view on the loaded part
+        of `rom` is returned instead.
+
+        Args:
+            path (Path): The path of the .hackb file.
+            rom: Optional writable buffer receiving the image.
+
+        Returns:
+            memoryview: The ROM words (format 'H').
+
+        Raises:
+            ValueError: If the file size is not a whole number of words or the image does not fit in `rom`.
+        """
+        with open(path, 'rb') as file:
+            size = Path(path).stat().st_size
+            if size % 2:
+                raise ValueError(f"The file {path} is not a packed .hackb image (odd size: {size} bytes)")
+            image = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) if size else b""
+
+        if sys.byteorder != "little":
+            # the packed format is little-endian: fall back to a swapped copy on big-endian hosts
+            swapped = array(Assembler.WORD_TYPECODE, bytes(image))
+            swapped.byteswap()
+            image = swapped
+
+        if rom is None:
+            return memoryview(image).cast("B").cast(Assembler.WORD_TYPECODE)
+
+        target = memoryview(rom).cast("B")
+        if size > len(target):
+            raise ValueError(f"The image {path} ({size // 2} words) does not fit in the ROM buffer")
+        target[:size] = memoryview(image).cast("B")
+        return target[:size].cast(Assembler.WORD_TYPECODE)
+
+    @staticmethod
+    def convert(source: Path, destination: Path) -> None:
+        """Converts between the text (.hack) and packed (.hackb) formats, based on the file suffixes."""
+
+        source, destination = Path(source), Path(destination)
+        if source.suffix == ".hackb":
+            words = Assembler.load_hackb_file(source)
+        elif source.suffix == ".hack":
+            words = Assembler.load_hack_file(source)
+        else:
+            raise ValueError(f"The file {source} is not of type .hack or .hackb")
+
+        if destination.suffix == ".hackb":
+            Assembler.write_words(words, destination)
+        elif destination.suffix == ".hack":
+            with open(destination, 'w') as file:
+                file.write("\n".join(Assembler.words_to_binary(words)))
+        else:
+            raise ValueError(f"The file {destination} is not of type .hack or .hackb")
+
+
+class SourceMap:
+    """
+        Map from ROM addresses back to the assembly source, saved next to the program as a .hackmap file.
+
+        The file is JSON: the source file name, the source line of every ROM address (0 when unknown)
+        and the (label, address) definitions in source order. Loading it builds, for every address, the
+        index of the nearest label defined at or before it, so that lookups are O(1).
+
+        Instances Attributes:
+            source (str): Name of the assembly source file.
+            lines (array): Source line number of each ROM address.
+            labels (list): (label, address) of every label, in source order.
+            enclosing (array): Index in `labels` of the nearest enclosing label of each address (-1 if none).
+    """
+
+    SUFFIX = ".hackmap"
+
+    def __init__(self, source: str = None):
+        self.source = source
+        self.lines = array("L")
+        self.labels = []
+        self.enclosing = array("l")
+
+    def add_label(self, label: str) -> None:
+        """Defines a label at the next ROM address."""
+        self.labels.append((label, len(self.lines)))
+
+    def add_instruction(self, line_number: int) -> None:
+        """Maps the next ROM address to a source line; its enclosing label is the last label defined."""
+        self.lines.append(line_number)
+        self.enclosing.append(len(self.labels) - 1)
+
+    def line(self, address: int) -> int:
+        """Returns the source line of the instruction at `address` (0 if unknown)."""
+        return self.lines[address]
+
+    def label(self, address: int) -> str:
+        """Returns the nearest label defined at or before `address`, or None."""
+        index = self.enclosing[address]
+        return self.labels[index][0] if index >= 0 else None
+
+    def labels_at(self) -> dict:
+        """Returns ROM address -> labels defined at that address."""
+        labels = {}
+        for label, address in self.labels:
+            labels.setdefault(address, []).append(label)
+        return labels
+
+    def save(self, path: Path) -> None:
+        with open(path, 'w') as file:
+            json.dump({"source": self.source, "lines": self.lines.tolist(), "labels": self.labels}, file,
+                      separators=(",", ":"))
+
+    @staticmethod
+    def load(path: Path):
+        with open(path, 'r') as file:
+            content = json.load(file)
+        source_map = SourceMap(content["source"])
+        source_map.lines = array("L", content["lines"])
+        source_map.labels = [(label, address) for label, address in content["labels"]]
+        # nearest enclosing label of every address, computed once
+        enclosing = [-1] * len(source_map.lines)
+        index = -1
+        next_label = 0
+        for address in range(len(source_map.lines)):
+            while next_label < len(source_map.labels) and source_map.labels[next_label][1] <= address:
+                index = next_label
+                next_label += 1
+            enclosing[address] = index
+        source_map.enclosing = array("l", enclosing)
+        return source_map
+
+
+class StreamingAssembler:
+    """
+        Single-pass assembler streaming instructions from the source file to the output file.
+
+        Lines are read lazily and flow through a generator pipeline (read -> strip comments -> encode),
+        each instruction being written as soon as it is encoded. A symbol referenced before it is known
+        is written as a placeholder and its ROM address is recorded in a fixup table; at the end of the
+        source every fixup is patched in place in the output file, either with the label address
+        (forward reference) or with a newly allocated variable address. Variables are allocated in
+        order of first reference, so the output is identical to the two-pass `Assembler`.
+
+        Memory therefore only holds the symbol table and the fixups, whatever the size of the program.
+        As in the two-pass `Assembler`, a label may only be defined once.
+
+        Class Attributes:
+            LINE_WIDTH (dict): The width, in bytes, of one encoded instruction for each output format.
+
+        Instances Attributes:
+            symbols (dict): Symbol table, initialized with a copy of the pre-defined symbols.
+            fixups (dict): Unresolved symbol -> array of the ROM addresses referencing it.
+            next_variable (int): The next available variable number for undefined symbols.
+            address (int): The ROM address of the next instruction.
+    """
+
+    LINE_WIDTH = {
+        "hack": 17,     # 16 binary digits + line feed
+        "hackb": 2,     # one uint16
+    }
+
+    def __init__(self):
+        self.symbols = dict(Assembler.PRE_DEFINED_SYMBOLS)
+        self.labels = set()
+        self.fixups = {}
+        self.next_variable = 16
+        self.address = 0
+        self.c_words = {}
+
+    @staticmethod
+    def read_lines(filename: str):
+        """Lazily yields the lines of an assembly file."""
+        if not filename.endswith(".asm"):
+            raise ValueError(f"The file {filename} is not of type .asm")
+        with open(filename, 'r') as file:
+            yield from file
+
+    @staticmethod
+    def strip_comments(lines):
+        """Yields the instructions of `lines` without comments, whitespace and empty lines."""
+        for line in lines:
+            cmd, *comments = line.split('//')
+            instruction = cmd.strip()
+            if instruction != "":
+                yield instruction
+
+    def encode(self, instructions):
+        """
+        Encodes instructions into 16-bit words, consuming labels on the fly.
+
+        Symbols that are not known yet are yielded as 0 and their address is added to `fixups`.
+
+        Args:
+            instructions (Iterable[str]): Preprocessed instructions (see `strip_comments`).
+
+        Yields:
+            int: The encoded word of each instruction, in ROM order.
+
+        Raises:
+            SyntaxError: If an instruction is invalid or a label is defined twice.
+        """
+        for instruction in instructions:
+            if Assembler.is_label(instruction):
+                self.define_label(instruction.strip('()'))
+                continue
+            if instruction[0] == "@":
+                word = self.encode_a_instruction(instruction[1:])
+            else:
+                word = self.c_words.get(instruction)
+                if word is None:
+                    word = int(Assembler.decode_c_instruction(instruction), 2)
+                    self.c_words[instruction] = word
+            self.address += 1
+            yield word
+
+    def define_label(self, label: str) -> None:
+        """Binds a label to the address of the next instruction."""
+        if label in self.labels:
+            raise SyntaxError(f"Label ({label}) is defined more than once")
+        self.labels.add(label)
+        self.symbols[label] = self.address
+
+    def encode_a_instruction(self, value: str) -> int:
+        """Encodes the value of an A-instruction, recording a fixup if it is an unknown symbol."""
+        if Assembler.is_symbol(value):
+            number = self.symbols.get(value)
+            if number is None:
+                addresses = self.fixups.get(value)
+                if addresses is None:
+                    addresses = self.fixups[value] = array("L")
+                addresses.append(self.address)
+                return 0
+            return number
+        number = int(value)
+        if number >= 32768:
+            raise SyntaxError(f"A-instruction: @value with  0 <= value <= 32767 but found value {number}")
+        return number & 0xFFFF
+
+    def resolve_fixups(self):
+        """
+        Resolves the pending fixups once the whole source has been read.
+
+        Symbols are visited in order of first reference: labels defined after their first use get their
+        label address, every other symbol becomes a new variable.
+
+        Yields:
+            tuple: (ROM address, word) for each placeholder to patch.
+        """
+        for symbol, addresses in self.fixups.items():
+            if symbol not in self.symbols:
+                self.symbols[symbol] = self.next_variable
+                self.next_variable += 1
+            word = self.symbols[symbol]
+            for address in addresses:
+                yield address, word
+        self.fixups.clear()
+
+    def assemble_lines(self, lines) -> array:
+        """
+        Assembles source lines in memory.
+
+        Args:
+            lines (Iterable[str]): The lines of the assembly program.
+
+        Returns:
+            array: The encoded words (typecode 'H').
+        """
+        words = array(Assembler.WORD_TYPECODE, self.encode(self.strip_comments(lines)))
+        for address, word in self.resolve_fixups():
+            words[address] = word
+        return words
+
+    def assemble_file(self, source_file: str, output_path: Path, output_format: str = "hack") -> int:
+        """
+        Assembles `source_file` into `output_path` in a single streaming pass.
+
+        Args:
+            source_file (str): The path to the input assembly file.
+            output_path (Path): The path of the output file.
+            output_format (str): "hack" (text) or "hackb" (packed little-endian words).
+
+        Returns:
+            int: The number of instructions written.
+        """
+        if output_format not in StreamingAssembler.LINE_WIDTH:
+            raise ValueError(f"Unknown output format: {output_format}")
+        words = self.encode(self.strip_comments(self.read_lines(source_file)))
+        width = StreamingAssembler.LINE_WIDTH[output_format]
+        with open(output_path, 'wb') as file:
+            if output_format == "hackb":
+                self.write_packed(words, file)
+            else:
+                self.write_text(words, file)
+            # backpatching: placeholders have a fixed width in both formats
+            for address, word in self.resolve_fixups():
+                file.seek(width * address)
+                if output_format == "hackb":
+                    file.write(word.to_bytes(2, "little"))
+                else:
+                    file.write(format(word, "016b").encode("ascii"))
+        return self.address
+
+    @staticmethod
+    def write_text(words, file, chunk_size: int = 4096) -> None:
+        """Writes words in the text .hack format to a binary file, without a trailing line feed."""
+        lines = []
+        separator = b""
+        for word in words:
+            lines.append(format(word, "016b"))
+            if len(lines) == chunk_size:
+                file.write(separator + "\n".join(lines).encode("ascii"))
+                separator = b"\n"
+                lines.clear()
+        if lines:
+            file.write(separator + "\n".join(lines).encode("ascii"))
+
+    @staticmethod
+    def write_packed(words, file, chunk_size: int = 4096) -> None:
+        """Writes words in the packed little-endian format, buffering `chunk_size` words at a time."""
+        buffer = array(Assembler.WORD_TYPECODE)
+        for word in words:
+            buffer.append(word)
+            if len(buffer) == chunk_size:
+                StreamingAssembler.flush(buffer, file)
+        StreamingAssembler.flush(buffer, file)
+
+    @staticmethod
+    def flush(buffer: array, file) -> None:
+        if sys.byteorder != "little":
+            buffer.byteswap()
+        buffer.tofile(file)
+        del buffer[:]
+
+
+class VectorizedAssembler:
+    """
+        NumPy backend of the assembler, encoding a whole program with array operations.
+
+        Generated programs repeat the same few instructions over and over, so every distinct line is
+        classified and decoded only once; its dest/comp/jump field codes or A-value are
+        stored in integer arrays, the 16-bit words of the distinct lines are composed with array
+        operations and finally gathered back in program order. Label addresses come from a cumulative
+        sum over the instruction mask. The result is identical to the two-pass `Assembler`.
+
+        Requires NumPy (see `available`); `assemble(..., vectorized=True)` falls back to the pure
+        Python encoder when it is missing.
+
+        Class Attributes:
+            COMP_CODES, DEST_CODES, JUMP_CODES (dict): Binary field string -> integer field code.
+    """
+
+    COMP_CODES = {bits: int(bits, 2) for bits in Assembler.COMP.values()}
+    DEST_CODES = {bits: int(bits, 2) for bits in Assembler.DEST.values()}
+    JUMP_CODES = {bits: int(bits, 2) for bits in Assembler.JUMP.values()}
+
+    @staticmethod
+    def available() -> bool:
+        """Returns True if NumPy can be imported."""
+        return np is not None
+
+    @staticmethod
+    def assemble_lines(lines):
+        """
+        Assembles source lines into a numpy array of uint16 words.
+
+        Args:
+            lines (Iterable[str]): The lines of the assembly program.
+
+        Returns:
+            numpy.ndarray: The encoded words.
+
+        Raises:
+            SyntaxError: If an instruction is invalid or a label is defined twice.
+        """
+        # factorize the program: id of each line in the table of distinct lines (in order of first appearance)
+        distinct = {}
+        line_ids = array("l")
+        for line in lines:
+            instruction = line.partition('//')[0].strip()
+            if instruction != "":
+                line_ids.append(distinct.setdefault(instruction, len(distinct)))
+        if not distinct:
+            return np.zeros(0, dtype=np.uint16)
+        inverse = np.frombuffer(line_ids, dtype=np.dtype("l"))
+        distinct = list(distinct)
+
+        # classify every distinct line once
+        kind = np.zeros(len(distinct), dtype=np.uint8)     # 0: C-instruction, 1: A-instruction, 2: label
+        for i, instruction in enumerate(distinct):
+            if instruction[0] == "@":
+                kind[i] = 1
+            elif Assembler.is_label(instruction):
+                kind[i] = 2
+
+        # label addresses: number of instructions before the label line
+        is_label = kind[inverse] == 2
+        is_instruction = ~is_label
+        address = np.cumsum(is_instruction) - is_instruction
+        symbols = dict(Assembler.PRE_DEFINED_SYMBOLS)
+        label_lines = np.nonzero(is_label)[0]
+        labels = set()
+        for line, label_id in zip(label_lines.tolist(), inverse[label_lines].tolist()):
+            label = distinct[label_id][1:-1]
+            if label in labels:
+                raise SyntaxError(f"Label ({label}) is defined more than once")
+            labels.add(label)
+            symbols[label] = int(address[line])
+
+        words = np.zeros(len(distinct), dtype=np.uint16)
+
+        # A-instructions: distinct lines are in order of first appearance, hence variables in order of first reference
+        a_index = np.nonzero(kind == 1)[0]
+        next_variable = 16
+        a_values = np.zeros(len(a_index), dtype=np.int64)
+        for i, instruction in enumerate(distinct[j] for j in a_index.tolist()):
+            value = instruction[1:]
+            if Assembler.is_symbol(value):
+                if value not in symbols:
+                    symbols[value] = next_variable
+                    next_variable += 1
+                a_values[i] = symbols[value]
+            else:
+                number = int(value)
+                if number >= 32768:
+                    raise SyntaxError(f"A-instruction: @value with  0 <= value <= 32767 but found value {number}")
+                a_values[i] = number
+        words[a_index] = (a_values & 0xFFFF).astype(np.uint16)
+
+        # C-instructions: field codes, then 111 a c1..c6 d1d2d3 j1j2j3
+        c_index = np.nonzero(kind == 0)[0]
+        comp = np.zeros(len(c_index), dtype=np.uint16)
+        dest = np.zeros(len(c_index), dtype=np.uint16)
+        jump = np.zeros(len(c_index), dtype=np.uint16)
+        for i, instruction in enumerate(distinct[j] for j in c_index.tolist()):
+            fields = Assembler.decode_c_instruction(instruction)
+            comp[i] = VectorizedAssembler.COMP_CODES[fields[3:10]]
+            dest[i] = VectorizedAssembler.DEST_CODES[fields[10:13]]
+            jump[i] = VectorizedAssembler.JUMP_CODES[fields[13:16]]
+        words[c_index] = 0b111 << 13 | comp << 6 | dest << 3 | jump
+
+        return words[inverse[is_instruction]]
+
+    @staticmethod
+    def render_text(words) -> bytes:
+        """Renders uint16 words in the text .hack format (no trailing line feed), as a bytes object."""
+        words = np.asarray(words, dtype=np.uint16)
+        if len(words) == 0:
+            return b""
+        shifts = np.arange(15, -1, -1, dtype=np.uint16)
+        text = np.full((len(words), 17), ord("\n"), dtype=np.uint8)
+        text[:, :16] = ((words[:, None] >> shifts) & 1) + ord("0")
+        return text.tobytes()[:-1]
+
+
+class BatchResult(NamedTuple):
+    """Outcome of the assembly of one file by `assemble_batch`."""
+    source: str
+    output: str
+    instructions: int
+    seconds: float
+    error: str = None
+
+
+def assemble(source, vectorized: bool = False) -> array:
+    """
+    Assembles a Hack program in memory, without any file I/O.
+
+    Every call uses its own symbol table, so the function is reentrant and can be called repeatedly
+    (or from several threads) in a long-running process.
+
+    Args:
+        source (str | Iterable[str]): The program text, or an iterable of its lines.
+        vectorized (bool): Use the NumPy backend (`VectorizedAssembler`) when NumPy is installed.
+
+    Returns:
+        array: The encoded words (typecode 'H').
+
+    Raises:
+        SyntaxError: If the program is invalid.
+    """
+    if isinstance(source, str):
+        source = source.splitlines()
+    if vectorized and VectorizedAssembler.available():
+        words = array(Assembler.WORD_TYPECODE)
+        words.frombytes(VectorizedAssembler.assemble_lines(source).astype("=u2").tobytes())
+        return words
+    return StreamingAssembler().assemble_lines(source)
+
+
+def assemble_file_job(source_file: str, output_format: str = "hack") -> BatchResult:
+    """Assembles one file next to its source and times it (worker of `assemble_batch`)."""
+    output = str(Path(source_file).with_suffix(Assembler.OUTPUT_FORMATS[output_format]))
+    start = time.perf_counter()
+    try:
+        instructions = StreamingAssembler().assemble_file(source_file, output, output_format)
+    except (OSError, ValueError, SyntaxError) as error:
+        return BatchResult(source_file, output, 0, time.perf_counter() - start, f"{type(error).__name__}: {error}")
+    return BatchResult(source_file, output, instructions, time.perf_counter() - start)
+
+
+def assemble_batch(source_files, output_format: str = "hack", max_workers: int = None) -> list:
+    """
+    Assembles many .asm files in parallel over a process pool.
+
+    A failing file does not stop the batch: its error is reported in its result.
+
+    Args:
+        source_files (Iterable[str]): The paths of the .asm files.
+        output_format (str): "hack" (text) or "hackb" (packed little-endian words).
+        max_workers (int): Number of worker processes (defaults to the number of CPUs).
+
+    Returns:
+        list: One `BatchResult` per file, in the order of `source_files`.
+    """
+    source_files = [str(file) for file in source_files]
+    if output_format not in Assembler.OUTPUT_FORMATS:
+        raise ValueError(f"Unknown output format: {output_format}")
+    with ProcessPoolExecutor(max_workers=max_workers) as pool:
+        return list(pool.map(assemble_file_job, source_files, [output_format] * len(source_files)))
+
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Hack Assembler")
-    parser.add_argument('input_file', type=str, nargs="?",
-                        default=None, help="Path to the input .asm file")
+    parser.add_argument('input_files', type=str, nargs="*",
+                        help="Path to the input .asm file(s) or directories (several inputs are assembled in parallel)")
+    parser.add_argument('--format', dest="output_format", choices=Assembler.OUTPUT_FORMATS, default="hack",
+                        help="Output format: text .hack (default) or packed little-endian .hackb")
+    parser.add_argument('--streaming', action="store_true",
+                        help="Assemble in a single streaming pass (flat memory use on very large files)")
+    parser.add_argument('--vectorized', action="store_true",
+                        help="Encode with the NumPy backend (falls back to pure Python if NumPy is missing)")
+    parser.add_argument('--optimize', action="store_true",
+                        help="Run the peephole optimizer on the program before encoding it (two-pass assembler)")
+    parser.add_argument('--vm', action="store_true",
+                        help="With --optimize: the program comes from the VM translator, trust the VM memory mapping")
+    parser.add_argument('--map', action="store_true",
+                        help="Also write a .hackmap source map (ROM address -> source line and label)")
+    parser.add_argument('--jobs', type=int, default=None,
+                        help="Number of worker processes for batch assembly (default: number of CPUs)")
+    parser.add_argument('--budget', type=int, default=SizeReport.ROM_SIZE,
+                        help=f"Fail, without output file, if a program exceeds this ROM budget in words "
+                             f"(default: the {SizeReport.ROM_SIZE}-word ROM)")
 
     args = parser.parse_args()
 
-    if args.input_file is None:
-        input_file = input("Enter the input hack assembly file path\n>")
+    if not args.input_files:
+        input_files = [input("Enter the input hack assembly file path\n>")]
     else:
-        input_file = args.input_file
+        input_files = args.input_files
 
-    assembler = Assembler(input_file)
+    if len(input_files) == 1 and not Path(input_files[0]).is_dir():
+        input_file = input_files[0]
+        output = Path(input_file).with_suffix(Assembler.OUTPUT_FORMATS[args.output_format])
+        if args.streaming:
+            size = StreamingAssembler().assemble_file(input_file, output, args.output_format)
+        elif args.vectorized:
+            with open(input_file, 'r') as file:
+                words = assemble(file, vectorized=True)
+            size = len(words)
+            if args.output_format == "hackb":
+                Assembler.write_words(words, output)
+            else:
+                with open(output, 'w') as file:
+                    file.write("\n".join(Assembler.words_to_binary(words)))
+        else:
+            from asm_optimizer import PeepholeOptimizer     # it imports the tables of the assembler
+            optimizer = PeepholeOptimizer(args.vm) if args.optimize else None
+            assembler = Assembler(input_file, args.output_format, optimizer)
+            size = len(assembler.translated)
+            if args.map:
+                assembler.source_map().save(output.with_suffix(SourceMap.SUFFIX))
+            if optimizer is not None:
+                print(f"peephole optimizer: {optimizer.removed} instructions removed")
+        # the size report of the VM translator, if any, names the functions to blame
+        report_path = output.with_name(output.stem + SizeReport.SUFFIX)
+        try:
+            check_rom_budget(size, args.budget, SizeReport.load(report_path) if report_path.is_file() else None)
+        except OverflowError as error:
+            output.unlink()
+            sys.exit(f"error: {input_file}: {error}")
+    else:
+        sources = []
+        for path in map(Path, input_files):
+            sources.extend(sorted(path.glob('**/*.asm')) if path.is_dir() else [path])
+        total = time.perf_counter()
+        results = assemble_batch(sources, args.output_format, args.jobs)
+        for i, result in enumerate(results):
+            if not result.error and result.instructions > args.budget:
+                Path(result.output).unlink()
+                results[i] = result = result._replace(error=f"ROM budget exceeded: {result.instructions} words "
+                                                            f"> {args.budget}")
+            status = result.error if result.error else f"{result.instructions} instructions"
+            print(f"{result.source}: {status} in {result.seconds * 1000:.1f} ms")
+        print(f"{len(results)} files in {(time.perf_counter() - total) * 1000:.1f} ms")
+        if any(result.error for result in results):
+            sys.exit(1)
@@ -0,0 +1,146 @@
+"""
+Throughput and memory benchmark suite of the two-pass `Assembler`.
+
+Synthetic workloads (see `workloads.py`) are written to a temporary .asm file and assembled phase by
+phase: load, preprocessing, get_labels and transcription. Each phase is timed on its own (lines/s), then
+run again under tracemalloc to measure its peak memory. Results are written as JSON so that runs on
+different commits can be compared with --compare.
+
+Usage (from the repository root):
+    python benchmarks/bench_assembler.py [--sizes 10000 100000 1000000 5000000] [--workloads mixed labels]
+                                         [--output results.json] [--compare previous.json] [--no-memory]
+"""
+import gc
+import sys
+import json
+import time
+import argparse
+import platform
+import tempfile
+import subprocess
+import tracemalloc
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from assembler import Assembler
+from benchmarks.workloads import WORKLOADS
+
+
+PHASES = ["load", "preprocessing", "get_labels", "transcription"]
+DEFAULT_SIZES = [10_000, 100_000, 1_000_000, 5_000_000]
+
+
+def run_phases(source_file: str, measure_memory: bool) -> dict:
+    """Assembles `source_file` phase by phase, returning (seconds, peak bytes or None) per phase."""
+    assembler = Assembler()
+    steps = {
+        "load": lambda: assembler.load_assembly_file(source_file),
+        "preprocessing": assembler.preprocessing,
+        "get_labels": assembler.get_labels,
+        "transcription": assembler.transcription,
+    }
+    results = {}
+    for phase in PHASES:
+        gc.collect()
+        if measure_memory:
+            tracemalloc.start()
+            before = tracemalloc.get_traced_memory()[0]
+        start = time.perf_counter()
+        steps[phase]()
+        seconds = time.perf_counter() - start
+        peak = None
+        if measure_memory:
+            peak = tracemalloc.get_traced_memory()[1] - before
+            tracemalloc.stop()
+        results[phase] = (seconds, peak)
+    return results
+
+
+def benchmark(workload: str, size: int, measure_memory: bool, seed: int = 0) -> list:
+    lines = WORKLOADS[workload](size, seed)
+    with tempfile.TemporaryDirectory() as tmp:
+        source_file = str(Path(tmp) / f"{workload}.asm")
+        with open(source_file, 'w') as file:
+            file.write("\n".join(lines) + "\n")
+        del lines
+        timings = run_phases(source_file, False)
+        memory = run_phases(source_file, True) if measure_memory else {}
+
+    records = []
+    for phase in PHASES:
+        seconds = timings[phase][0]
+        records.append({
+            "workload": workload,
+            "lines": size,
+            "phase": phase,
+            "seconds": round(seconds, 6),
+            "lines_per_second": round(size / seconds) if seconds else None,
+            "peak_bytes": memory[phase][1] if measure_memory else None,
+        })
+    return records
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=Path(__file__).resolve().parent, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(previous: dict, current: dict) -> None:
+    """Prints the throughput and memory ratio of each measurement present in both runs."""
+    key = lambda record: (record["workload"], record["lines"], record["phase"])
+    old = {key(record): record for record in previous["results"]}
+    print(f"\ncompared with {previous.get('revision')} (ratio current / previous)")
+    for record in current["results"]:
+        before = old.get(key(record))
+        if before is None:
+            continue
+        speed = record["lines_per_second"] / before["lines_per_second"] \
+            if record["lines_per_second"] and before["lines_per_second"] else float("nan")
+        memory = record["peak_bytes"] / before["peak_bytes"] \
+            if record["peak_bytes"] and before["peak_bytes"] else float("nan")
+        print(f"{record['workload']:>15} {record['lines']:>9} {record['phase']:>14}  "
+              f"throughput x{speed:.2f}  memory x{memory:.2f}")
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description="Assembler throughput and memory benchmark suite")
+    arg_parser.add_argument('--sizes', type=int, nargs="+", default=DEFAULT_SIZES)
+    arg_parser.add_argument('--workloads', nargs="+", choices=WORKLOADS, default=list(WORKLOADS))
+    arg_parser.add_argument('--seed', type=int, default=0)
+    arg_parser.add_argument('--output', type=str, default=None, help="Path of the JSON results (default: stdout)")
+    arg_parser.add_argument('--compare', type=str, default=None, help="JSON results of a previous run")
+    arg_parser.add_argument('--no-memory', action="store_true", help="Skip the tracemalloc runs")
+    args = arg_parser.parse_args()
+
+    results = []
+    for workload in args.workloads:
+        for size in args.sizes:
+            for record in benchmark(workload, size, not args.no_memory, args.seed):
+                results.append(record)
+                peak = f"{record['peak_bytes'] / 2 ** 20:10.1f} MiB" if record["peak_bytes"] is not None else ""
+                print(f"{workload:>15} {size:>9} {record['phase']:>14} {record['seconds']:10.3f} s "
+                      f"{record['lines_per_second'] or 0:>12,} lines/s {peak}", file=sys.stderr)
+
+    report = {
+        "revision": git_revision(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "results": results,
+    }
+    if args.output is None:
+        print(json.dumps(report, indent=2))
+    else:
+        with open(args.output, 'w') as file:
+            json.dump(report, file, indent=2)
+
+    if args.compare is not None:
+        with open(args.compare, 'r') as file:
+            compare(json.load(file), report)
+
+
+if __name__ == "__main__":
+    main()
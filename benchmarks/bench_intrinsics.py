@@ -0,0 +1,73 @@
+"""
+Cycle benchmark of the intrinsics of the VM translator against the JACK_OS library calls.
+
+Each workload is a Sys.init looping over `Math.multiply`, `Math.divide` or `Memory.peek`/`Memory.poke`
+calls, linked with the JACK_OS (Sys.vm replaced). It is translated with the library calls, then with the
+intrinsics enabled, and run on the CPU emulator until it halts; the static variables must be the same.
+The `constant` workload multiplies by a constant, which the translator specializes into shift-adds.
+
+Usage (from the repository root):
+    python benchmarks/bench_intrinsics.py [--cache-top] [--workloads multiply divide]
+"""
+import sys
+import argparse
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from bench_vm_translator import run
+from VMTranslator import CodeWriter
+
+
+ROOT = Path(__file__).resolve().parent.parent
+
+# static 0: loop counter, static 1: accumulator
+LOOP = """function Sys.init 0
+call Memory.init 0
+pop temp 0
+call Math.init 0
+pop temp 0
+push constant 100
+pop static 0
+label LOOP
+{body}
+push static 0
+push constant 1
+sub
+pop static 0
+push static 0
+if-goto LOOP
+label END
+goto END
+"""
+
+WORKLOADS = {
+    "multiply": "push static 0\npush static 0\nneg\ncall Math.multiply 2\npush static 1\nadd\npop static 1",
+    "constant": "push static 0\npush constant 321\ncall Math.multiply 2\npush static 1\nadd\npop static 1",
+    "divide": "push constant 30000\npush static 0\nneg\ncall Math.divide 2\npush static 1\nadd\npop static 1",
+    "memory": "push static 0\npush constant 5000\nadd\npush static 0\ncall Memory.poke 2\npop temp 0\n"
+              "push static 0\npush constant 5000\nadd\ncall Memory.peek 1\npush static 1\nadd\npop static 1",
+}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="VM translator intrinsics benchmark")
+    parser.add_argument('--workloads', type=str, nargs="+", default=list(WORKLOADS), choices=list(WORKLOADS))
+    parser.add_argument('--cache-top', action="store_true", help="Translate both versions with top-of-stack caching")
+    parser.add_argument('--max-cycles', type=int, default=50_000_000)
+
+    args = parser.parse_args()
+
+    failures = 0
+    print(f"{'workload':<10} {'words':>15} {'cycles':>21}  speedup")
+    for name in args.workloads:
+        # the JACK_OS only fits the ROM with the compact calling convention
+        modes = {"compact": True, "cache_top": args.cache_top}
+        sources = [ROOT / "Compiler/JACK_OS", ("Sys.vm", LOOP.format(body=WORKLOADS[name]))]
+        library = run(sources, args.max_cycles, **modes)
+        inline = run(sources, args.max_cycles, intrinsics=list(CodeWriter.intrinsic_functions), **modes)
+        same = library["state"][0] == inline["state"][0]
+        failures += not same
+        print(f"{name:<10} {library['words']:>7}>{inline['words']:>7} {library['cycles']:>10}>{inline['cycles']:>10}"
+              f"  {library['cycles'] / inline['cycles']:6.1f}x  {'ok' if same else 'MISMATCH'}")
+    sys.exit(1 if failures else 0)
@@ -0,0 +1,99 @@
+"""
+Stack depth and cycle benchmark of the tail calls of the VM translator.
+
+Each workload is a recursive program in tail position: `sum` adds 1..n with an accumulator (a function
+calling itself), `parity` decides whether n is even with two functions calling each other. It is
+translated with the standard calls, then with `tail_calls`, and run on the CPU emulator until it halts,
+recording the highest stack pointer. The static variables must be the same. The Hack stack holds
+the RAM from 256 to 2047: the standard translation overflows it from a depth of about 220 frames.
+
+Usage (from the repository root):
+    python benchmarks/bench_tail_calls.py [--depth 1000] [--compact] [--cache-top]
+"""
+import sys
+import argparse
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from bench_vm_translator import run
+
+
+WORKLOADS = {
+    "sum": """function Sys.init 0
+push constant {depth}
+push constant 0
+call Main.sum 2
+pop static 0
+label END
+goto END
+function Main.sum 0
+push argument 0
+if-goto MORE
+push argument 1
+return
+label MORE
+push argument 0
+push constant 1
+sub
+push argument 1
+push argument 0
+add
+call Main.sum 2
+return
+""",
+    "parity": """function Sys.init 0
+push constant {depth}
+call Main.even 1
+pop static 0
+label END
+goto END
+function Main.even 0
+push argument 0
+if-goto MORE
+push constant 0
+not
+return
+label MORE
+push argument 0
+push constant 1
+sub
+call Main.odd 1
+return
+function Main.odd 0
+push argument 0
+if-goto MORE
+push constant 0
+return
+label MORE
+push argument 0
+push constant 1
+sub
+call Main.even 1
+return
+""",
+}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="VM translator tail calls benchmark")
+    parser.add_argument('--workloads', type=str, nargs="+", default=list(WORKLOADS), choices=list(WORKLOADS))
+    parser.add_argument('--depth', type=int, default=1000, help="Number of recursive calls")
+    parser.add_argument('--compact', action="store_true", help="Translate with the compact calling convention")
+    parser.add_argument('--cache-top', action="store_true", help="Translate with top-of-stack caching")
+    parser.add_argument('--max-cycles', type=int, default=50_000_000)
+
+    args = parser.parse_args()
+
+    failures = 0
+    print(f"{'workload':<10} {'highest SP':>15} {'cycles':>19}  reduction")
+    for name in args.workloads:
+        source = WORKLOADS[name].format(depth=args.depth)
+        modes = {"compact": args.compact, "cache_top": args.cache_top}
+        standard = run([source], args.max_cycles, **modes)
+        tail = run([source], args.max_cycles, tail_calls=True, **modes)
+        same = standard["state"][0] == tail["state"][0]
+        failures += not same
+        print(f"{name:<10} {standard['depth']:>7}>{tail['depth']:>7} {standard['cycles']:>9}>{tail['cycles']:>9}"
+              f"  {100 * (1 - tail['cycles'] / standard['cycles']):5.1f}%  {'ok' if same else 'MISMATCH'}")
+    sys.exit(1 if failures else 0)
@@ -0,0 +1,53 @@
+"""
+Benchmark of the NumPy assembler backend against the pure Python encoder.
+
+Usage (from the repository root):
+    python benchmarks/bench_vectorized_assembler.py [--instructions 1000000] [--seed 0]
+"""
+import sys
+import time
+import argparse
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from assembler import Assembler, VectorizedAssembler, assemble
+from benchmarks.workloads import mixed
+
+
+def timed(function, *args, **kwargs):
+    start = time.perf_counter()
+    result = function(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description="NumPy assembler backend benchmark")
+    arg_parser.add_argument('--instructions', type=int, default=1_000_000)
+    arg_parser.add_argument('--seed', type=int, default=0)
+    args = arg_parser.parse_args()
+
+    if not VectorizedAssembler.available():
+        sys.exit("NumPy is not installed: only the pure Python backend is available.")
+
+    lines = mixed(args.instructions, args.seed)
+    python_words, python_time = timed(assemble, lines)
+    numpy_words, numpy_time = timed(assemble, lines, vectorized=True)
+    if python_words != numpy_words:
+        sys.exit("The backends disagree.")
+
+    python_text, python_render = timed(lambda: "\n".join(Assembler.words_to_binary(python_words)).encode())
+    numpy_text, numpy_render = timed(VectorizedAssembler.render_text, numpy_words)
+    if python_text != numpy_text:
+        sys.exit("The text renderers disagree.")
+
+    n = len(python_words)
+    print(f"{n} instructions ({len(lines)} source lines)")
+    print(f"{'':8}{'encode (s)':>12}{'instr/s':>14}{'render (s)':>12}")
+    print(f"{'python':8}{python_time:12.3f}{n / python_time:14,.0f}{python_render:12.3f}")
+    print(f"{'numpy':8}{numpy_time:12.3f}{n / numpy_time:14,.0f}{numpy_render:12.3f}")
+    print(f"speedup: encode x{python_time / numpy_time:.1f}, render x{python_render / numpy_render:.1f}")
+
+
+if __name__ == "__main__":
+    main()
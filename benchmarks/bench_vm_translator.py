@@ -0,0 +1,109 @@
+"""
+Correctness harness and cycle benchmark of the top-of-stack caching mode of the VM translator.
+
+Every program is translated twice, with the standard templates and with `cache_top`, then run on the
+CPU emulator until it halts. The static variables (by name) and the virtual registers SP, LCL, ARG,
+THIS, THAT and temp must be the same; the ROM size and cycle count of both translations are reported.
+Programs: the VM test programs (`Arith` is an arithmetic-heavy loop) and the JACK_OS with a small
+Main class (which only fits the ROM with --compact).
+
+Usage (from the repository root):
+    python benchmarks/bench_vm_translator.py [--compact] [--shared-comparisons] [--programs Arith JACK_OS]
+"""
+import sys
+import shutil
+import argparse
+import tempfile
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from size_report import SizeReport
+from VMTranslator import VMTranslator
+from vm_runner import execute
+
+
+ROOT = Path(__file__).resolve().parent.parent
+
+MAIN = """
+function Main.main 0
+push constant 6
+push constant 7
+call Math.multiply 2
+pop static 0
+push constant 1000
+push constant 7
+call Math.divide 2
+pop static 1
+push constant 10000
+call Math.sqrt 1
+pop static 2
+label END
+goto END
+"""
+
+PROGRAMS = {
+    "Fib": [ROOT / "test_files/vm/Fib"],
+    "Loops": [ROOT / "test_files/vm/Loops"],
+    "Arith": [ROOT / "test_files/vm/Arith"],
+    "JACK_OS": [ROOT / "Compiler/JACK_OS", MAIN],
+}
+
+
+def build(sources: list, directory: Path) -> None:
+    """
+    Copies the .vm files of the source directories, and writes the source texts as Main.vm, in `directory`
+    (a (name, text) source is written as `name`, replacing a copied file).
+    """
+    directory.mkdir()
+    for source in sources:
+        if isinstance(source, Path):
+            for file in source.glob("*.vm"):
+                shutil.copy(file, directory)
+        elif isinstance(source, tuple):
+            (directory / source[0]).write_text(source[1])
+        else:
+            (directory / "Main.vm").write_text(source)
+
+
+def run(sources: list, max_cycles: int, **modes) -> dict:
+    """
+    Translates and runs a program, returning its size, cycles, highest stack pointer and observable state
+    (only its size if it does not fit the ROM).
+    """
+    report = SizeReport()
+    with tempfile.TemporaryDirectory() as tmp:
+        program = Path(tmp) / "Program"
+        build(sources, program)
+        VMTranslator(str(program), report=report, **modes)
+        lines = program.with_suffix(".asm").read_text().splitlines()
+    if report.total > SizeReport.ROM_SIZE:
+        return {"words": report.total}
+    emulator, statics, depth = execute(lines, max_cycles)
+    return {"words": len(emulator.rom), "cycles": emulator.cycles, "depth": depth,
+            "state": (statics, emulator.ram[:13].tolist())}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="VM translator top-of-stack caching harness")
+    parser.add_argument('--programs', type=str, nargs="+", default=list(PROGRAMS), choices=list(PROGRAMS))
+    parser.add_argument('--compact', action="store_true", help="Translate with the compact calling convention")
+    parser.add_argument('--shared-comparisons', action="store_true", help="Translate with the shared comparisons")
+    parser.add_argument('--max-cycles', type=int, default=50_000_000)
+
+    args = parser.parse_args()
+
+    failures = 0
+    print(f"{'program':<10} {'words':>15} {'cycles':>23}  reduction")
+    for name in args.programs:
+        modes = {"compact": args.compact, "shared_comparisons": args.shared_comparisons}
+        standard = run(PROGRAMS[name], args.max_cycles, **modes)
+        cached = run(PROGRAMS[name], args.max_cycles, cache_top=True, **modes)
+        if "cycles" not in standard or "cycles" not in cached:
+            print(f"{name:<10} {standard['words']:>7}>{cached['words']:>7}  does not fit the ROM (try --compact)")
+            continue
+        same = standard["state"] == cached["state"]
+        failures += not same
+        print(f"{name:<10} {standard['words']:>7}>{cached['words']:>7} {standard['cycles']:>11}>{cached['cycles']:>11}"
+              f"  {100 * (1 - cached['cycles'] / standard['cycles']):5.1f}%  {'ok' if same else 'MISMATCH'}")
+    sys.exit(1 if failures else 0)
@@ -0,0 +1,81 @@
+"""
+Synthetic Hack assembly workloads for the benchmarks.
+
+Every generator returns the lines (without line feeds) of a valid program of about `size` source lines.
+A-instructions only reference labels that are inside the 32K ROM.
+"""
+import random
+
+
+C_INSTRUCTIONS = ["D=M", "M=D", "D=A", "AM=M-1", "A=M-1", "M=M+1", "D=D+M", "M=D+M", "0;JMP", "D;JNE", "D;JEQ",
+                  "M=-1", "M=0", "D=M-D", "A=A-1", "AD=D+1", "MD=M+1"]
+ROM_SIZE = 32768
+
+
+def mixed(size: int, seed: int = 0) -> list:
+    """VM-translator-like program mixing labels, variables, constants and C-instructions."""
+    rng = random.Random(seed)
+    lines = []
+    n_labels = max(1, min(size, ROM_SIZE) // 50)
+    for i in range(size):
+        if i % 50 == 0:
+            lines.append(f"(LABEL_{i // 50})")
+        if i % 2 == 0:
+            choice = rng.random()
+            if choice < 0.4:
+                lines.append(f"@{rng.randrange(32768)}")
+            elif choice < 0.7:
+                lines.append(f"@var_{rng.randrange(200)}")
+            elif choice < 0.9:
+                lines.append(f"@LABEL_{rng.randrange(n_labels)}")
+            else:
+                lines.append(rng.choice(["@SP", "@LCL", "@ARG", "@THIS", "@THAT", "@R13"]))
+        else:
+            lines.append(rng.choice(C_INSTRUCTIONS) + "    // comment")
+    return lines
+
+
+def labels(size: int, seed: int = 0) -> list:
+    """One label every other line and a jump to a random label in between."""
+    rng = random.Random(seed)
+    lines = []
+    address = 0
+    n_labels = 0
+    while len(lines) < size:
+        lines.append(f"(L_{n_labels})")
+        if address < ROM_SIZE:
+            n_labels += 1
+        lines.append(f"@L_{rng.randrange(max(1, n_labels))}")
+        lines.append("D;JNE")
+        address += 2
+    return lines[:size]
+
+
+def variables(size: int, seed: int = 0) -> list:
+    """Stores to thousands of distinct variables."""
+    rng = random.Random(seed)
+    lines = []
+    for i in range(size // 2):
+        lines.append(f"@var_{rng.randrange(min(16000, size))}")
+        lines.append("M=D")
+    return lines
+
+
+def c_instructions(size: int, seed: int = 0) -> list:
+    """Almost only C-instructions, with comments and indentation."""
+    rng = random.Random(seed)
+    lines = []
+    for i in range(size):
+        if i % 16 == 0:
+            lines.append(f"    @{rng.randrange(32768)}")
+        else:
+            lines.append(f"    {rng.choice(C_INSTRUCTIONS)}  // comment {i}")
+    return lines
+
+
+WORKLOADS = {
+    "mixed": mixed,
+    "labels": labels,
+    "variables": variables,
+    "c_instructions": c_instructions,
+}
@@ -0,0 +1,103 @@
+import argparse
+from pathlib import Path
+
+from assembler import Assembler, SourceMap
+
+
+class Disassembler:
+    """
+        Disassembler for the Hack computer, decoding machine code back into canonical assembly.
+
+        C-instructions are decoded through reverse lookup tables of the assembler `COMP`, `DEST` and
+        `JUMP` tables, indexed by the integer value of each bit field and computed once.
+        Given the `SourceMap` written by the assembler, the labels are restored and every instruction
+        is annotated with its source line.
+
+        Class Attributes:
+            COMP (dict): Comp bits (a c1..c6) -> mnemonic.
+            DEST (dict): Dest bits -> mnemonic ("" when there is no destination).
+            JUMP (dict): Jump bits -> mnemonic ("" when there is no jump).
+    """
+
+    COMP = {int(bits, 2): mnemonic for mnemonic, bits in Assembler.COMP.items()}
+    DEST = {int(bits, 2): mnemonic or "" for mnemonic, bits in Assembler.DEST.items()}
+    JUMP = {int(bits, 2): mnemonic or "" for mnemonic, bits in Assembler.JUMP.items()}
+
+    @staticmethod
+    def decode(word: int) -> str:
+        """
+        Decodes one 16-bit word into an assembly instruction.
+
+        Raises:
+            ValueError: If the comp field of a C-instruction is not a Hack computation.
+        """
+        if not word & 0x8000:
+            return f"@{word}"
+        comp = Disassembler.COMP.get((word >> 6) & 0x7F)
+        if comp is None:
+            raise ValueError(f"Invalid C-instruction: {word:016b}")
+        dest = Disassembler.DEST[(word >> 3) & 0x7]
+        jump = Disassembler.JUMP[word & 0x7]
+        instruction = f"{dest}={comp}" if dest else comp
+        return f"{instruction};{jump}" if jump else instruction
+
+    @staticmethod
+    def disassemble(words, source_map: SourceMap = None) -> list:
+        """
+        Disassembles a program.
+
+        Args:
+            words (Iterable[int]): The ROM words.
+            source_map (SourceMap): Optional map restoring labels and source line comments.
+
+        Returns:
+            list: The assembly lines (without line feeds).
+        """
+        labels = source_map.labels_at() if source_map is not None else {}
+        lines = []
+        address = -1
+        for address, word in enumerate(words):
+            for label in labels.get(address, []):
+                lines.append(f"({label})")
+            instruction = Disassembler.decode(word)
+            if source_map is not None and source_map.line(address):
+                lines.append(f"    {instruction:<16}// {source_map.source}:{source_map.line(address)}")
+            else:
+                lines.append(f"    {instruction}")
+        for label in labels.get(address + 1, []):
+            lines.append(f"({label})")
+        return lines
+
+    @staticmethod
+    def load(path: Path):
+        """Loads a text (.hack) or packed (.hackb) program."""
+        path = Path(path)
+        if path.suffix == ".hackb":
+            return Assembler.load_hackb_file(path)
+        if path.suffix == ".hack":
+            return Assembler.load_hack_file(path)
+        raise ValueError(f"The file {path} is not of type .hack or .hackb")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Hack Disassembler")
+    parser.add_argument('input_file', type=str, nargs="?",
+                        default=None, help="Path to the input .hack or .hackb file")
+    parser.add_argument('--map', type=str, default=None,
+                        help="Source map written by the assembler (default: <input>.hackmap if it exists)")
+    parser.add_argument('-o', '--output', type=str, default=None,
+                        help="Path of the output .asm file (default: <input>.dis.asm)")
+
+    args = parser.parse_args()
+
+    if args.input_file is None:
+        input_file = input("Enter the input hack file path\n>")
+    else:
+        input_file = args.input_file
+
+    map_path = Path(args.map) if args.map else Path(input_file).with_suffix(SourceMap.SUFFIX)
+    source_map = SourceMap.load(map_path) if map_path.is_file() else None
+    output = Path(args.output) if args.output else Path(input_file).with_suffix(".dis.asm")
+
+    with open(output, 'w') as file:
+        file.write("\n".join(Disassembler.disassemble(Disassembler.load(input_file), source_map)) + "\n")
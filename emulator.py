@@ -0,0 +1,181 @@
+import json
+import argparse
+from array import array
+from pathlib import Path
+
+from assembler import Assembler, assemble
+
+
+class CPUEmulator:
+    """
+        Emulator of the Hack CPU, executing a ROM image and counting the executed cycles.
+
+        Every instruction takes one cycle. The ROM is decoded once before running: A-instructions into
+        their value, C-instructions into (comp, dest, jump) bit fields evaluated by a bitwise model of
+        the Hack ALU.
+
+        The program is considered halted when it reaches the conventional end loop (an A-instruction
+        loading its own address followed by an unconditional jump) or runs past the end of the ROM.
+
+        Class Attributes:
+            RAM_SIZE (int): Number of 16-bit words of RAM (data memory + screen + keyboard).
+
+        Instances Attributes:
+            rom (array): The program words.
+            ram (array): The data memory.
+            a, d, pc (int): The registers.
+            cycles (int): Number of instructions executed so far.
+    """
+
+    RAM_SIZE = 24577
+
+    def __init__(self, rom):
+        self.rom = array(Assembler.WORD_TYPECODE, rom)
+        self.ram = array(Assembler.WORD_TYPECODE, [0] * CPUEmulator.RAM_SIZE)
+        self.a = 0
+        self.d = 0
+        self.pc = 0
+        self.cycles = 0
+        self.decoded = [CPUEmulator.decode(word) for word in self.rom]
+
+    @staticmethod
+    def from_source(source):
+        """Assembles Hack assembly source (text or lines) and returns an emulator loaded with it."""
+        return CPUEmulator(assemble(source))
+
+    @staticmethod
+    def decode(word: int) -> tuple:
+        """Decodes a word into (None, value) for an A-instruction or (comp, dest, jump) for a C-instruction."""
+        if not word & 0x8000:
+            return None, word
+        return (word >> 6) & 0x7F, (word >> 3) & 0x7, word & 0x7
+
+    @staticmethod
+    def alu(x: int, y: int, control: int) -> int:
+        """Hack ALU: control holds the bits zx nx zy ny f no."""
+        if control & 0b100000:
+            x = 0
+        if control & 0b010000:
+            x = ~x & 0xFFFF
+        if control & 0b001000:
+            y = 0
+        if control & 0b000100:
+            y = ~y & 0xFFFF
+        out = (x + y) & 0xFFFF if control & 0b000010 else x & y
+        if control & 0b000001:
+            out = ~out & 0xFFFF
+        return out
+
+    @staticmethod
+    def jumps(out: int, jump: int) -> bool:
+        negative = out & 0x8000
+        return bool((jump & 0b100 and negative) or (jump & 0b010 and out == 0)
+                    or (jump & 0b001 and not negative and out != 0))
+
+    def halted(self) -> bool:
+        """Checks for the end of the program (past the ROM or in the `(END) @END 0;JMP` loop)."""
+        if self.pc >= len(self.decoded):
+            return True
+        comp, dest = self.decoded[self.pc][:2]
+        return comp is None and dest == self.pc and self.pc + 1 < len(self.decoded) \
+            and self.decoded[self.pc + 1] == (0b0101010, 0, 0b111)
+
+    def step(self) -> None:
+        """Executes one instruction."""
+        instruction = self.decoded[self.pc]
+        self.cycles += 1
+        if instruction[0] is None:
+            self.a = instruction[1]
+            self.pc += 1
+            return
+        comp, dest, jump = instruction
+        address = self.a
+        y = self.ram[address] if comp & 0b1000000 else self.a
+        out = CPUEmulator.alu(self.d, y, comp & 0b111111)
+        if dest & 0b001:
+            self.ram[address] = out
+        if dest & 0b010:
+            self.d = out
+        if dest & 0b100:
+            self.a = out
+        if jump and CPUEmulator.jumps(out, jump):
+            self.pc = address
+        else:
+            self.pc += 1
+
+    def run(self, max_cycles: int = 10_000_000) -> int:
+        """
+        Runs the program until it halts.
+
+        Args:
+            max_cycles (int): Safety limit on the number of executed instructions.
+
+        Returns:
+            int: The total number of cycles executed.
+
+        Raises:
+            RuntimeError: If the program did not halt within `max_cycles` cycles.
+        """
+        limit = self.cycles + max_cycles
+        while not self.halted():
+            if self.cycles >= limit:
+                raise RuntimeError(f"The program did not halt within {max_cycles} cycles (pc={self.pc})")
+            self.step()
+        return self.cycles
+
+    def profile(self, max_cycles: int = 10_000_000) -> array:
+        """
+        Runs the program until it halts, counting the executions of each instruction.
+
+        Returns:
+            array: The execution count of each ROM address.
+        """
+        hits = array("L", [0] * len(self.rom))
+        limit = self.cycles + max_cycles
+        while not self.halted():
+            if self.cycles >= limit:
+                raise RuntimeError(f"The program did not halt within {max_cycles} cycles (pc={self.pc})")
+            hits[self.pc] += 1
+            self.step()
+        return hits
+
+    def signed(self, address: int) -> int:
+        """Returns RAM[address] as a signed 16-bit integer."""
+        value = self.ram[address]
+        return value - 0x10000 if value & 0x8000 else value
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Hack CPU Emulator")
+    parser.add_argument('input_file', type=str, help="Path to the .asm, .hack or .hackb program")
+    parser.add_argument('--max-cycles', type=int, default=10_000_000)
+    parser.add_argument('--dump', type=int, nargs="*", default=[0, 1, 2, 3, 4],
+                        help="RAM addresses to print after the run")
+    parser.add_argument('--profile', type=str, default=None,
+                        help="With an .asm program: write the execution count of each label to this JSON file "
+                             "(input of the jump optimizer --profile)")
+
+    args = parser.parse_args()
+
+    path = Path(args.input_file)
+    labels = []
+    if path.suffix == ".asm":
+        assembler = Assembler()
+        assembler.translate(str(path))
+        labels = assembler.source_map().labels
+        emulator = CPUEmulator(assembler.words())
+    elif path.suffix == ".hackb":
+        emulator = CPUEmulator(Assembler.load_hackb_file(path))
+    else:
+        emulator = CPUEmulator(Assembler.load_hack_file(path))
+
+    if args.profile:
+        hits = emulator.profile(args.max_cycles)
+        cycles = emulator.cycles
+        with open(args.profile, 'w') as file:
+            json.dump({label: hits[address] for label, address in labels if address < len(hits)}, file, indent=1)
+    else:
+        cycles = emulator.run(args.max_cycles)
+    print(f"halted after {cycles} cycles")
+    for address in args.dump:
+        print(f"RAM[{address}] = {emulator.signed(address)}")
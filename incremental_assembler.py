@@ -0,0 +1,384 @@
+import pickle
+import argparse
+from array import array
+from bisect import bisect_left
+from pathlib import Path
+from typing import NamedTuple
+
+from assembler import Assembler, StreamingAssembler
+
+
+class ReassemblyResult(NamedTuple):
+    """Summary of one run of `IncrementalAssembler.assemble`."""
+    full: bool              # True if the whole program was (re)assembled
+    changed_lines: int      # number of source lines re-read in the edited region
+    encoded: int            # number of instructions encoded in the edited region
+    shift: int              # change of the instruction count (addresses after the edit move by `shift`)
+    patched: int            # number of instructions outside the edited region fixed up
+
+
+class IncrementalAssembler:
+    """
+        Assembler reusing the result of its previous run to reassemble an edited .asm file.
+
+        The state of the last run is kept in a sidecar cache next to the output file: the source
+        lines, the address of the first instruction of every line, the encoded words, the symbol table
+        and, for every symbol, the sorted addresses of the A-instructions referencing it.
+
+        On the next run the new source is compared with the cached one: only the lines between the
+        common prefix and the common suffix are preprocessed and encoded again. If the instruction
+        count changed, the words after the edit are moved and the labels defined after it shift, in
+        which case only the A-instructions referencing the moved labels are fixed up. The labels and
+        the symbolic A-instructions are also kept in address order, so that an edit only visits the
+        ones of the edited region and of the part of the program after it. Variables are re-allocated
+        (in order of first reference) only if the edit changes the set of variables or the first
+        reference of one of them, and only the references of the variables whose address actually
+        changed are patched.
+
+        The output file is patched in place when the instruction count did not change. The result is
+        identical to assembling the new source from scratch.
+
+        Class Attributes:
+            CACHE_VERSION (int): Version of the cache layout, a cache of another version is ignored.
+            CACHE_SUFFIX (str): Suffix appended to the output file name to get the cache path.
+
+        Instances Attributes:
+            lines (list): The source lines of the last run.
+            line_address (array): Address of the first instruction at or after each line (plus the end address).
+            words (array): The encoded words.
+            labels (dict): Label -> ROM address.
+            label_addresses, label_names (array, list): The labels in address order (then source order).
+            variables (dict): Variable -> RAM address, in allocation order.
+            references (dict): Symbol -> sorted array of the addresses of the A-instructions referencing it.
+            reference_addresses, reference_symbols (array, list): The symbolic A-instructions in address order.
+    """
+
+    CACHE_VERSION = 2
+    CACHE_SUFFIX = ".asmcache"
+
+    def __init__(self):
+        self.lines = []
+        self.line_address = array("L", [0])
+        self.words = array(Assembler.WORD_TYPECODE)
+        self.labels = {}
+        self.label_addresses = array("L")
+        self.label_names = []
+        self.variables = {}
+        self.references = {}
+        self.reference_addresses = array("L")
+        self.reference_symbols = []
+        self.c_words = {}
+
+    @staticmethod
+    def cache_path(output_path: Path) -> Path:
+        output_path = Path(output_path)
+        return output_path.with_name(output_path.name + IncrementalAssembler.CACHE_SUFFIX)
+
+    @staticmethod
+    def load(output_path: Path):
+        """Returns the assembler saved by the previous run for `output_path`, or None if there is no usable cache."""
+        try:
+            with open(IncrementalAssembler.cache_path(output_path), 'rb') as file:
+                version, state = pickle.load(file)
+        except (OSError, EOFError, pickle.UnpicklingError, ValueError, TypeError):
+            return None
+        if version != IncrementalAssembler.CACHE_VERSION:
+            return None
+        assembler = IncrementalAssembler()
+        assembler.__dict__.update(state)
+        return assembler
+
+    def save(self, output_path: Path) -> None:
+        """Writes the state of the assembler to the sidecar cache of `output_path`."""
+        state = {key: value for key, value in self.__dict__.items() if key != "c_words"}
+        with open(IncrementalAssembler.cache_path(output_path), 'wb') as file:
+            pickle.dump((IncrementalAssembler.CACHE_VERSION, state), file, protocol=pickle.HIGHEST_PROTOCOL)
+
+    def value(self, symbol: str) -> int:
+        """Resolves a symbol: labels shadow pre-defined symbols, anything else is a variable."""
+        if symbol in self.labels:
+            return self.labels[symbol]
+        if symbol in Assembler.PRE_DEFINED_SYMBOLS:
+            return Assembler.PRE_DEFINED_SYMBOLS[symbol]
+        return self.variables[symbol]
+
+    def update(self, lines: list) -> tuple:
+        """
+        Updates the state to the new source `lines`, re-encoding only the edited region.
+
+        Args:
+            lines (list): The new source lines.
+
+        Returns:
+            tuple: (start, end, old_end, shift, patched) where lines[start:end] replaced the cached
+                   lines[start:old_end], `shift` is the change of the instruction count and `patched`
+                   the set of addresses outside the edited region whose word changed.
+
+        Raises:
+            SyntaxError: If an instruction is invalid or a label is defined twice.
+        """
+        old = self.lines
+        limit = min(len(old), len(lines))
+        start = 0
+        while start < limit and old[start] == lines[start]:
+            start += 1
+        common_end = 0
+        while common_end < limit - start and old[-1 - common_end] == lines[-1 - common_end]:
+            common_end += 1
+        old_end = len(old) - common_end
+        end = len(lines) - common_end
+        region_start = self.line_address[start]
+        region_end = self.line_address[old_end]
+
+        previous = {}       # symbol -> value before the update, for every symbol whose value may change
+        touched = set()     # symbols referenced in the old or the new region
+        first_in_region = set()     # symbols whose first reference was in the old region
+
+        # 1. forget the old region: its labels and its references
+        region_labels = set()
+        for instruction in StreamingAssembler.strip_comments(old[start:old_end]):
+            if Assembler.is_label(instruction):
+                label = instruction.strip('()')
+                previous[label] = self.labels.pop(label)
+                region_labels.add(label)
+            elif instruction[0] == "@" and Assembler.is_symbol(instruction[1:]):
+                touched.add(instruction[1:])
+        for symbol in touched:
+            references = self.references[symbol]
+            first = bisect_left(references, region_start)
+            if first == 0 and references and references[0] < region_end:
+                first_in_region.add(symbol)
+            del references[first:bisect_left(references, region_end)]
+        # the labels of the old region follow the labels defined right before it, at the same address
+        label_first = bisect_left(self.label_addresses, region_start) + self.prefix_labels(start)
+        label_last = label_first + len(region_labels)
+        reference_first = bisect_left(self.reference_addresses, region_start)
+        reference_last = bisect_left(self.reference_addresses, region_end)
+
+        # 2. encode the new region
+        region_words = array(Assembler.WORD_TYPECODE)
+        region_address = array("L")
+        new_labels, new_label_addresses = [], array("L")
+        new_symbols, new_reference_addresses = [], array("L")
+        region_references = {}
+        address = region_start
+        for line in lines[start:end]:
+            region_address.append(address)
+            instruction = line.split('//')[0].strip()
+            if instruction == "":
+                continue
+            if Assembler.is_label(instruction):
+                label = instruction.strip('()')
+                if label in self.labels:
+                    raise SyntaxError(f"Label ({label}) is defined more than once")
+                previous.setdefault(label, Assembler.PRE_DEFINED_SYMBOLS.get(label, self.variables.get(label)))
+                self.labels[label] = address
+                new_labels.append(label)
+                new_label_addresses.append(address)
+                continue
+            if instruction[0] == "@":
+                value = instruction[1:]
+                if Assembler.is_symbol(value):
+                    new_symbols.append(value)
+                    new_reference_addresses.append(address)
+                    region_references.setdefault(value, array("L")).append(address)
+                    region_words.append(0)
+                else:
+                    number = int(value)
+                    if number >= 32768:
+                        raise SyntaxError(f"A-instruction: @value with  0 <= value <= 32767 but found value {number}")
+                    region_words.append(number & 0xFFFF)
+            else:
+                word = self.c_words.get(instruction)
+                if word is None:
+                    word = self.c_words[instruction] = int(Assembler.decode_c_instruction(instruction), 2)
+                region_words.append(word)
+            address += 1
+        region_stop = address
+        shift = region_stop - region_end
+
+        # 3. move the labels and references after the region, then put the region in their place
+        if shift:
+            for i in range(label_last, len(self.label_names)):
+                label = self.label_names[i]
+                previous.setdefault(label, self.label_addresses[i])
+                self.labels[label] = self.label_addresses[i] + shift
+            for symbol in set(self.reference_symbols[reference_last:]):
+                references = self.references[symbol]
+                first = bisect_left(references, region_end)
+                references[first:] = array("L", map(shift.__add__, references[first:]))
+            new_label_addresses.extend(map(shift.__add__, self.label_addresses[label_last:]))
+            new_reference_addresses.extend(map(shift.__add__, self.reference_addresses[reference_last:]))
+            self.label_addresses[label_first:] = new_label_addresses
+            self.reference_addresses[reference_first:] = new_reference_addresses
+            self.line_address[old_end:] = array("L", map(shift.__add__, self.line_address[old_end:]))
+        else:
+            self.label_addresses[label_first:label_last] = new_label_addresses
+            self.reference_addresses[reference_first:reference_last] = new_reference_addresses
+        self.label_names[label_first:label_last] = new_labels
+        self.reference_symbols[reference_first:reference_last] = new_symbols
+        self.line_address[start:old_end] = region_address
+        self.words[region_start:region_end] = region_words
+
+        for symbol, addresses in region_references.items():
+            references = self.references.setdefault(symbol, array("L"))
+            position = bisect_left(references, region_start)
+            references[position:position] = addresses
+            touched.add(symbol)
+        for symbol in touched:
+            if not self.references[symbol]:
+                del self.references[symbol]
+
+        # 4. re-allocate the variables if their set or the first reference of one of them changed
+        if any(self.reallocates(symbol, symbol in first_in_region, region_start, region_stop)
+               for symbol in touched.union(region_labels, new_labels)):
+            for symbol, address in self.variables.items():
+                previous.setdefault(symbol, address)
+            variables = [symbol for symbol in self.references
+                         if symbol not in self.labels and symbol not in Assembler.PRE_DEFINED_SYMBOLS]
+            variables.sort(key=lambda symbol: self.references[symbol][0])
+            self.variables = {symbol: 16 + i for i, symbol in enumerate(variables)}
+
+        # 5. resolve: the references of the region, then every symbol whose value changed
+        for symbol, addresses in region_references.items():
+            word = self.value(symbol) & 0xFFFF
+            for reference in addresses:
+                self.words[reference] = word
+        patched = set()
+        for symbol, before in previous.items():
+            if symbol in self.references and before != self.value(symbol):
+                word = self.value(symbol) & 0xFFFF
+                for reference in self.references[symbol]:
+                    self.words[reference] = word
+                    if not region_start <= reference < region_stop:
+                        patched.add(reference)
+
+        self.lines = lines
+        return start, end, old_end, shift, patched
+
+    def prefix_labels(self, start: int) -> int:
+        """The number of labels defined on the lines right before line `start`, which share its address."""
+        count = 0
+        for i in range(start - 1, -1, -1):
+            instruction = self.lines[i].split('//')[0].strip()
+            if instruction == "":
+                continue
+            if not Assembler.is_label(instruction):
+                break
+            count += 1
+        return count
+
+    def reallocates(self, symbol: str, first_in_region: bool, region_start: int, region_stop: int) -> bool:
+        """
+        Tells whether the variables must be re-allocated after an edit touching `symbol`: it became or
+        stopped being a variable, or its first reference was or is in the edited region.
+        """
+        variable = symbol in self.references and symbol not in self.labels \
+            and symbol not in Assembler.PRE_DEFINED_SYMBOLS
+        if variable != (symbol in self.variables):
+            return True
+        return variable and (first_in_region or region_start <= self.references[symbol][0] < region_stop)
+
+    def assemble(self, source_file: str, output_path: Path, output_format: str = "hack") -> ReassemblyResult:
+        """
+        Assembles `source_file` into `output_path`, incrementally if this instance holds a previous run.
+
+        Args:
+            source_file (str): The path to the input assembly file.
+            output_path (Path): The path of the output file.
+            output_format (str): "hack" (text) or "hackb" (packed little-endian words).
+
+        Returns:
+            ReassemblyResult: What was re-encoded and patched.
+        """
+        if output_format not in Assembler.OUTPUT_FORMATS:
+            raise ValueError(f"Unknown output format: {output_format}")
+        output_path = Path(output_path)
+        width = StreamingAssembler.LINE_WIDTH[output_format]
+        full = not self.output_matches(output_path, width)
+
+        with open(source_file, 'r') as file:
+            lines = file.readlines()
+        start, end, old_end, shift, patched = self.update(lines)
+        region_start = self.line_address[start]
+        region_stop = self.line_address[end]
+
+        if full:
+            self.write_all(output_path, output_format)
+        elif shift == 0:
+            with open(output_path, 'r+b') as file:
+                for address in sorted(patched.union(range(region_start, region_stop))):
+                    file.seek(width * address)
+                    file.write(self.encode_word(self.words[address], output_format))
+        elif output_format == "hackb":
+            self.write_all(output_path, output_format)
+        else:
+            # splice the text of the region into the old text, then fix up the moved references
+            with open(output_path, 'rb') as file:
+                text = bytearray(file.read())
+            text += b"\n"
+            region = b"".join(self.encode_word(word, output_format) + b"\n"
+                              for word in self.words[region_start:region_stop])
+            text[width * region_start:width * (region_stop - shift)] = region
+            for address in patched:
+                text[width * address:width * address + 16] = self.encode_word(self.words[address], output_format)
+            with open(output_path, 'wb') as file:
+                file.write(text[:-1])
+        return ReassemblyResult(full, end - start, region_stop - region_start, shift, len(patched))
+
+    def output_matches(self, output_path: Path, width: int) -> bool:
+        """Checks that the output file still has the size of the cached program."""
+        if not self.words or not output_path.is_file():
+            return False
+        expected = width * len(self.words) - (1 if width == StreamingAssembler.LINE_WIDTH["hack"] else 0)
+        return output_path.stat().st_size == expected
+
+    @staticmethod
+    def encode_word(word: int, output_format: str) -> bytes:
+        if output_format == "hackb":
+            return word.to_bytes(2, "little")
+        return format(word, "016b").encode("ascii")
+
+    def write_all(self, output_path: Path, output_format: str) -> None:
+        if output_format == "hackb":
+            Assembler.write_words(self.words, output_path)
+        else:
+            with open(output_path, 'w') as file:
+                file.write("\n".join(Assembler.words_to_binary(self.words)))
+
+
+def reassemble(source_file: str, output_format: str = "hack") -> ReassemblyResult:
+    """
+    Assembles `source_file` next to itself, reusing and refreshing the sidecar cache of the previous run.
+
+    A source that fails to assemble invalidates the cache, so the next run starts from scratch.
+    """
+    output = Path(source_file).with_suffix(Assembler.OUTPUT_FORMATS[output_format])
+    assembler = IncrementalAssembler.load(output) or IncrementalAssembler()
+    try:
+        result = assembler.assemble(source_file, output, output_format)
+    except (SyntaxError, ValueError):
+        IncrementalAssembler.cache_path(output).unlink(missing_ok=True)
+        raise
+    assembler.save(output)
+    return result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Incremental Hack Assembler")
+    parser.add_argument('input_file', type=str, nargs="?",
+                        default=None, help="Path to the input .asm file")
+    parser.add_argument('--format', dest="output_format", choices=Assembler.OUTPUT_FORMATS, default="hack",
+                        help="Output format: text .hack (default) or packed little-endian .hackb")
+
+    args = parser.parse_args()
+
+    if args.input_file is None:
+        input_file = input("Enter the input hack assembly file path\n>")
+    else:
+        input_file = args.input_file
+
+    result = reassemble(input_file, args.output_format)
+    mode = "full assembly" if result.full else "incremental"
+    print(f"{mode}: {result.changed_lines} lines re-read, {result.encoded} instructions encoded, "
+          f"{result.patched} fixed up, addresses shifted by {result.shift}")
@@ -0,0 +1,243 @@
+import re
+import sys
+import json
+import argparse
+from array import array
+from pathlib import Path
+
+from assembler import Assembler, StreamingAssembler
+
+
+class HackObject:
+    """
+        Relocatable object: a piece of program assembled independently of its final ROM address.
+
+        Words referencing a label of the object hold its address relative to the start of the object
+        (local relocations, rebased by the linker). Words referencing a symbol the object does not
+        define hold 0 (external relocations, resolved by the linker to a label exported by another
+        object, a pre-defined symbol or a variable).
+
+        File layout (.hobj): the magic line, a JSON header line (exports, external symbols and section
+        sizes), then the little-endian sections: words (uint16), local relocation addresses (uint32),
+        external relocations as (address, symbol index) pairs (uint32).
+
+        Class Attributes:
+            MAGIC (bytes): First line of an object file.
+            SUFFIX (str): Suffix of object files.
+
+        Instances Attributes:
+            words (array): The encoded words.
+            exports (dict): Exported label -> address relative to the object.
+            externals (list): The symbols referenced but not defined by the object, in order of first reference.
+            local_relocations (array): Addresses of the words holding an object-relative label address.
+            external_relocations (array): Flat (address, index in `externals`) pairs.
+    """
+
+    MAGIC = b"HACKOBJ 1\n"
+    SUFFIX = ".hobj"
+
+    def __init__(self):
+        self.words = array(Assembler.WORD_TYPECODE)
+        self.exports = {}
+        self.externals = []
+        self.local_relocations = array("I")
+        self.external_relocations = array("I")
+
+    def save(self, path: Path) -> None:
+        header = {
+            "exports": self.exports,
+            "externals": self.externals,
+            "words": len(self.words),
+            "local_relocations": len(self.local_relocations),
+            "external_relocations": len(self.external_relocations) // 2,
+        }
+        with open(path, 'wb') as file:
+            file.write(HackObject.MAGIC)
+            file.write(json.dumps(header, separators=(",", ":")).encode() + b"\n")
+            for section in (self.words, self.local_relocations, self.external_relocations):
+                if sys.byteorder != "little":
+                    section = array(section.typecode, section)
+                    section.byteswap()
+                section.tofile(file)
+
+    @staticmethod
+    def load(path: Path):
+        with open(path, 'rb') as file:
+            if file.readline() != HackObject.MAGIC:
+                raise ValueError(f"The file {path} is not a Hack object file")
+            header = json.loads(file.readline())
+            hack_object = HackObject()
+            hack_object.exports = header["exports"]
+            hack_object.externals = header["externals"]
+            sections = (
+                (hack_object.words, header["words"]),
+                (hack_object.local_relocations, header["local_relocations"]),
+                (hack_object.external_relocations, 2 * header["external_relocations"]),
+            )
+            for section, length in sections:
+                section.fromfile(file, length)
+                if sys.byteorder != "little":
+                    section.byteswap()
+        return hack_object
+
+
+class ObjectAssembler(StreamingAssembler):
+    """
+        Assembler producing a relocatable `HackObject` instead of a ROM image.
+
+        Every symbolic A-instruction is left unresolved while streaming; at the end, references to a
+        label of the source become local relocations and the other symbols external relocations
+        (pre-defined symbols included, so that a label of another object may shadow them as in a
+        monolithic assembly). Labels matching `exports` are exported, the others stay local to the
+        object, so that generated labels (e.g. `INSTRUCTION_END_0`) of separately built objects do not
+        collide.
+
+        Class Attributes:
+            EXPORT_ALL (str): Pattern exporting every label.
+            EXPORT_FUNCTIONS (str): Pattern exporting only VM function entry points (`Class.function`)
+                and the shared routines of the VM translator (`$CALL`, `$RETURN`, `$EQ`, `$GT`, `$LT`,
+                `$MULTIPLY`, `$DIVIDE`, `$TAILCALL`).
+    """
+
+    EXPORT_ALL = r".*"
+    EXPORT_FUNCTIONS = (r"^([A-Za-z_][A-Za-z0-9_]*\.[A-Za-z_][A-Za-z0-9_]*"
+                        r"|\$CALL|\$RETURN|\$EQ|\$GT|\$LT|\$MULTIPLY|\$DIVIDE|\$TAILCALL)$")
+
+    def __init__(self, exports: str = EXPORT_ALL):
+        super().__init__()
+        self.exports = re.compile(exports)
+
+    def encode_a_instruction(self, value: str) -> int:
+        if Assembler.is_symbol(value):
+            addresses = self.fixups.get(value)
+            if addresses is None:
+                addresses = self.fixups[value] = array("L")
+            addresses.append(self.address)
+            return 0
+        return super().encode_a_instruction(value)
+
+    def assemble_object(self, lines) -> HackObject:
+        """
+        Assembles source lines into a relocatable object.
+
+        Args:
+            lines (Iterable[str]): The lines of the assembly program.
+
+        Returns:
+            HackObject: The object.
+        """
+        hack_object = HackObject()
+        hack_object.words = array(Assembler.WORD_TYPECODE, self.encode(self.strip_comments(lines)))
+        for symbol, addresses in self.fixups.items():
+            if symbol in self.labels:
+                for address in addresses:
+                    hack_object.words[address] = self.symbols[symbol]
+                hack_object.local_relocations.extend(addresses.tolist())
+            else:
+                index = len(hack_object.externals)
+                hack_object.externals.append(symbol)
+                for address in addresses:
+                    hack_object.external_relocations.extend((address, index))
+        hack_object.local_relocations = array("I", sorted(hack_object.local_relocations))
+        hack_object.exports = {label: self.symbols[label] for label in sorted(self.labels)
+                               if self.exports.match(label)}
+        self.fixups.clear()
+        return hack_object
+
+
+class Linker:
+    """
+        Linker merging relocatable objects into a ROM image.
+
+        Objects are laid out in the given order from address 0 (the first object must therefore hold
+        the bootstrap code). Local relocations are rebased on the address of their object; external
+        symbols are resolved, in order, to an exported label, a pre-defined symbol, or a variable,
+        variables being allocated from address 16 in order of first reference.
+
+        Instances Attributes:
+            labels (dict): Exported label -> ROM address.
+            variables (dict): Variable -> RAM address.
+            bases (list): ROM address of each object.
+    """
+
+    def __init__(self):
+        self.labels = {}
+        self.variables = {}
+        self.bases = []
+
+    def link(self, objects) -> array:
+        """
+        Links objects into ROM words.
+
+        Args:
+            objects (Iterable[HackObject]): The objects, in ROM order.
+
+        Returns:
+            array: The ROM words (typecode 'H').
+
+        Raises:
+            ValueError: If two objects export the same label.
+        """
+        objects = list(objects)
+        rom = array(Assembler.WORD_TYPECODE)
+        for hack_object in objects:
+            base = len(rom)
+            self.bases.append(base)
+            for label, address in hack_object.exports.items():
+                if label in self.labels:
+                    raise ValueError(f"Label ({label}) is exported by more than one object")
+                self.labels[label] = base + address
+            rom.extend(hack_object.words)
+
+        for base, hack_object in zip(self.bases, objects):
+            for address in hack_object.local_relocations:
+                rom[base + address] += base
+            values = [self.resolve(symbol) & 0xFFFF for symbol in hack_object.externals]
+            relocations = hack_object.external_relocations
+            for i in range(0, len(relocations), 2):
+                rom[base + relocations[i]] = values[relocations[i + 1]]
+        return rom
+
+    def resolve(self, symbol: str) -> int:
+        if symbol in self.labels:
+            return self.labels[symbol]
+        if symbol in Assembler.PRE_DEFINED_SYMBOLS:
+            return Assembler.PRE_DEFINED_SYMBOLS[symbol]
+        if symbol not in self.variables:
+            self.variables[symbol] = 16 + len(self.variables)
+        return self.variables[symbol]
+
+
+def compile_object(source_file: str, exports: str = ObjectAssembler.EXPORT_ALL) -> HackObject:
+    """Assembles an .asm file into a relocatable object."""
+    with open(source_file, 'r') as file:
+        return ObjectAssembler(exports).assemble_object(file)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Hack object assembler and linker")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    compile_parser = commands.add_parser("compile", help="Assemble an .asm file into a relocatable .hobj object")
+    compile_parser.add_argument('input_file', type=str, help="Path to the input .asm file")
+    compile_parser.add_argument('-o', '--output', type=str, default=None, help="Object path (default: <input>.hobj)")
+    compile_parser.add_argument('--vm', action="store_true",
+                                help="Only export VM function labels (Class.function), keep the other labels local")
+
+    link_parser = commands.add_parser("link", help="Link .hobj objects into a program")
+    link_parser.add_argument('objects', type=str, nargs="+", help="Objects, in ROM order (bootstrap first)")
+    link_parser.add_argument('-o', '--output', type=str, required=True, help="Path of the .hack or .hackb program")
+
+    args = parser.parse_args()
+
+    if args.command == "compile":
+        output = Path(args.output) if args.output else Path(args.input_file).with_suffix(HackObject.SUFFIX)
+        exports = ObjectAssembler.EXPORT_FUNCTIONS if args.vm else ObjectAssembler.EXPORT_ALL
+        compile_object(args.input_file, exports).save(output)
+    else:
+        rom = Linker().link(HackObject.load(path) for path in args.objects)
+        if Path(args.output).suffix == ".hackb":
+            Assembler.write_words(rom, args.output)
+        else:
+            with open(args.output, 'w') as file:
+                file.write("\n".join(Assembler.words_to_binary(rom)))
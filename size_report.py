@@ -0,0 +1,130 @@
+import json
+import argparse
+from pathlib import Path
+
+
+class SizeReport:
+    """
+        ROM size accounting of a translated program.
+
+        Every instruction emitted by the VM translator is attributed to the source file, the VM function
+        and the kind of VM command it comes from (`push constant`, `pop local`, `call`, `return`,
+        `comparison`, ...), so that the bloat report tells which functions and which commands fill the
+        ROM.
+
+        Class Attributes:
+            ROM_SIZE (int): Number of words of the Hack ROM, the default budget.
+            SUFFIX (str): Suffix of saved reports, written next to the .asm file.
+            BOOTSTRAP (str): File and function name of the bootstrap code.
+
+        Instances Attributes:
+            words (dict): (file, function, kind) -> number of instructions.
+    """
+
+    ROM_SIZE = 32768
+    SUFFIX = ".size.json"
+    BOOTSTRAP = "(bootstrap)"
+
+    def __init__(self):
+        self.words = {}
+
+    @property
+    def total(self) -> int:
+        return sum(self.words.values())
+
+    def add(self, file: str, function: str, kind: str, words: int) -> None:
+        if words:
+            key = (file, function, kind)
+            self.words[key] = self.words.get(key, 0) + words
+
+    def by(self, field: str) -> list:
+        """
+        Totals per file, function or kind.
+
+        Args:
+            field (str): "file", "function" or "kind".
+
+        Returns:
+            list: (name, words) pairs, largest first.
+        """
+        position = ("file", "function", "kind").index(field)
+        totals = {}
+        for key, words in self.words.items():
+            totals[key[position]] = totals.get(key[position], 0) + words
+        return sorted(totals.items(), key=lambda item: (-item[1], item[0]))
+
+    def format(self, top: int = 20, budget: int = ROM_SIZE) -> str:
+        """Formats the bloat report: the total against the budget and the largest functions, kinds and files."""
+        total = self.total
+        lines = [f"ROM size: {total} / {budget} words ({100 * total / budget:.1f}% of the budget)"]
+        files = {function: file for file, function, _ in self.words}
+        for field in ("function", "kind", "file"):
+            rows = self.by(field)
+            lines.append("")
+            lines.append(f"by {field} ({len(rows)}):")
+            for name, words in rows[:top]:
+                origin = f" ({files[name]})" if field == "function" else ""
+                lines.append(f"  {words:>7}  {100 * words / max(total, 1):5.1f}%  {name}{origin}")
+            if len(rows) > top:
+                rest = sum(words for _, words in rows[top:])
+                lines.append(f"  {rest:>7}  {100 * rest / max(total, 1):5.1f}%  ... {len(rows) - top} more")
+        return "\n".join(lines)
+
+    def check(self, budget: int = ROM_SIZE) -> None:
+        """
+        Checks the program against a ROM budget.
+
+        Raises:
+            OverflowError: If the program does not fit, naming the largest functions.
+        """
+        check_rom_budget(self.total, budget, self)
+
+    def save(self, path: Path) -> None:
+        with open(path, 'w') as file:
+            json.dump({"total": self.total, "words": [[*key, words] for key, words in sorted(self.words.items())]},
+                      file, indent=1)
+
+    @staticmethod
+    def load(path: Path):
+        report = SizeReport()
+        with open(path, 'r') as file:
+            for file_name, function, kind, words in json.load(file)["words"]:
+                report.add(file_name, function, kind, words)
+        return report
+
+
+def check_rom_budget(words: int, budget: int = SizeReport.ROM_SIZE, report: SizeReport = None) -> None:
+    """
+    Checks the size of an assembled program against a ROM budget.
+
+    Args:
+        words (int): Number of words of the program.
+        budget (int): The budget.
+        report (SizeReport): Optional size report of the program, used to name the largest functions.
+
+    Raises:
+        OverflowError: If the program does not fit.
+    """
+    if words <= budget:
+        return
+    message = f"ROM budget exceeded: {words} words > {budget} (+{words - budget})"
+    if report is not None:
+        largest = ", ".join(f"{name} ({count})" for name, count in report.by("function")[:5])
+        message += f"; largest functions: {largest}"
+    raise OverflowError(message)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Hack ROM size report")
+    parser.add_argument('report', type=str, help=f"Path to a {SizeReport.SUFFIX} report written by the VM translator")
+    parser.add_argument('--budget', type=int, default=SizeReport.ROM_SIZE, help="ROM budget in words")
+    parser.add_argument('--top', type=int, default=20, help="Number of rows per section")
+
+    args = parser.parse_args()
+
+    size_report = SizeReport.load(args.report)
+    print(size_report.format(args.top, args.budget))
+    try:
+        size_report.check(args.budget)
+    except OverflowError as error:
+        parser.exit(1, f"error: {error}\n")
@@ -0,0 +1,472 @@
+from VMTranslator import VMTranslator, CodeWriter
+from vm_optimizer import VMOptimizer
+from size_report import SizeReport
+from assembler import StreamingAssembler
+from emulator import CPUEmulator
+from vm_runner import execute, run
+from array import array
+from pathlib import Path
+import re
+import shutil
+import tempfile
+import unittest
+
+
+LOCALS = """function Sys.init 0
+push constant 7
+call Main.sum 1
+pop static 0
+label HALT
+goto HALT
+function Main.sum 5
+push argument 0
+pop local 4
+push local 0
+push local 3
+add
+push local 4
+add
+return
+"""
+
+
+class TestCompactCalls(unittest.TestCase):
+
+    def test_same_behavior(self):
+        for directory in ("test_files/vm/Loops", "test_files/vm/Fib"):
+            reference, statics, _ = run(directory)
+            compact, compact_statics, _ = run(directory, compact=True)
+            self.assertEqual(statics, compact_statics, msg=f"test_same_behavior_statics_{directory}")
+            self.assertEqual(reference.ram[:5].tolist(), compact.ram[:5].tolist(), msg=f"test_same_behavior_ram_{directory}")
+            self.assertLess(len(compact.rom), len(reference.rom), msg=f"test_same_behavior_size_{directory}")
+
+    def test_locals(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            program = Path(tmp) / "Locals"
+            program.mkdir()
+            (program / "Sys.vm").write_text(LOCALS)
+            for compact in (False, True):
+                VMTranslator(str(program), compact=compact)
+                text = program.with_suffix(".asm").read_text()
+                emulator = CPUEmulator.from_source(text)
+                # dirty stack: the locals must be zeroed
+                emulator.ram[256:300] = array("H", [5] * 44)
+                emulator.run()
+                self.assertEqual(7, emulator.ram[16], msg=f"test_locals0_{compact}")
+                self.assertEqual(compact, "($locals.Main.sum)" in text, msg=f"test_locals1_{compact}")
+                self.assertEqual(compact, f"({CodeWriter.return_routine})" in text, msg=f"test_locals2_{compact}")
+
+
+class TestSharedComparisons(unittest.TestCase):
+
+    def test_same_behavior(self):
+        for directory in ("test_files/vm/Loops", "test_files/vm/Fib"):
+            reference, statics, _ = run(directory)
+            shared, shared_statics, _ = run(directory, shared_comparisons=True)
+            self.assertEqual(statics, shared_statics, msg=f"test_same_behavior_statics_{directory}")
+            self.assertGreater(shared.cycles, reference.cycles, msg=f"test_same_behavior_cycles_{directory}")
+
+    def test_size(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            program = Path(tmp) / "Math"
+            program.mkdir()
+            shutil.copy("Compiler/JACK_OS/Math.vm", program)
+            sizes = {}
+            for shared in (False, True):
+                translator = VMTranslator(str(program), bootstrap=False, shared_comparisons=shared)
+                text = program.with_suffix(".asm").read_text()
+                sizes[shared] = CodeWriter.count_instructions(text.splitlines())
+                self.assertNotIn("($EQ)", text, msg=f"test_size0_{shared}")
+            # the sites return to labels numbered as the return addresses of calls
+            self.assertNotIn("INSTRUCTION_END", text, msg="test_size1")
+        sites = translator.code_writer.comparisons
+        costs = CodeWriter.comparison_costs()
+        inline_words, shared_words = costs["inline"]["eq"][0], costs["shared"]["eq"][0]
+        self.assertGreater(sites, 0, msg="test_size2")
+        self.assertEqual((inline_words - shared_words) * sites, sizes[False] - sizes[True], msg="test_size3")
+        self.assertIn(f"comparisons: {sites} sites", translator.code_writer.comparison_report(), msg="test_size4")
+        # $LT falls through to the false path, the other routines jump to it
+        self.assertEqual({"eq": (4, 17, 22), "gt": (4, 17, 22), "lt": (4, 17, 20)}, costs["shared"], msg="test_size5")
+        self.assertEqual(40, costs["routines"], msg="test_size6")
+
+
+class TestTopOfStackCache(unittest.TestCase):
+
+    def test_templates(self):
+        writer = CodeWriter("Test", Path("."), cache_top=True)
+        writer.set_curr_filename("Test")
+        writer.write_push("constant", 2)
+        writer.write_push("local", 1)
+        writer.write_arithmetic("add")
+        writer.write_arithmetic("neg")
+        writer.write_pop("static", 3)
+        writer.write_push("argument", 0)
+        writer.write_label("L")
+        lines = [line.strip() for line in "".join(writer.output).splitlines()
+                 if line.strip() and not line.strip().startswith("//")]
+        self.assertEqual(["@2", "D=A",
+                          "@SP", "M=M+1", "A=M-1", "M=D", "@LCL", "A=M+1", "D=M",
+                          "@SP", "AM=M-1", "D=D+M",
+                          "D=-D",
+                          "@Test.3", "M=D",
+                          "@ARG", "A=M", "D=M",
+                          "@SP", "M=M+1", "A=M-1", "M=D", "(..$L)"], lines, msg="test_templates0")
+        self.assertFalse(writer.top_in_d, msg="test_templates1")
+
+    def test_same_behavior(self):
+        for directory in ("test_files/vm/Arith", "test_files/vm/Loops", "test_files/vm/Fib"):
+            for compact, shared in ((False, False), (True, True)):
+                reference, statics, _ = run(directory, compact=compact, shared_comparisons=shared)
+                cached, cached_statics, _ = run(directory, compact=compact, shared_comparisons=shared, cache_top=True)
+                self.assertEqual(statics, cached_statics, msg=f"test_same_behavior_statics_{directory}_{compact}")
+                self.assertEqual(reference.ram[:13].tolist(), cached.ram[:13].tolist(),
+                                 msg=f"test_same_behavior_ram_{directory}_{compact}")
+                self.assertLess(len(cached.rom), len(reference.rom), msg=f"test_same_behavior_size_{directory}_{compact}")
+                self.assertLess(cached.cycles, reference.cycles, msg=f"test_same_behavior_cycles_{directory}_{compact}")
+        self.assertEqual({"Sys.0": -29598, "Sys.1": 4088, "Sys.2": 150}, run("test_files/vm/Arith")[1],
+                         msg="test_same_behavior_arith")
+
+
+class TestFusedBranches(unittest.TestCase):
+
+    def test_templates(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            program = Path(tmp) / "Program"
+            program.mkdir()
+            (program / "Main.vm").write_text("function Main.f 0\nlabel LOOP\npush argument 0\npush constant 10\nlt\n"
+                                             "not\nif-goto END\ngoto LOOP\nlabel END\npush argument 0\n"
+                                             "push argument 1\nsub\nif-goto LOOP\npush constant 0\nreturn\n")
+            for cache_top in (False, True):
+                VMTranslator(str(program), bootstrap=False, cache_top=cache_top, fuse_branches=True)
+                code = program.with_suffix(".asm").read_text()
+                self.assertNotIn("INSTRUCTION_END", code, msg=f"test_templates0_{cache_top}")
+                self.assertNotIn("M=-1", code, msg=f"test_templates1_{cache_top}")
+                self.assertEqual(2, code.count("D=M-D"), msg=f"test_templates2_{cache_top}")
+                self.assertIn("@Main.f$END\n    D;JGE", code, msg=f"test_templates3_{cache_top}")
+                self.assertIn("@Main.f$LOOP\n    D;JNE", code, msg=f"test_templates4_{cache_top}")
+
+    def test_same_behavior(self):
+        for directory in ("test_files/vm/Arith", "test_files/vm/Loops", "test_files/vm/Fib"):
+            for cache_top in (False, True):
+                reference, statics, _ = run(directory, cache_top=cache_top)
+                fused, fused_statics, _ = run(directory, cache_top=cache_top, fuse_branches=True)
+                self.assertEqual(statics, fused_statics, msg=f"test_same_behavior_statics_{directory}_{cache_top}")
+                self.assertEqual(reference.ram[:13].tolist(), fused.ram[:13].tolist(),
+                                 msg=f"test_same_behavior_ram_{directory}_{cache_top}")
+                self.assertLess(len(fused.rom), len(reference.rom), msg=f"test_same_behavior_size_{directory}_{cache_top}")
+                self.assertLess(fused.cycles, reference.cycles, msg=f"test_same_behavior_cycles_{directory}_{cache_top}")
+
+
+TAIL_CALLS = """function Sys.init 0
+push constant 100
+push constant 0
+call Main.sum 2
+pop static 0
+push constant 51
+call Main.even 1
+pop static 1
+push constant 7
+call Main.twice 1
+pop static 2
+push constant 5
+push constant 6
+push constant 7
+call Main.first 3
+pop static 3
+label HALT
+goto HALT
+function Main.sum 1
+push argument 0
+push constant 0
+eq
+if-goto DONE
+push argument 0
+pop local 0
+push local 0
+push constant 1
+sub
+push argument 1
+push local 0
+add
+call Main.sum 2
+return
+label DONE
+push argument 1
+return
+function Main.even 0
+push argument 0
+if-goto ODD
+push constant 0
+not
+return
+label ODD
+push argument 0
+push constant 1
+sub
+call Main.odd 1
+return
+function Main.odd 0
+push argument 0
+if-goto EVEN
+push constant 0
+return
+label EVEN
+push argument 0
+push constant 1
+sub
+call Main.even 1
+return
+function Main.twice 0
+push argument 0
+push argument 0
+push constant 1
+call Main.add3 3
+return
+function Main.add3 2
+push argument 0
+push argument 1
+add
+pop local 1
+push local 1
+push argument 2
+add
+return
+function Main.first 0
+push argument 0
+push argument 2
+sub
+call Main.neg 1
+return
+function Main.neg 0
+push argument 0
+neg
+return
+"""
+
+
+class TestTailCalls(unittest.TestCase):
+
+    def test_same_behavior(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            program = Path(tmp) / "Program"
+            program.mkdir()
+            (program / "Main.vm").write_text(TAIL_CALLS)
+            for compact, cache_top in ((False, False), (True, True)):
+                results = []
+                for tail_calls in (False, True):
+                    emulator, statics, depth = run(program, compact=compact, cache_top=cache_top,
+                                                   tail_calls=tail_calls)
+                    results.append((statics, emulator.ram[:5].tolist(), depth, emulator.cycles))
+                (statics, registers, depth, cycles), (tail_statics, tail_registers, tail_depth, tail_cycles) = results
+                self.assertEqual({"Main.0": 5050, "Main.1": 0, "Main.2": 15, "Main.3": 2}, statics,
+                                 msg=f"test_same_behavior0_{compact}")
+                self.assertEqual(statics, tail_statics, msg=f"test_same_behavior1_{compact}")
+                self.assertEqual(registers, tail_registers, msg=f"test_same_behavior2_{compact}")
+                # 100 nested frames of Main.sum, against the frames of Sys.init and of one call
+                self.assertGreater(depth, 256 + 100 * 8, msg=f"test_same_behavior3_{compact}")
+                self.assertLess(tail_depth, 256 + 30, msg=f"test_same_behavior4_{compact}")
+                self.assertLess(tail_cycles, cycles, msg=f"test_same_behavior5_{compact}")
+
+    def test_unused_routine(self):
+        # Fib has no call in tail position: $TAILCALL is not written
+        totals = []
+        for tail_calls in (False, True):
+            report = SizeReport()
+            with tempfile.TemporaryDirectory() as tmp:
+                program = Path(tmp) / "Fib"
+                shutil.copytree("test_files/vm/Fib", program)
+                VMTranslator(str(program), report=report, tail_calls=tail_calls)
+                code = program.with_suffix(".asm").read_text()
+            self.assertNotIn(f"({CodeWriter.tail_call_routine})", code, msg="test_unused_routine0")
+            totals.append(report.total)
+        self.assertEqual(totals[0], totals[1], msg="test_unused_routine1")
+
+
+class TestLeanOutput(unittest.TestCase):
+
+    def test_same_code(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            program = Path(tmp) / "Fib"
+            shutil.copytree("test_files/vm/Fib", program)
+            for cache_top in (False, True):
+                texts = []
+                for lean in (False, True):
+                    VMTranslator(str(program), cache_top=cache_top, lean=lean)
+                    texts.append(program.with_suffix(".asm").read_text())
+                full, lean = texts
+                self.assertEqual(StreamingAssembler().assemble_lines(full.splitlines()).tolist(),
+                                 StreamingAssembler().assemble_lines(lean.splitlines()).tolist(),
+                                 msg=f"test_same_code0_{cache_top}")
+                self.assertNotIn("//", lean, msg=f"test_same_code1_{cache_top}")
+                self.assertEqual(CodeWriter.count_instructions(full.splitlines()) + lean.count("("),
+                                 len(lean.splitlines()), msg=f"test_same_code2_{cache_top}")
+                self.assertLess(len(lean), len(full) // 2, msg=f"test_same_code3_{cache_top}")
+
+    def test_templates(self):
+        # every standard template is laid out as the `write` calls of the other commands
+        for lean in (False, True):
+            writer = CodeWriter("Test", Path("."), lean=lean)
+            writer.set_curr_filename("Test")
+            writer.write_push("static", 3)
+            writer.write("D=M")
+            writer.write("(L)", tab=False)
+            writer.write()
+            expected = "@Test.3\nD=M\n@SP\nM=M+1\nA=M-1\nM=D\nD=M\n(L)\n" if lean else \
+                "        // push static 3\n    @Test.3\n    D=M\n    @SP\n    M=M+1\n    A=M-1\n    M=D\n\n" \
+                "    D=M\n(L)\n\n"
+            self.assertEqual(expected, "".join(writer.output), msg=f"test_templates_{lean}")
+
+
+class TestParallelTranslation(unittest.TestCase):
+
+    def test_deterministic(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            program = Path(tmp) / "OS"
+            shutil.copytree("Compiler/JACK_OS", program)
+            (program / "App").mkdir()
+            shutil.copy("test_files/vm/Fib/Main.vm", program / "App")
+            outputs, reports, hits = [], [], []
+            for workers in (1, 3):
+                report, optimizer = SizeReport(), VMOptimizer()
+                VMTranslator(str(program), report=report, optimizer=optimizer, max_workers=workers)
+                outputs.append(program.with_suffix(".asm").read_text())
+                reports.append(report.words)
+                hits.append(optimizer.hits)
+        self.assertEqual(outputs[0], outputs[1], msg="test_deterministic0")
+        self.assertEqual(reports[0], reports[1], msg="test_deterministic1")
+        self.assertEqual(hits[0], hits[1], msg="test_deterministic2")
+        self.assertGreater(sum(hits[0].values()), 0, msg="test_deterministic3")
+        # files merged in the order of their paths (App/Main.vm first), after the bootstrap
+        functions = re.findall(r"^\((\w+)\.\w+\)$", outputs[0], re.MULTILINE)
+        self.assertEqual(["Main", "Array", "Keyboard", "Math", "Memory"], list(dict.fromkeys(functions))[:5],
+                         msg="test_deterministic4")
+
+    def test_top_level_calls(self):
+        # calls before the first function of a file are scoped by the file, not shared with the bootstrap
+        with tempfile.TemporaryDirectory() as tmp:
+            program = Path(tmp) / "Program"
+            program.mkdir()
+            (program / "Sys.vm").write_text("call Main.f 0\npop static 0\nfunction Sys.init 0\n"
+                                            "call Main.f 0\npop static 1\nlabel END\ngoto END\n")
+            (program / "Main.vm").write_text("call Sys.init 0\nfunction Main.f 0\npush constant 5\nreturn\n")
+            VMTranslator(str(program))
+            code = program.with_suffix(".asm").read_text()
+        labels = re.findall(r"^\((\w*\.\.\$ret\.\d+)\)$", code, re.MULTILINE)
+        self.assertEqual(["..$ret.0", "Main..$ret.0", "Sys..$ret.0"], sorted(labels), msg="test_top_level_calls0")
+        # assembles without a duplicate label (the top-level code of the files is never reached)
+        _, statics, _ = execute(code.splitlines(), max_cycles=10_000)
+        self.assertEqual({"Sys.0": 0, "Sys.1": 5}, statics, msg="test_top_level_calls1")
+
+
+# Sys.vm of a JACK_OS application initializing only Memory and Math
+INTRINSICS = """function Sys.init 0
+call Memory.init 0
+pop temp 0
+call Math.init 0
+pop temp 0
+push constant 181
+push constant 3
+neg
+call Math.multiply 2
+pop static 0
+push constant 12
+push static 0
+call Math.multiply 2
+pop static 1
+push static 0
+push constant 1000
+call Math.multiply 2
+pop static 2
+push constant 0
+push static 0
+call Math.multiply 2
+pop static 3
+push constant 32767
+push constant 7
+neg
+call Math.divide 2
+pop static 4
+push static 1
+push constant 7
+call Math.divide 2
+pop static 5
+push constant 3000
+push constant 1234
+call Memory.poke 2
+pop temp 0
+push constant 3000
+call Memory.peek 1
+push constant 1
+add
+pop static 6
+label END
+goto END
+"""
+
+
+class TestIntrinsics(unittest.TestCase):
+
+    def test_templates(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            program = Path(tmp) / "Program"
+            program.mkdir()
+            (program / "Main.vm").write_text("function Main.f 0\npush argument 0\npush constant 10\n"
+                                             "call Math.multiply 2\nreturn\n")
+            VMTranslator(str(program), bootstrap=False, intrinsics=["Math.multiply"])
+            code = program.with_suffix(".asm").read_text()
+        # x * 10 = ((x * 2) * 2 + x) * 2, without a call
+        self.assertNotIn("Math.multiply$ret", code, msg="test_templates0")
+        self.assertEqual(3, code.count("D=D+A"), msg="test_templates1")
+        self.assertEqual(1, code.count("D=D+M"), msg="test_templates2")
+
+    def test_unused_routines(self):
+        # the shared multiplication and division are only written if the program calls them
+        totals = []
+        for intrinsics in ((), ["Math.multiply", "Math.divide"]):
+            report = SizeReport()
+            with tempfile.TemporaryDirectory() as tmp:
+                program = Path(tmp) / "Fib"
+                shutil.copytree("test_files/vm/Fib", program)
+                VMTranslator(str(program), report=report, intrinsics=intrinsics)
+                code = program.with_suffix(".asm").read_text()
+            self.assertNotIn(f"({CodeWriter.multiply_routine})", code, msg="test_unused_routines0")
+            totals.append(report.total)
+        self.assertEqual(totals[0], totals[1], msg="test_unused_routines1")
+
+    def test_division_by_zero(self):
+        source = "function Sys.init 0\npush constant 7\npush constant 0\ncall Math.divide 2\npop static 0\n"
+        error = "function Sys.error 0\npush argument 0\npop static 1\nlabel HALT\ngoto HALT\n"
+        for i, text in enumerate((source, source + error)):
+            with tempfile.TemporaryDirectory() as tmp:
+                program = Path(tmp) / "Program"
+                program.mkdir()
+                (program / "Sys.vm").write_text(text)
+                VMTranslator(str(program), intrinsics=["Math.divide"])
+                code = program.with_suffix(".asm").read_text()
+            self.assertEqual(i == 1, "@Sys.error" in code, msg=f"test_division_by_zero0_{i}")
+            # halts instead of jumping through a variable
+            _, statics, _ = execute(code.splitlines(), max_cycles=10_000)
+            self.assertEqual({"Sys.0": 0, "Sys.1": 3} if i else {"Sys.0": 0}, statics, msg=f"test_division_by_zero1_{i}")
+
+    def test_same_behavior(self):
+        results = []
+        with tempfile.TemporaryDirectory() as tmp:
+            program = Path(tmp) / "Program"
+            shutil.copytree("Compiler/JACK_OS", program)
+            (program / "Sys.vm").write_text(INTRINSICS)
+            for intrinsics, cache_top in (((), False), (list(CodeWriter.intrinsic_functions), False),
+                                          (list(CodeWriter.intrinsic_functions), True), (["Memory.peek"], False)):
+                emulator, statics, _ = run(program, compact=True, cache_top=cache_top, intrinsics=intrinsics)
+                results.append((emulator, {symbol: value for symbol, value in statics.items()
+                                           if symbol.startswith("Sys.")}))
+        reference, statics = results[0]
+        self.assertEqual({"Sys.0": -543, "Sys.1": -6516, "Sys.2": -18712, "Sys.3": 0, "Sys.4": -4681, "Sys.5": -930,
+                          "Sys.6": 1235}, statics, msg="test_same_behavior0")
+        for i, (emulator, intrinsic_statics) in enumerate(results[1:]):
+            self.assertEqual(statics, intrinsic_statics, msg=f"test_same_behavior1_{i}")
+            self.assertEqual(reference.ram[0], emulator.ram[0], msg=f"test_same_behavior2_{i}")
+            self.assertLess(emulator.cycles, reference.cycles, msg=f"test_same_behavior3_{i}")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,205 @@
+from asm_optimizer import PeepholeOptimizer, JumpOptimizer, Outliner, preprocess
+from assembler import StreamingAssembler
+from emulator import CPUEmulator
+from VMTranslator import VMTranslator
+from vm_runner import execute
+from pathlib import Path
+import shutil
+import tempfile
+import unittest
+
+
+def translate_vm(directory: str) -> str:
+    """Translates a directory of .vm files in a temporary copy and returns the assembly text."""
+    with tempfile.TemporaryDirectory() as tmp:
+        program = Path(tmp) / Path(directory).name
+        shutil.copytree(directory, program)
+        VMTranslator(str(program))
+        return program.with_suffix(".asm").read_text()
+
+
+class TestPeepholeOptimizer(unittest.TestCase):
+
+    def test_redundant_address(self):
+        optimizer = PeepholeOptimizer()
+        self.assertEqual(["@SP", "A=M", "D=M"], optimizer.optimize(["@SP", "M=M+1", "@SP", "AM=M-1", "D=M"]),
+                         msg="test_redundant_address0")
+        self.assertEqual({"redundant": 1, "restored_a": 0, "memory_round_trip": 1, "dead_write": 0},
+                         optimizer.stats, msg="test_redundant_address1")
+        self.assertEqual(["@7", "D=A", "@x", "M=D"], PeepholeOptimizer().optimize(["@7", "D=A", "@x", "M=D", "D=M"]),
+                         msg="test_redundant_address2")
+
+    def test_restored_address(self):
+        program = ["@SP", "M=M+1", "A=M-1", "M=D", "@SP", "A=M-1", "M=-M"]
+        self.assertEqual(program, PeepholeOptimizer().optimize(program), msg="test_restored_address0")
+        self.assertEqual(["@SP", "M=M+1", "A=M-1", "M=D", "M=-M"], PeepholeOptimizer(vm_layout=True).optimize(program),
+                         msg="test_restored_address1")
+
+    def test_barriers(self):
+        # the label resets what is known, the fall-through of a conditional jump does not
+        program = ["@SP", "D=M", "(LOOP)", "@SP", "D=M", "@LOOP", "D;JNE", "@SP", "D=M", "@LOOP", "0;JMP", "@SP"]
+        self.assertEqual(["@SP", "D=M", "(LOOP)", "@SP", "D=M", "@LOOP", "D;JNE", "0;JMP", "@SP"],
+                         PeepholeOptimizer().optimize(program), msg="test_barriers0")
+        self.assertEqual(["@2", "D=A"], PeepholeOptimizer().optimize(["@1", "@2", "D=A", "D=A"]), msg="test_barriers1")
+
+    def test_variable_addresses(self):
+        # @a is a dead write, but removing it would move b from RAM[17] to RAM[16]
+        program = ["@a", "@b", "M=1", "@17", "D=M"]
+        self.assertEqual(program, PeepholeOptimizer().optimize(program), msg="test_variable_addresses0")
+        program = ["@a", "M=1", "@b", "D=A", "@a", "@b", "A=D", "M=D"]
+        self.assertEqual(["@a", "M=1", "@b", "D=A", "M=D"], PeepholeOptimizer().optimize(program),
+                         msg="test_variable_addresses1")
+
+    def test_same_behavior(self):
+        source = translate_vm("test_files/vm/Fib")
+        reference = CPUEmulator.from_source(source)
+        reference.run()
+        for vm_layout in (False, True):
+            optimizer = PeepholeOptimizer(vm_layout)
+            optimized = CPUEmulator.from_source(optimizer.optimize(source.splitlines()))
+            optimized.run()
+            self.assertEqual(144, optimized.signed(16), msg=f"test_same_behavior_result_{vm_layout}")
+            # R13-R15 and the frames above the stack hold ROM addresses, which moved
+            self.assertEqual(reference.ram[:13].tolist() + reference.ram[261:reference.ram[0]].tolist(),
+                             optimized.ram[:13].tolist() + optimized.ram[261:optimized.ram[0]].tolist(),
+                             msg=f"test_same_behavior_ram_{vm_layout}")
+            self.assertGreater(optimizer.removed, 0, msg=f"test_same_behavior_removed_{vm_layout}")
+            self.assertEqual(len(reference.rom) - optimizer.removed, len(optimized.rom),
+                             msg=f"test_same_behavior_size_{vm_layout}")
+            self.assertLess(optimized.cycles, reference.cycles, msg=f"test_same_behavior_cycles_{vm_layout}")
+
+
+class TestJumpOptimizer(unittest.TestCase):
+
+    def test_threading(self):
+        optimizer = JumpOptimizer()
+        program = ["@L1", "0;JMP", "(L1)", "@L2", "0;JMP", "(L2)", "@R0", "M=1", "(END)", "@END", "0;JMP"]
+        self.assertEqual(["(L2)", "@R0", "M=1", "(END)", "@END", "0;JMP"], optimizer.optimize(program),
+                         msg="test_threading0")
+        self.assertEqual({"threaded": 1, "inverted": 0, "branches_removed": 2, "blocks_removed": 1},
+                         optimizer.stats, msg="test_threading1")
+
+    def test_inversion(self):
+        optimizer = JumpOptimizer()
+        program = ["@R0", "D=M", "@T", "D;JNE", "@F", "0;JMP",
+                   "(T)", "@R1", "M=1", "(F)", "@R2", "M=1", "(END)", "@END", "0;JMP"]
+        self.assertEqual(["@R0", "D=M", "@F", "D;JEQ", "(T)", "@R1", "M=1", "(F)", "@R2", "M=1",
+                          "(END)", "@END", "0;JMP"], optimizer.optimize(program), msg="test_inversion0")
+        self.assertEqual({"threaded": 1, "inverted": 1, "branches_removed": 1, "blocks_removed": 1},
+                         optimizer.stats, msg="test_inversion1")
+        # the fall-through into (T) reads A: nothing may change
+        program[6:9] = ["(T)", "D=A", "M=D"]
+        self.assertEqual(program, JumpOptimizer().optimize(program), msg="test_inversion2")
+
+    def test_same_behavior(self):
+        for directory in ("test_files/vm/Loops", "test_files/vm/Fib"):
+            source = preprocess(translate_vm(directory).splitlines())
+            for program in (source, PeepholeOptimizer(vm_layout=True).optimize(source)):
+                reference, statics, _ = execute(program)
+                optimizer = JumpOptimizer()
+                optimized, optimized_statics, _ = execute(optimizer.optimize(program))
+                self.assertEqual(statics, optimized_statics, msg=f"test_same_behavior_statics_{directory}")
+                self.assertEqual(reference.ram[:13].tolist(), optimized.ram[:13].tolist(),
+                                 msg=f"test_same_behavior_ram_{directory}")
+                self.assertGreater(optimizer.stats["branches_removed"], 0, msg=f"test_same_behavior_branches_{directory}")
+                self.assertLess(len(optimized.rom), len(reference.rom), msg=f"test_same_behavior_size_{directory}")
+                self.assertLess(optimized.cycles, reference.cycles, msg=f"test_same_behavior_cycles_{directory}")
+                self.assertTrue(all(saved >= 0 for saved in optimizer.cycles_saved.values()),
+                                msg=f"test_same_behavior_loops_{directory}")
+
+    def test_loop_rotation(self):
+        source = preprocess(translate_vm("test_files/vm/Loops").splitlines())
+        optimizer = JumpOptimizer()
+        optimizer.optimize(source)
+        self.assertEqual(2, optimizer.cycles_saved["Main.find$WHILE_LOOP_2"], msg="test_loop_rotation0")
+        self.assertGreater(optimizer.cycles_saved["Sys.init$WHILE_LOOP_1"], 2, msg="test_loop_rotation1")
+        assembler = StreamingAssembler()
+        hits = CPUEmulator(assembler.assemble_lines(source)).profile()
+        profiled = JumpOptimizer(profile={label: hits[assembler.symbols[label]] for label in assembler.labels
+                                          if assembler.symbols[label] < len(hits)})
+        reference, statics, _ = execute(JumpOptimizer().optimize(source))
+        optimized, profiled_statics, _ = execute(profiled.optimize(source))
+        self.assertEqual(statics, profiled_statics, msg="test_loop_rotation2")
+        self.assertLessEqual(optimized.cycles, reference.cycles, msg="test_loop_rotation3")
+
+
+class TestOutliner(unittest.TestCase):
+
+    def test_subroutine(self):
+        body = ["@R1", "D=M", "@R2", "M=D+M", "@R3", "M=M+1", "@R4", "M=M-1", "@R5", "M=D", "@R6", "M=-1"]
+        program = body + ["@R7", "M=1"] + body + ["@R8", "M=1"] + body + ["(END)", "@END", "0;JMP"]
+        outliner = Outliner()
+        optimized = outliner.optimize(program)
+        call = ["@$outline.0$ret.0", "D=A", "@R15", "M=D", "@$outline.0", "0;JMP", "($outline.0$ret.0)"]
+        self.assertEqual(call, optimized[:7], msg="test_subroutine0")
+        self.assertEqual(["($outline.0)"] + body + ["@R15", "A=M", "0;JMP"], optimized[-16:], msg="test_subroutine1")
+        self.assertEqual({"subroutines": 1, "uses": 3, "words_saved": 3, "extra_cycles": 27}, outliner.stats,
+                         msg="test_subroutine2")
+        # the sequence reads D before writing it
+        program[1] = "D=D+M"
+        self.assertEqual(program, Outliner().optimize(program), msg="test_subroutine3")
+
+    def test_live_link(self):
+        # R15 holds a value across the last uses (as in $MULTIPLY), which must stay in place
+        body = ["@R1", "D=M", "@R2", "M=D+M", "@R3", "M=M+1", "@R4", "M=M-1", "@R5", "M=D", "@R6", "M=-1"]
+        save, restore = ["@R0", "D=M", "@R15", "M=D"], ["@R15", "D=M", "@R9", "M=D", "(END)", "@END", "0;JMP"]
+        program = body + ["@R7", "M=1"] + save + body + ["@R8", "M=1"] + body + restore
+        self.assertEqual(program, Outliner().optimize(program), msg="test_live_link0")
+        program = body + ["@R7", "M=1"] + body + ["@R8", "M=1"] + body + save + body + restore
+        reference, _, _ = execute(program)
+        outliner = Outliner()
+        optimized, _, _ = execute(outliner.optimize(program))
+        self.assertEqual(3, outliner.stats["uses"], msg="test_live_link1")
+        self.assertEqual(reference.ram[:10].tolist(), optimized.ram[:10].tolist(), msg="test_live_link2")
+
+    def test_tail(self):
+        tail = ["@R1", "M=1", "@R2", "M=1", "@R3", "M=1", "@END", "0;JMP"]
+        program = ["@R0", "D=M", "@SKIP", "D;JEQ", *tail, "(SKIP)", "@R4", "M=1", *tail, "(END)", "@END", "0;JMP"]
+        outliner = Outliner()
+        self.assertEqual(["@R0", "D=M", "@SKIP", "D;JEQ", "@$outline.0", "0;JMP", "(SKIP)", "@R4", "M=1",
+                          "@$outline.0", "0;JMP", "(END)", "@END", "0;JMP", "($outline.0)", *tail],
+                         outliner.optimize(program), msg="test_tail0")
+        self.assertEqual(4, outliner.stats["words_saved"], msg="test_tail1")
+
+    def test_same_behavior(self):
+        for directory in ("test_files/vm/Loops", "test_files/vm/Fib"):
+            source = PeepholeOptimizer(vm_layout=True).optimize(preprocess(translate_vm(directory).splitlines()))
+            reference, statics, _ = execute(source)
+            outliner = Outliner()
+            optimized, optimized_statics, _ = execute(outliner.optimize(source))
+            self.assertEqual(statics, optimized_statics, msg=f"test_same_behavior_statics_{directory}")
+            self.assertEqual(reference.ram[:13].tolist(), optimized.ram[:13].tolist(),
+                             msg=f"test_same_behavior_ram_{directory}")
+            self.assertEqual(len(reference.rom) - outliner.stats["words_saved"], len(optimized.rom),
+                             msg=f"test_same_behavior_size_{directory}")
+            self.assertGreater(outliner.stats["words_saved"], 0, msg=f"test_same_behavior_saved_{directory}")
+
+    def test_knobs(self):
+        source = PeepholeOptimizer(vm_layout=True).optimize(preprocess(translate_vm("test_files/vm/Loops").splitlines()))
+        size = sum(1 for instruction in source if instruction[0] != "(")
+        outliner = Outliner()
+        outliner.optimize(source)
+        thrifty = Outliner(max_cycles_per_word=1)
+        thrifty.optimize(source)
+        self.assertLess(thrifty.stats["extra_cycles"], outliner.stats["extra_cycles"], msg="test_knobs0")
+        self.assertLessEqual(thrifty.stats["extra_cycles"], thrifty.stats["words_saved"], msg="test_knobs1")
+        self.assertEqual(source, Outliner(max_cycles_per_word=0).optimize(source), msg="test_knobs2")
+        targeted = Outliner(target=size - 10)
+        targeted.optimize(source)
+        self.assertGreaterEqual(targeted.stats["words_saved"], 10, msg="test_knobs3")
+        self.assertLess(targeted.stats["words_saved"], outliner.stats["words_saved"], msg="test_knobs4")
+
+
+class TestCPUEmulator(unittest.TestCase):
+
+    def test_mult(self):
+        with open("test_files/mult.asm", 'r') as source:
+            emulator = CPUEmulator.from_source(source.read())
+        emulator.ram[0], emulator.ram[1] = 6, 7
+        emulator.run()
+        self.assertEqual(42, emulator.ram[2], msg="test_mult")
+
+    def test_profile(self):
+        emulator = CPUEmulator.from_source(translate_vm("test_files/vm/Loops"))
+        hits = emulator.profile()
+        self.assertEqual(emulator.cycles, sum(hits), msg="test_profile0")
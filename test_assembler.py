@@ -1,4 +1,9 @@
-from assembler import Assembler
+from assembler import Assembler, StreamingAssembler, VectorizedAssembler, assemble, assemble_batch
+from incremental_assembler import IncrementalAssembler, reassemble
+from array import array
+from pathlib import Path
+import shutil
+import tempfile
 import unittest
 
 
@@ -21,7 +26,7 @@ class TestAssembler(unittest.TestCase):
 
     def test_load_assembly_file(self):
         comparison = [
-            "@test\n",
+            "@10\n",
             "@var\n",
             "\n",
             "// comment\n",
@@ -35,7 +40,7 @@ class TestAssembler(unittest.TestCase):
 
     def test_preprocessing(self):
         comparison = [
-            "@test",
+            "@10",
             "@var",
             "D=M",
             "(LABEL0)",
@@ -46,6 +51,11 @@ class TestAssembler(unittest.TestCase):
         self.assembler.preprocessing()
         self.assertEqual(comparison, self.assembler.preprocessed, msg="test_preprocessing")
 
+    def test_duplicate_label(self):
+        self.assembler.preprocessed = ["(LOOP)", "@LOOP", "(LOOP)"]
+        with self.assertRaises(SyntaxError, msg="test_duplicate_label"):
+            self.assembler.get_labels()
+
     def test_int16_to_binary(self):
         self.assertEqual("0000000000000000", Assembler.int16_to_binary(0), msg="test_int16_to_binary0")
         self.assertEqual("0000000000010000", Assembler.int16_to_binary(16), msg="test_int16_to_binary1")
@@ -78,16 +88,186 @@ class TestAssembler(unittest.TestCase):
                                self.assembler.decode_c_instruction("@qrrhcgza")
 
     def test_translate(self):
-        self.assembler.translate("test_files/test.asm", "test_files")
-        with open("test_files/out_test.hack", 'r') as out, open("test_files/test.hack", 'r') as compare_file:
-            output = out.readlines()
-            compare = compare_file.readlines()
-            self.assertEqual(compare, output, msg="test_translate_0")
-        self.assembler.translate("test_files/fill.asm", "test_files")
-        with open("test_files/out_fill.hack", 'r') as out, open("test_files/fill.hack", 'r') as compare_file:
-            output = out.readlines()
-            compare = compare_file.readlines()
-            self.assertEqual(compare, output, msg="test_translate_1")
+        for name in ("test", "fill"):
+            assembler = Assembler()
+            assembler.translate(f"test_files/{name}.asm")
+            with tempfile.TemporaryDirectory() as tmp:
+                assembler.write_hack_file(Path(tmp) / f"out_{name}.hack")
+                with open(Path(tmp) / f"out_{name}.hack", 'r') as out, \
+                        open(f"test_files/{name}.hack", 'r') as compare_file:
+                    output = out.readlines()
+                    compare = compare_file.readlines()
+                    self.assertEqual(compare, output, msg=f"test_translate_{name}")
+
+
+class TestHackBinary(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.tmp_path = Path(self.tmp.name)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_binary_to_words(self):
+        words = Assembler.binary_to_words(["0000000000001010\n", "1111110000010000", "\n"])
+        self.assertEqual([10, 0b1111110000010000], list(words), msg="test_binary_to_words0")
+        self.assertEqual(["0000000000001010", "1111110000010000"], Assembler.words_to_binary(words),
+                         msg="test_binary_to_words1")
+        with self.assertRaises(ValueError, msg="test_binary_to_words2"):
+            Assembler.binary_to_words(["0101"])
+
+    def test_hackb_round_trip(self):
+        for golden in ("test_files/test.hack", "test_files/fill.hack"):
+            packed = self.tmp_path / "out.hackb"
+            text = self.tmp_path / "out.hack"
+            Assembler.convert(golden, packed)
+            self.assertEqual(2 * len(Assembler.load_hack_file(golden)), packed.stat().st_size,
+                             msg="test_hackb_round_trip0")
+            Assembler.convert(packed, text)
+            with open(golden, 'r') as compare_file, open(text, 'r') as out:
+                self.assertEqual(compare_file.read(), out.read(), msg="test_hackb_round_trip1")
+
+    def test_load_hackb_file(self):
+        packed = self.tmp_path / "test.hackb"
+        packed.write_bytes(bytes([0x0a, 0x00, 0x10, 0xfc]))
+        self.assertEqual([10, 0b1111110000010000], Assembler.load_hackb_file(packed).tolist(),
+                         msg="test_load_hackb_file0")
+        rom = array("H", [0] * 4)
+        Assembler.load_hackb_file(packed, rom)
+        self.assertEqual([10, 0b1111110000010000, 0, 0], rom.tolist(), msg="test_load_hackb_file1")
+        with self.assertRaises(ValueError, msg="test_load_hackb_file2"):
+            Assembler.load_hackb_file(packed, array("H", [0]))
+
+
+class TestStreamingAssembler(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.tmp_path = Path(self.tmp.name)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_goldens(self):
+        for name in ("test", "fill"):
+            output = self.tmp_path / (name + ".hack")
+            StreamingAssembler().assemble_file(f"test_files/{name}.asm", output)
+            with open(f"test_files/{name}.hack", 'r') as compare_file, open(output, 'r') as out:
+                self.assertEqual(compare_file.read(), out.read(), msg=f"test_goldens_{name}")
+
+    def test_forward_references(self):
+        source = self.tmp_path / "forward.asm"
+        source.write_text("@END\n0;JMP\n@x\nM=1\n(END)\n@y\n@END\n@x\n")
+        output = self.tmp_path / "forward.hackb"
+        count = StreamingAssembler().assemble_file(str(source), output, "hackb")
+        self.assertEqual(7, count, msg="test_forward_references0")
+        self.assertEqual([4, 0b1110101010000111, 16, 0b1110111111001000, 17, 4, 16],
+                         Assembler.load_hackb_file(output).tolist(), msg="test_forward_references1")
+
+    def test_duplicate_label(self):
+        source = self.tmp_path / "duplicate.asm"
+        source.write_text("(LOOP)\n@LOOP\n(LOOP)\n")
+        with self.assertRaises(SyntaxError, msg="test_duplicate_label"):
+            StreamingAssembler().assemble_file(str(source), self.tmp_path / "duplicate.hack")
+
+
+class TestAssembleAPI(unittest.TestCase):
+
+    def test_assemble(self):
+        words = assemble("@10\n@var\n\n// comment\nD=M  // comment\n(LABEL0)\n(LABEL1)\n@20\n")
+        self.assertEqual(Assembler.load_hack_file("test_files/test.hack"), words, msg="test_assemble0")
+        with open("test_files/fill.asm", 'r') as source:
+            self.assertEqual(Assembler.load_hack_file("test_files/fill.hack"), assemble(source),
+                             msg="test_assemble1")
+
+    def test_isolated_symbols(self):
+        self.assertEqual([16, 0b1110111111001000], assemble(["@first", "M=1"]).tolist(), msg="test_isolated_symbols0")
+        self.assertEqual([16, 4, 17], assemble(["@second", "(LOOP)", "@THAT", "@first"]).tolist(),
+                         msg="test_isolated_symbols1")
+        self.assertNotIn("first", Assembler.PRE_DEFINED_SYMBOLS, msg="test_isolated_symbols2")
+        self.assertNotIn("LOOP", Assembler().symbols, msg="test_isolated_symbols3")
+
+    def test_assemble_batch(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            for name in ("test", "fill"):
+                shutil.copy(f"test_files/{name}.asm", tmp)
+            sources = [Path(tmp) / "test.asm", Path(tmp) / "fill.asm", Path(tmp) / "missing.asm"]
+            results = assemble_batch(sources, "hackb", max_workers=2)
+            self.assertEqual([str(source) for source in sources], [result.source for result in results],
+                             msg="test_assemble_batch0")
+            self.assertEqual([4, 43, 0], [result.instructions for result in results], msg="test_assemble_batch1")
+            self.assertIsNone(results[1].error, msg="test_assemble_batch2")
+            self.assertIsNotNone(results[2].error, msg="test_assemble_batch3")
+            self.assertEqual(Assembler.load_hack_file("test_files/fill.hack").tolist(),
+                             Assembler.load_hackb_file(results[1].output).tolist(), msg="test_assemble_batch4")
+
+
+@unittest.skipUnless(VectorizedAssembler.available(), "NumPy is not installed")
+class TestVectorizedAssembler(unittest.TestCase):
+
+    def test_goldens(self):
+        for name in ("test", "fill"):
+            with open(f"test_files/{name}.asm", 'r') as source:
+                words = VectorizedAssembler.assemble_lines(source)
+            with open(f"test_files/{name}.hack", 'r') as compare_file:
+                self.assertEqual(compare_file.read(), VectorizedAssembler.render_text(words).decode(),
+                                 msg=f"test_goldens_{name}")
+
+    def test_same_as_python(self):
+        with open("test_files/mult.asm", 'r') as source:
+            lines = source.readlines()
+        lines += ["@DONE", "0;JMP", "@x", "M=-1", "(DONE)", "@y", "@DONE", "@x", "@-1", "AMD=D|M;JGT"]
+        self.assertEqual(assemble(lines), assemble(lines, vectorized=True), msg="test_same_as_python0")
+        self.assertEqual(0, len(assemble([], vectorized=True)), msg="test_same_as_python1")
+        with self.assertRaises(SyntaxError, msg="test_same_as_python2"):
+            assemble(["@1", "D=Q"], vectorized=True)
+        with self.assertRaises(SyntaxError, msg="test_same_as_python3"):
+            assemble(["(LOOP)", "@LOOP", "(LOOP)"], vectorized=True)
+
+
+class TestIncrementalAssembler(unittest.TestCase):
 
+    EDITS = [
+        # (line index, lines removed, lines inserted)
+        (3, 0, []),                     # unchanged source
+        (5, 1, ["D=D+1"]),              # same instruction count
+        (4, 0, ["@new_var", "M=0"]),    # new variable, labels after the edit move
+        (0, 0, ["@other", "(START)"]),  # variable referenced first, label at the very beginning
+        (9, 3, []),                     # removes instructions and a label reference
+        (2, 1, ["(LOOP_2)", "@LOOP_2"]),
+    ]
 
+    def test_edits(self):
+        with open("test_files/fill.asm", 'r') as source:
+            lines = source.read().splitlines()
+        with tempfile.TemporaryDirectory() as tmp:
+            source = Path(tmp) / "fill.asm"
+            for output_format in Assembler.OUTPUT_FORMATS:
+                program = list(lines)
+                for i, (index, removed, inserted) in enumerate([(0, 0, [])] + self.EDITS):
+                    program[index:index + removed] = inserted
+                    source.write_text("\n".join(program))
+                    result = reassemble(str(source), output_format)
+                    self.assertEqual(i == 0, result.full, msg=f"test_edits_full_{output_format}_{i}")
+                    if i > 0:
+                        self.assertEqual(len(inserted), result.changed_lines,
+                                         msg=f"test_edits_lines_{output_format}_{i}")
+                    output = source.with_suffix(Assembler.OUTPUT_FORMATS[output_format])
+                    if output_format == "hackb":
+                        words = Assembler.load_hackb_file(output)
+                    else:
+                        words = Assembler.load_hack_file(output)
+                    self.assertEqual(assemble(program).tolist(), words.tolist(), msg=f"test_edits_{output_format}_{i}")
 
+    def test_invalid_source_drops_cache(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            source = Path(tmp) / "test.asm"
+            source.write_text("@1\nD=A\n")
+            reassemble(str(source))
+            cache = IncrementalAssembler.cache_path(source.with_suffix(".hack"))
+            self.assertTrue(cache.is_file(), msg="test_invalid_source_drops_cache0")
+            source.write_text("@1\nD=Q\n")
+            with self.assertRaises(SyntaxError, msg="test_invalid_source_drops_cache1"):
+                reassemble(str(source))
+            self.assertFalse(cache.is_file(), msg="test_invalid_source_drops_cache2")
@@ -0,0 +1,39 @@
+from assembler import Assembler, SourceMap, assemble
+from disassembler import Disassembler
+from pathlib import Path
+import tempfile
+import unittest
+
+
+class TestDisassembler(unittest.TestCase):
+
+    def test_decode(self):
+        self.assertEqual("@10", Disassembler.decode(0b0000000000001010), msg="test_decode0")
+        self.assertEqual("D=M", Disassembler.decode(0b1111110000010000), msg="test_decode1")
+        self.assertEqual("0;JMP", Disassembler.decode(0b1110101010000111), msg="test_decode2")
+        self.assertEqual("AMD=D|M;JGT", Disassembler.decode(0b1111010101111001), msg="test_decode3")
+        with self.assertRaises(ValueError, msg="test_decode4"):
+            Disassembler.decode(0b1111111111000000)
+
+    def test_round_trip(self):
+        for golden in ("test_files/fill.hack", "test_files/mult_test.hack"):
+            words = Assembler.load_hack_file(golden)
+            self.assertEqual(words, assemble(Disassembler.disassemble(words)), msg=f"test_round_trip_{golden}")
+
+    def test_source_map(self):
+        assembler = Assembler()
+        assembler.translate("test_files/fill.asm")
+        source_map = assembler.source_map()
+        with tempfile.TemporaryDirectory() as tmp:
+            source_map.save(Path(tmp) / "fill.hackmap")
+            loaded = SourceMap.load(Path(tmp) / "fill.hackmap")
+        for current in (source_map, loaded):
+            self.assertEqual("fill.asm", current.source, msg="test_source_map0")
+            self.assertEqual(11, current.line(0), msg="test_source_map1")
+            self.assertIsNone(current.label(0), msg="test_source_map2")
+            self.assertEqual("LOOP", current.label(6), msg="test_source_map3")
+            self.assertEqual(current.label(len(current.lines) - 1), current.labels[-1][0], msg="test_source_map4")
+
+        lines = Disassembler.disassemble(assembler.words(), loaded)
+        self.assertIn("(LOOP)", lines, msg="test_source_map5")
+        self.assertEqual(assembler.words(), assemble(lines), msg="test_source_map6")
@@ -0,0 +1,82 @@
+from assembler import assemble
+from emulator import CPUEmulator
+from linker import HackObject, ObjectAssembler, Linker
+from VMTranslator import VMTranslator
+from pathlib import Path
+import tempfile
+import shutil
+import unittest
+
+APPLICATION = """
+function Sys.init 0
+call Memory.init 0
+pop temp 0
+call Math.init 0
+pop temp 0
+push constant 6
+push constant 7
+call Math.multiply 2
+pop static 0
+push constant 100
+push constant 7
+call Math.divide 2
+pop static 1
+label END
+goto END
+"""
+
+
+class TestLinker(unittest.TestCase):
+
+    def test_single_object(self):
+        with open("test_files/fill.asm", 'r') as file:
+            lines = file.readlines()
+        hack_object = ObjectAssembler().assemble_object(lines)
+        self.assertEqual(assemble(lines), Linker().link([hack_object]), msg="test_single_object0")
+        self.assertIn("LOOP", hack_object.exports, msg="test_single_object1")
+
+    def test_relocation(self):
+        first = ObjectAssembler().assemble_object(["@i", "M=1", "@second", "0;JMP", "(first)", "@first", "0;JMP"])
+        second = ObjectAssembler().assemble_object(["(second)", "@j", "M=1", "@i", "M=0", "@first", "0;JMP"])
+        linker = Linker()
+        rom = linker.link([first, second])
+        self.assertEqual(assemble(["@i", "M=1", "@second", "0;JMP", "(first)", "@first", "0;JMP",
+                                   "(second)", "@j", "M=1", "@i", "M=0", "@first", "0;JMP"]), rom,
+                         msg="test_relocation0")
+        self.assertEqual({"i": 16, "j": 17}, linker.variables, msg="test_relocation1")
+        with self.assertRaises(ValueError, msg="test_relocation2"):
+            Linker().link([first, first])
+
+    def test_prebuilt_library(self):
+        for compact in (False, True):
+            with tempfile.TemporaryDirectory() as tmp:
+                library = Path(tmp) / "Library"
+                library.mkdir()
+                for name in ("Array.vm", "Math.vm", "Memory.vm"):
+                    shutil.copy(Path("Compiler/JACK_OS") / name, library)
+                VMTranslator(str(library), bootstrap=False, compact=compact)
+                exports = ObjectAssembler.EXPORT_FUNCTIONS
+                with open(library.with_suffix(".asm"), 'r') as file:
+                    ObjectAssembler(exports).assemble_object(file).save(library.with_suffix(".hobj"))
+
+                application = Path(tmp) / "Application"
+                application.mkdir()
+                (application / "Sys.vm").write_text(APPLICATION)
+                VMTranslator(str(application), compact=compact)
+                with open(application.with_suffix(".asm"), 'r') as file:
+                    main = ObjectAssembler(exports).assemble_object(file)
+
+                linker = Linker()
+                rom = linker.link([main, HackObject.load(library.with_suffix(".hobj"))])
+
+            self.assertIn("Math.multiply", linker.labels, msg=f"test_prebuilt_library0_{compact}")
+            self.assertNotIn("INSTRUCTION_END_Math$0", linker.labels, msg=f"test_prebuilt_library1_{compact}")
+            self.assertEqual(compact, "$CALL" in linker.labels, msg=f"test_prebuilt_library2_{compact}")
+            emulator = CPUEmulator(rom)
+            emulator.run()
+            self.assertEqual(42, emulator.signed(linker.variables["Sys.0"]), msg=f"test_prebuilt_library3_{compact}")
+            self.assertEqual(14, emulator.signed(linker.variables["Sys.1"]), msg=f"test_prebuilt_library4_{compact}")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,53 @@
+from assembler import assemble
+from size_report import SizeReport, check_rom_budget
+from VMTranslator import VMTranslator
+from pathlib import Path
+import tempfile
+import shutil
+import unittest
+
+
+class TestSizeReport(unittest.TestCase):
+
+    def setUp(self):
+        self.report = SizeReport()
+        with tempfile.TemporaryDirectory() as tmp:
+            program = Path(tmp) / "Fib"
+            shutil.copytree("test_files/vm/Fib", program)
+            VMTranslator(str(program), report=self.report)
+            self.words = assemble(program.with_suffix(".asm").read_text())
+
+    def test_attribution(self):
+        self.assertEqual(len(self.words), self.report.total, msg="test_attribution0")
+        functions = dict(self.report.by("function"))
+        self.assertEqual({SizeReport.BOOTSTRAP, "Sys.init", "Main.fibonacci"}, set(functions), msg="test_attribution1")
+        self.assertEqual({SizeReport.BOOTSTRAP, "Sys", "Main"}, {name for name, _ in self.report.by("file")},
+                         msg="test_attribution2")
+        kinds = dict(self.report.by("kind"))
+        # Main.fibonacci makes two calls, Sys.init one
+        self.assertEqual(2 * self.report.words[("Sys", "Sys.init", "call")],
+                         self.report.words[("Main", "Main.fibonacci", "call")], msg="test_attribution3")
+        self.assertIn("comparison", kinds, msg="test_attribution4")
+        self.assertIn("push constant", kinds, msg="test_attribution5")
+        self.assertNotIn("label", kinds, msg="test_attribution6")
+        sizes = [words for _, words in self.report.by("kind")]
+        self.assertEqual(sorted(sizes, reverse=True), sizes, msg="test_attribution7")
+
+    def test_budget(self):
+        self.report.check(len(self.words))
+        with self.assertRaises(OverflowError, msg="test_budget0") as context:
+            self.report.check(len(self.words) - 1)
+        self.assertIn("Main.fibonacci", str(context.exception), msg="test_budget1")
+        with self.assertRaises(OverflowError, msg="test_budget2"):
+            check_rom_budget(SizeReport.ROM_SIZE + 1)
+        self.assertIn("by function", self.report.format(), msg="test_budget3")
+
+    def test_save_load(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            self.report.save(Path(tmp) / ("Fib" + SizeReport.SUFFIX))
+            loaded = SizeReport.load(Path(tmp) / ("Fib" + SizeReport.SUFFIX))
+        self.assertEqual(self.report.words, loaded.words, msg="test_save_load")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,48 @@
+from vm_constant_folder import ConstantFolder
+from vm_optimizer import VMOptimizer
+from vm_ir import VMProgram
+from vm_runner import run
+import unittest
+
+
+def fold(folder: ConstantFolder, commands: list) -> list:
+    return folder.optimize(VMProgram.parse(commands)).commands()
+
+
+class TestConstantFolder(unittest.TestCase):
+
+    def test_fold(self):
+        folder = ConstantFolder()
+        self.assertEqual(["push constant 7", "push constant 1", "neg", "push constant 32767", "not"],
+                         fold(folder, ["push constant 3", "push constant 4", "add", "push constant 1", "neg",
+                                          "push constant 32767", "push constant 1", "add"]), msg="test_fold0")
+        # comparisons on the wrapped difference, as translated: 20000 - (-20000) is negative
+        self.assertEqual(["push constant 0", "push constant 1", "neg"],
+                         fold(folder, ["push constant 20000", "push constant 20000", "neg", "gt",
+                                          "push constant 5", "push constant 5", "eq"]), msg="test_fold1")
+        self.assertEqual({"arithmetic": 2, "comparison": 2, "branch": 0, "propagation": 0}, folder.hits,
+                         msg="test_fold2")
+        # locals are zeroed at function entry, cells are tracked through pops
+        self.assertEqual(["function F.f 1", "push constant 9", "pop temp 1", "push constant 9", "goto END",
+                          "label END", "push local 0", "return"],
+                         fold(folder, ["function F.f 1", "push constant 9", "pop temp 1", "push temp 1",
+                                          "push local 0", "add", "push local 0", "not", "if-goto END",
+                                          "label END", "push local 0", "return"]), msg="test_fold3")
+        # cells are forgotten after a call or a write through that
+        for clobber in (["call F.g 0", "pop temp 0"], ["push constant 1", "pop that 0"]):
+            commands = ["push constant 2", "pop static 0"] + clobber + ["push static 0", "push constant 1", "add"]
+            self.assertEqual(commands, fold(ConstantFolder(), commands), msg=f"test_fold4_{clobber[0]}")
+        # the entries below a conditional jump are read at its target
+        commands = ["push constant 1", "push argument 0", "if-goto L", "push constant 2", "add", "label L"]
+        self.assertEqual(commands, fold(ConstantFolder(), commands), msg="test_fold5")
+
+    def test_same_behavior(self):
+        for directory in ("test_files/vm/Arith", "test_files/vm/Loops", "test_files/vm/Fib"):
+            reference, statics, _ = run(directory)
+            folded, folded_statics, _ = run(directory, optimizer=[ConstantFolder(), VMOptimizer()])
+            self.assertEqual(statics, folded_statics, msg=f"test_same_behavior_statics_{directory}")
+            self.assertLessEqual(folded.cycles, reference.cycles, msg=f"test_same_behavior_cycles_{directory}")
+
+
+if __name__ == '__main__':
+    unittest.main()
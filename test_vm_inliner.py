@@ -0,0 +1,150 @@
+from vm_inliner import Inliner
+from vm_ir import VMProgram
+from vm_runner import run
+from pathlib import Path
+import tempfile
+import unittest
+
+
+SYS = """function Sys.init 0
+push constant 7
+call Main.abs 1
+pop static 0
+push constant 5
+neg
+call Main.abs 1
+pop static 1
+push constant 3000
+pop pointer 0
+push constant 3
+push constant 4
+call Main.sum 2
+pop static 2
+push constant 3001
+call Main.get 1
+push pointer 0
+add
+pop static 3
+call Main.counter 0
+pop static 4
+label HALT
+goto HALT
+"""
+
+MAIN = """function Main.abs 0
+push argument 0
+push constant 0
+lt
+if-goto NEGATIVE
+push argument 0
+return
+label NEGATIVE
+push argument 0
+neg
+return
+function Main.sum 1
+push argument 0
+call Main.abs 1
+push argument 1
+call Main.abs 1
+add
+pop local 0
+push local 0
+return
+function Main.get 0
+push argument 0
+pop pointer 0
+push constant 11
+pop this 0
+push this 0
+return
+function Main.counter 0
+push static 0
+push constant 1
+add
+pop static 0
+push static 0
+return
+"""
+
+# Sys.x is inlined with its call of Sys.b in the first round, which the second round inlines again
+NESTED = """function Sys.init 0
+push constant 0
+call Sys.b 1
+pop static 0
+push constant 1
+call Sys.x 1
+pop static 1
+label HALT
+goto HALT
+function Sys.b 0
+push argument 0
+if-goto T
+push constant 10
+return
+label T
+push constant 20
+return
+function Sys.x 0
+push argument 0
+call Sys.b 1
+return
+"""
+
+
+class TestInliner(unittest.TestCase):
+
+    def test_inline(self):
+        programs = [VMProgram.parse(SYS.splitlines(), "Sys"), VMProgram.parse(MAIN.splitlines(), "Main")]
+        inliner = Inliner()
+        sys_program, main = inliner.inline(programs)
+        # Main.sum is too large once Main.abs is inlined in it, Main.counter uses the static variables of Main
+        calls = [command for command in sys_program.commands() if command.startswith("call")]
+        self.assertEqual(["call Main.sum 2", "call Main.counter 0"], calls, msg="test_inline0")
+        self.assertEqual([("Sys.init", "Main.abs"), ("Sys.init", "Main.abs"), ("Sys.init", "Main.get"),
+                          ("Main.sum", "Main.abs"), ("Main.sum", "Main.abs")],
+                         [(caller, callee) for caller, callee, _ in inliner.sites], msg="test_inline1")
+        self.assertIn("label Main.abs.0.NEGATIVE", sys_program.commands(), msg="test_inline2")
+        # the registers of Main.get: its argument, then the saved THIS
+        self.assertIn("push pointer 0\npop temp 1", "\n".join(sys_program.commands()), msg="test_inline3")
+        # call frame, minus the argument popped and the goto of the first return
+        saving = Inliner.frame_cycles - Inliner.argument_cycles - Inliner.goto_cycles
+        self.assertIn(f"Sys.init -> Main.abs: {saving} cycles", inliner.report(), msg="test_inline4")
+        # thresholds
+        inliner = Inliner(max_size=8)
+        inliner.inline(programs)
+        self.assertEqual({"Main.get"}, {callee for _, callee, _ in inliner.sites}, msg="test_inline5")
+        # Main.sum is inlinable once the calls of its body are inlined
+        for depth in (1, 2):
+            inliner = Inliner(max_size=40, max_depth=depth)
+            inliner.inline(programs)
+            self.assertEqual(depth == 2, "Main.sum" in {callee for _, callee, _ in inliner.sites},
+                             msg=f"test_inline6_{depth}")
+
+    def test_same_behavior(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            program = Path(tmp) / "Program"
+            program.mkdir()
+            (program / "Sys.vm").write_text(SYS)
+            (program / "Main.vm").write_text(MAIN)
+            reference, statics, _ = run(program)
+            inlined, inlined_statics, _ = run(program, inliner=Inliner(max_size=40))
+        self.assertEqual({"Sys.0": 7, "Sys.1": 5, "Sys.2": 7, "Sys.3": 3011, "Sys.4": 1, "Main.0": 1}, statics,
+                         msg="test_same_behavior0")
+        self.assertEqual(statics, inlined_statics, msg="test_same_behavior1")
+        self.assertEqual(reference.ram[:5].tolist(), inlined.ram[:5].tolist(), msg="test_same_behavior2")
+        self.assertLess(inlined.cycles, reference.cycles, msg="test_same_behavior3")
+
+    def test_nested(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            program = Path(tmp) / "Program"
+            program.mkdir()
+            (program / "Sys.vm").write_text(NESTED)
+            inliner = Inliner()
+            _, statics, _ = run(program, inliner=inliner)
+        self.assertEqual(4, len(inliner.sites), msg="test_nested0")
+        self.assertEqual({"Sys.0": 10, "Sys.1": 20}, statics, msg="test_nested1")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,58 @@
+from vm_ir import VMProgram, PUSH, CALL, ADD, LOCAL
+from pathlib import Path
+import tempfile
+import unittest
+
+
+SOURCE = """// comment
+function Main.main 2
+    push constant 7   // seven
+    pop local 1
+    add
+label LOOP
+    if-goto LOOP
+    call Main.main 0
+    return
+"""
+
+
+class TestVMProgram(unittest.TestCase):
+
+    def test_parse(self):
+        program = VMProgram.parse(SOURCE.splitlines(), "Main")
+        self.assertEqual(["function Main.main 2", "push constant 7", "pop local 1", "add", "label LOOP",
+                          "if-goto LOOP", "call Main.main 0", "return"], program.commands(), msg="test_parse0")
+        self.assertEqual(["Main.main", "LOOP"], program.symbols, msg="test_parse1")
+        self.assertEqual((PUSH, ADD, CALL), (program.opcodes[1], program.opcodes[3], program.opcodes[6]),
+                         msg="test_parse2")
+        self.assertEqual((LOCAL, 1), (program.args[2], program.indexes[2]), msg="test_parse3")
+        for line in ("jump LOOP", "push heap 0", "push local", "pop local -1", "add 1"):
+            with self.assertRaises(SyntaxError, msg=f"test_parse_{line}"):
+                VMProgram.parse([line])
+
+    def test_cache(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            source = Path(tmp) / "Main.vm"
+            source.write_text(SOURCE)
+            cache = Path(tmp) / "cache"
+            program = VMProgram.from_file(source, cache)
+            [cache_file] = list(cache.iterdir())
+            loaded = VMProgram.from_file(source, cache)
+            self.assertEqual(program.commands(), loaded.commands(), msg="test_cache0")
+            self.assertEqual("Main", loaded.source, msg="test_cache1")
+            # an unchanged source is loaded from the cache, not parsed
+            digest = cache_file.stem
+            VMProgram.parse(["return"]).save(cache_file, digest)
+            self.assertEqual(["return"], VMProgram.from_file(source, cache).commands(), msg="test_cache2")
+            # a changed source is parsed again
+            source.write_text(SOURCE + "push constant 1\n")
+            self.assertEqual(program.commands() + ["push constant 1"], VMProgram.from_file(source, cache).commands(),
+                             msg="test_cache3")
+            self.assertEqual(2, len(list(cache.iterdir())), msg="test_cache4")
+            cache_file.write_bytes(b"garbage")
+            with self.assertRaises(ValueError, msg="test_cache5"):
+                VMProgram.load(cache_file)
+
+
+if __name__ == '__main__':
+    unittest.main()
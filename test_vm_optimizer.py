@@ -0,0 +1,51 @@
+from vm_optimizer import VMOptimizer, Rule
+from vm_ir import VMProgram
+from vm_runner import run
+import unittest
+
+
+def optimize(optimizer: VMOptimizer, commands: list) -> list:
+    return optimizer.optimize(VMProgram.parse(commands)).commands()
+
+
+class TestVMOptimizer(unittest.TestCase):
+
+    def test_rules(self):
+        optimizer = VMOptimizer()
+        self.assertEqual(["push local 0", "goto L", "label L2"],
+                         optimize(optimizer, ["push local 0", "push constant 1", "neg", "not", "not", "if-goto L",
+                                             "goto L2", "label L2"]), msg="test_rules0")
+        self.assertEqual(1, optimizer.hits["true"], msg="test_rules1")
+        self.assertEqual(1, optimizer.hits["not-not"], msg="test_rules2")
+        self.assertEqual(1, optimizer.hits["branch-always"], msg="test_rules3")
+        self.assertEqual(1, optimizer.hits["goto-next"], msg="test_rules4")
+        # the wildcards must match the same tokens
+        program = ["push local 0", "pop local 1", "goto A", "label B", "not", "if-goto B"]
+        self.assertEqual(program, optimize(VMOptimizer(), program), msg="test_rules5")
+        # x = 0 branches on x itself
+        self.assertEqual(["push local 0", "if-goto F", "label T"],
+                         optimize(VMOptimizer(), ["push local 0", "push constant 0", "eq", "if-goto T", "goto F",
+                                                 "label T"]), msg="test_rules6")
+
+    def test_rule_table(self):
+        optimizer = VMOptimizer((Rule("custom", "push $s $i; pop $t $j", "push $t $i"),))
+        self.assertEqual(["push this 1"], optimize(optimizer, ["push local 1", "pop this 2"]), msg="test_rule_table0")
+        with self.assertRaises(ValueError, msg="test_rule_table1"):
+            Rule("grow", "not", "not; not")
+        with self.assertRaises(ValueError, msg="test_rule_table2"):
+            Rule("unbound", "pop local $i", "push local $j")
+        with self.assertRaises(ValueError, msg="test_rule_table3"):
+            Rule("wildcard", "$op", "")
+
+    def test_same_behavior(self):
+        results = {}
+        for optimizer in (None, VMOptimizer()):
+            emulator, statics, _ = run("test_files/vm/Loops", optimizer=optimizer)
+            results[optimizer is None] = (statics, len(emulator.rom), emulator.cycles)
+        self.assertEqual(results[True][0], results[False][0], msg="test_same_behavior0")
+        self.assertLess(results[False][1], results[True][1], msg="test_same_behavior1")
+        self.assertLess(results[False][2], results[True][2], msg="test_same_behavior2")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,84 @@
+from vm_tree_shaker import TreeShaker
+from vm_ir import VMProgram
+from VMTranslator import VMTranslator
+from vm_runner import execute
+from size_report import SizeReport
+from pathlib import Path
+import shutil
+import tempfile
+import unittest
+
+
+SYS = """function Sys.init 0
+call Main.main 0
+pop temp 0
+label HALT
+goto HALT
+function Sys.unused 0
+call Main.helper 0
+return
+"""
+
+MAIN = """push constant 0
+function Main.main 0
+call Main.square 0
+return
+function Main.square 0
+call Main.square 0
+return
+function Main.helper 0
+push constant 1
+return
+"""
+
+# an application multiplying 6 by 7, written over the Sys.vm of the JACK_OS
+APPLICATION = """function Sys.init 0
+call Memory.init 0
+pop temp 0
+call Math.init 0
+pop temp 0
+push constant 6
+push constant 7
+call Math.multiply 2
+pop static 0
+label END
+goto END
+"""
+
+
+class TestTreeShaker(unittest.TestCase):
+
+    def test_shake(self):
+        programs = [VMProgram.parse(SYS.splitlines(), "Sys"), VMProgram.parse(MAIN.splitlines(), "Main")]
+        shaker = TreeShaker()
+        sys_program, main = shaker.shake(programs)
+        self.assertEqual(["Sys.init", "Main.main", "Main.square"], shaker.kept, msg="test_shake0")
+        self.assertEqual({"Sys.unused": "never called",
+                          "Main.helper": "only called by unreachable Sys.unused"}, shaker.dropped, msg="test_shake1")
+        self.assertEqual(6, shaker.commands, msg="test_shake2")
+        self.assertEqual(SYS.splitlines()[:5], sys_program.commands(), msg="test_shake3")
+        # commands before the first function are kept
+        self.assertEqual(MAIN.splitlines()[:7], main.commands(), msg="test_shake4")
+        self.assertIn("Main.helper: only called by unreachable Sys.unused", shaker.log(), msg="test_shake5")
+        with self.assertRaises(ValueError, msg="test_shake6"):
+            TreeShaker(["Main.missing"]).shake(programs)
+
+    def test_same_behavior(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            program = Path(tmp) / "Program"
+            shutil.copytree("Compiler/JACK_OS", program)
+            (program / "Sys.vm").write_text(APPLICATION)
+            report = SizeReport()
+            VMTranslator(str(program), report=report)
+            # the whole JACK_OS does not fit the ROM with the standard calling convention
+            self.assertGreater(report.total, SizeReport.ROM_SIZE, msg="test_same_behavior0")
+            report = SizeReport()
+            VMTranslator(str(program), report=report, shaker=TreeShaker())
+            self.assertLess(report.total, SizeReport.ROM_SIZE, msg="test_same_behavior1")
+            self.assertNotIn("Screen.drawCircle", {function for _, function, _ in report.words}, msg="test_same_behavior2")
+            _, statics, _ = execute(program.with_suffix(".asm").read_text().splitlines())
+        self.assertEqual(42, statics["Sys.0"], msg="test_same_behavior3")
+
+
+if __name__ == '__main__':
+    unittest.main()
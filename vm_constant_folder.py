@@ -0,0 +1,192 @@
+import argparse
+from pathlib import Path
+
+from vm_ir import (VMProgram, ADD, SUB, NEG, EQ, GT, LT, AND, OR, NOT, PUSH, POP, GOTO, IF_GOTO, FUNCTION, CALL,
+                   CONSTANT, ARGUMENT, LOCAL, STATIC, THIS, THAT, TEMP)
+
+
+class ConstantFolder:
+    """
+        Constant propagation and folding over the extended basic blocks of VM code.
+
+        The (opcode, arg, index) commands of the `VMProgram` are simulated on an abstract stack whose entries hold a known 16-bit value or None,
+        along with the output slots of the commands producing them. Known values are also tracked for
+        the `temp`, `local`, `argument` and `static` cells: a pop records the value of the popped entry,
+        `function` zeroes the locals, and a push of a known cell becomes a push of its value. Producers
+        can be deleted wherever they are: the commands between a producer and the consumer of its
+        entry never reach that entry.
+
+        An arithmetic command or comparison whose operands are known is replaced, with its producers,
+        by the push of its result; comparisons fold as the translation computes them, on the wrapped
+        difference x - y. An `if-goto` on a known condition becomes a `goto` or nothing; on an unknown
+        one, the entries below it are left in place, as the target reads them too. The state is reset
+        at labels and after jumps and returns (blocks of several predecessors), and the cells are
+        forgotten after calls and writes through `this` or `that` (which may alias any of them).
+
+        Instances Attributes:
+            hits (dict): Kind of fold -> count ("arithmetic", "comparison", "branch", "propagation").
+    """
+
+    CELLS = (TEMP, LOCAL, ARGUMENT, STATIC)
+    BINARY = {
+        ADD: lambda x, y: x + y,
+        SUB: lambda x, y: x - y,
+        AND: lambda x, y: x & y,
+        OR: lambda x, y: x | y,
+        EQ: lambda x, y: -(ConstantFolder.signed(x - y) == 0),
+        GT: lambda x, y: -(ConstantFolder.signed(x - y) > 0),
+        LT: lambda x, y: -(ConstantFolder.signed(x - y) < 0),
+    }
+
+    def __init__(self):
+        self.hits = {"arithmetic": 0, "comparison": 0, "branch": 0, "propagation": 0}
+
+    @staticmethod
+    def signed(value: int) -> int:
+        value &= 0xFFFF
+        return value - 0x10000 if value & 0x8000 else value
+
+    @staticmethod
+    def push(value: int) -> list:
+        """The shortest commands pushing a 16-bit value."""
+        if value >= 0:
+            return [(PUSH, CONSTANT, value)]
+        if value == -0x8000:
+            return [(PUSH, CONSTANT, 32767), (NOT, 0, 0)]
+        return [(PUSH, CONSTANT, -value), (NEG, 0, 0)]
+
+    def optimize(self, program: VMProgram) -> VMProgram:
+        """
+        Folds the constants of a VM program.
+
+        Args:
+            program (VMProgram): The program.
+
+        Returns:
+            VMProgram: The optimized program, of the same source.
+        """
+        output = []     # slots: the commands replacing each input command
+        stack = []      # entries: [value or None, output slots of the producers]
+        cells = {}
+
+        def emit(slot: list) -> int:
+            output.append(slot)
+            return len(output) - 1
+
+        def pop() -> list:
+            return stack.pop() if stack else [None, []]
+
+        def materialize(entry: list) -> None:
+            """Rewrites the producers of a known entry as a push of its value, if that is shorter."""
+            value, producers = entry
+            if value is not None and producers:
+                canonical = ConstantFolder.push(value)
+                if len(canonical) < sum(len(output[slot]) for slot in producers):
+                    for slot in producers:
+                        output[slot] = []
+                    output[producers[-1]] = canonical
+
+        def flush() -> None:
+            for entry in stack:
+                materialize(entry)
+            stack.clear()
+            cells.clear()
+
+        for command in zip(program.opcodes, program.args, program.indexes):
+            opcode, arg, index = command
+            if opcode == PUSH:
+                value = index if arg == CONSTANT else cells.get((arg, index))
+                slot = [command]
+                if arg != CONSTANT and value is not None and value >= 0:
+                    slot = ConstantFolder.push(value)
+                    self.hits["propagation"] += 1
+                stack.append([value, [emit(slot)]])
+            elif opcode == POP:
+                entry = pop()
+                materialize(entry)
+                if arg in ConstantFolder.CELLS:
+                    cells[(arg, index)] = entry[0]
+                elif arg in (THIS, THAT):
+                    cells.clear()
+                emit([command])
+            elif opcode in (NEG, NOT):
+                value, producers = pop()
+                if value is not None:
+                    value = ConstantFolder.signed(-value if opcode == NEG else ~value)
+                stack.append([value, producers + [emit([command])]])
+            elif opcode in ConstantFolder.BINARY:
+                y, x = pop(), pop()
+                if x[0] is not None and y[0] is not None:
+                    for slot in x[1] + y[1]:
+                        output[slot] = []
+                    value = ConstantFolder.signed(ConstantFolder.BINARY[opcode](x[0], y[0]))
+                    stack.append([value, [emit(ConstantFolder.push(value))]])
+                    self.hits["comparison" if opcode in (EQ, GT, LT) else "arithmetic"] += 1
+                else:
+                    materialize(x)
+                    materialize(y)
+                    stack.append([None, [emit([command])]])
+            elif opcode == IF_GOTO:
+                value, producers = pop()
+                if value is None:
+                    # the entries below are also read at the target: their producers must stay
+                    for entry in stack:
+                        materialize(entry)
+                    stack[:] = [[None, []] for _ in stack]
+                    emit([command])
+                    continue
+                for slot in producers:
+                    output[slot] = []
+                self.hits["branch"] += 1
+                if value:
+                    emit([(GOTO, arg, 0)])
+                    flush()
+            elif opcode == CALL:
+                for _ in range(index):
+                    materialize(pop())
+                cells.clear()
+                stack.append([None, [emit([command])]])
+            else:
+                # label, goto, function, return
+                flush()
+                emit([command])
+                if opcode == FUNCTION:
+                    cells.update({(LOCAL, i): 0 for i in range(index)})
+        flush()
+        result = program.derive()
+        for slot in output:
+            for command in slot:
+                result.append(*command)
+        return result
+
+    def optimize_file(self, source: Path, destination: Path) -> None:
+        self.optimize(VMProgram.from_file(source)).to_file(destination)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Hack VM constant propagation and folding")
+    parser.add_argument('input', type=str, help="Path to the input .vm file or directory of .vm files")
+    parser.add_argument('-o', '--output', type=str, default=None,
+                        help="Output .vm file or directory (default: <input>.fold.vm, or the <input>_fold directory)")
+
+    args = parser.parse_args()
+
+    folder = ConstantFolder()
+    source = Path(args.input)
+    before = after = 0
+    if source.is_dir():
+        output = Path(args.output) if args.output else source.with_name(source.name + "_fold")
+        jobs = [(file, output / file.relative_to(source)) for file in sorted(source.glob('**/*.vm'))]
+    else:
+        jobs = [(source, Path(args.output) if args.output else source.with_suffix(".fold.vm"))]
+    for file, destination in jobs:
+        destination.parent.mkdir(parents=True, exist_ok=True)
+        with open(file, 'r') as lines:
+            before += len(VMProgram.preprocessing(lines))
+        folder.optimize_file(file, destination)
+        with open(destination, 'r') as lines:
+            after += len(VMProgram.preprocessing(lines))
+
+    print(f"{before} -> {after} commands")
+    for kind, hits in folder.hits.items():
+        print(f"  {hits:>6}  {kind}")
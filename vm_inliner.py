@@ -0,0 +1,237 @@
+import argparse
+from pathlib import Path
+
+from vm_ir import (VMProgram, ADD, SUB, EQ, GT, LT, AND, OR, PUSH, POP, LABEL, GOTO, IF_GOTO, FUNCTION, CALL, RETURN,
+                   CONSTANT, ARGUMENT, LOCAL, STATIC, POINTER, TEMP)
+
+
+class Inliner:
+    """
+        Whole-program inliner substituting the body of small VM functions at their call sites.
+
+        The arguments and local variables of an inlined function are remapped to `temp` registers left
+        unused by the program (the Jack compiler only uses temp 0), popped from the stack or zeroed
+        in a short prologue. Its labels are renamed `{callee}.{site}.{label}`, and its returns jump to
+        the end of its body, where the return value is on top of the stack as after a call. If it
+        writes `pointer`, the caller's THIS and THAT are saved in registers too and restored at the end.
+
+        A function is inlined when its body has at most `max_size` commands, it does not call itself,
+        the stack holds exactly its return value at every return, its registers fit the free ones, its
+        static variables belong to the file of the caller, and no register of its own is used after it
+        calls a function (whose code may use the same registers). Inlining runs in rounds, a function
+        becoming inlinable once the calls of its body were inlined, up to `max_depth` nested levels.
+        The registers of a body lie above those of the bodies inlined in it, so nesting needs no renaming.
+
+        Functions are handled as the (opcode, arg, index) commands of their `VMProgram`, label and
+        function names standing for their symbol (the symbols of a function depend on its file).
+
+        The cycles saved at each site are estimated with the standard templates of the VM translator.
+
+        Class Attributes:
+            frame_cycles (int): Cycles of a call, its function entry and its return, without locals.
+            local_cycles (int): Cycles of the zeroing of a local variable at function entry.
+            argument_cycles (int): Cycles of the prologue per argument (pop temp).
+            inlined_local_cycles (int): Cycles of the prologue per local variable (push constant 0, pop temp).
+            pointer_cycles (int): Cycles of the saving and restoring of a pointer.
+            goto_cycles (int): Cycles of the jump of a return to the end of the body.
+
+        Instances Attributes:
+            max_size (int): Largest number of commands of an inlined body.
+            max_depth (int): Largest number of nested inlining levels.
+            sites (list): (caller, callee, estimated cycles saved) of each inlined call site.
+    """
+
+    # commands whose first argument is a label or function name
+    SYMBOLIC = (LABEL, GOTO, IF_GOTO, FUNCTION, CALL)
+    # commands popping an entry of the stack without pushing one
+    POPPING = (POP, ADD, SUB, EQ, GT, LT, AND, OR, IF_GOTO)
+
+    frame_cycles = 97
+    local_cycles = 3
+    argument_cycles = 9
+    inlined_local_cycles = 16
+    pointer_cycles = 29
+    goto_cycles = 2
+
+    def __init__(self, max_size: int = 16, max_depth: int = 2):
+        self.max_size = max_size
+        self.max_depth = max_depth
+        self.sites = []
+
+    @staticmethod
+    def balanced(body: list) -> bool:
+        """Checks that the stack holds exactly the return value at every return (and at every label the same)."""
+        depths = {}
+        depth = 0
+        for opcode, arg, index in body:
+            if opcode == LABEL:
+                known = depths.setdefault(arg, depth)
+                if depth is not None and known != depth or known is None:
+                    return False
+                depth = known
+                continue
+            if depth is None:
+                # dead code after a goto or a return
+                continue
+            if opcode == PUSH:
+                depth += 1
+            elif opcode in Inliner.POPPING:
+                depth -= 1
+            elif opcode == CALL:
+                depth += 1 - index
+            if depth < 0:
+                return False
+            if opcode in (GOTO, IF_GOTO) and depths.setdefault(arg, depth) != depth:
+                return False
+            if opcode == GOTO:
+                depth = None
+            elif opcode == RETURN:
+                if depth != 1:
+                    return False
+                depth = None
+        return depth is None
+
+    def template(self, name: str, body: list, free: list):
+        """
+        Checks that a function can be inlined.
+
+        Returns:
+            dict: Its body, number of registers used by the bodies inlined in it, arguments, locals,
+                saved pointers and whether it uses static variables; None if it cannot be inlined.
+        """
+        if len(body) - 1 > self.max_size or not Inliner.balanced(body[1:]):
+            return None
+        calls = [i for i, (opcode, _, _) in enumerate(body) if opcode == CALL]
+        if any(body[i][1] == name for i in calls):
+            return None
+        memory = [(arg, index) for opcode, arg, index in body if opcode in (PUSH, POP)]
+        inner = [free.index(index) + 1 for arg, index in memory if arg == TEMP and index in free]
+        arguments = [index for arg, index in memory if arg == ARGUMENT]
+        pointers = sorted({index for opcode, arg, index in body if opcode == POP and arg == POINTER})
+        if calls:
+            first = calls[0]
+            labels = {arg: i for i, (opcode, arg, _) in enumerate(body) if opcode == LABEL}
+            if pointers or any(opcode in (PUSH, POP) and arg in (ARGUMENT, LOCAL)
+                               or opcode in (GOTO, IF_GOTO) and labels.get(arg, first) < first
+                               for opcode, arg, _ in body[first:]):
+                return None
+        return {"body": body[1:], "inner": max(inner, default=0), "arguments": max(arguments, default=-1) + 1,
+                "locals": body[0][2], "pointers": pointers, "static": any(arg == STATIC for arg, _ in memory)}
+
+    def instantiate(self, callee: str, site: int, template: dict, n_args: int, free: list) -> list:
+        """The commands replacing `call callee n_args`: prologue, renamed body and epilogue."""
+        base = template["inner"]
+        arguments = free[base:base + n_args]
+        local_registers = free[base + n_args:base + n_args + template["locals"]]
+        saved = free[base + n_args + template["locals"]:base + n_args + template["locals"] + len(template["pointers"])]
+        commands = [(POP, TEMP, register) for register in reversed(arguments)]
+        for register in local_registers:
+            commands += [(PUSH, CONSTANT, 0), (POP, TEMP, register)]
+        for pointer, register in zip(template["pointers"], saved):
+            commands += [(PUSH, POINTER, pointer), (POP, TEMP, register)]
+        body = template["body"]
+        end = f"{callee}.{site}.END"
+        for i, (opcode, arg, index) in enumerate(body):
+            if opcode in (PUSH, POP) and arg in (ARGUMENT, LOCAL):
+                registers = arguments if arg == ARGUMENT else local_registers
+                commands.append((opcode, TEMP, registers[index]))
+            elif opcode in (LABEL, GOTO, IF_GOTO):
+                commands.append((opcode, f"{callee}.{site}.{arg}", 0))
+            elif opcode == RETURN:
+                if i + 1 < len(body):
+                    commands.append((GOTO, end, 0))
+            else:
+                commands.append((opcode, arg, index))
+        if any(opcode == RETURN for opcode, _, _ in body[:-1]):
+            commands.append((LABEL, end, 0))
+        for pointer, register in zip(template["pointers"], saved):
+            commands += [(PUSH, TEMP, register), (POP, POINTER, pointer)]
+        return commands
+
+    def saving(self, template: dict, n_args: int) -> int:
+        """Estimated cycles saved by inlining a call."""
+        returns = sum(opcode == RETURN for opcode, _, _ in template["body"])
+        call = Inliner.frame_cycles + Inliner.local_cycles * template["locals"]
+        inlined = (Inliner.argument_cycles * n_args + Inliner.inlined_local_cycles * template["locals"]
+                   + Inliner.pointer_cycles * len(template["pointers"]) + Inliner.goto_cycles * (returns - 1))
+        return call - inlined
+
+    def inline(self, programs: list) -> list:
+        """
+        Inlines the small functions of a whole program at their call sites.
+
+        Args:
+            programs (list): The `VMProgram` of every file of the program.
+
+        Returns:
+            list: The programs with the calls inlined (the inlined functions are kept: see `vm_tree_shaker`).
+        """
+        temps = {index for program in programs
+                 for opcode, arg, index in zip(program.opcodes, program.args, program.indexes)
+                 if opcode in (PUSH, POP) and arg == TEMP}
+        free = [i for i in range(8) if i not in temps]
+        files = []
+        functions = {}
+        for program in programs:
+            commands = [(opcode, program.symbols[arg] if opcode in Inliner.SYMBOLIC else arg, index)
+                        for opcode, arg, index in zip(program.opcodes, program.args, program.indexes)]
+            spans = program.functions()
+            files.append((commands[:spans[0][1]] if spans else commands, [name for name, _, _ in spans]))
+            for name, start, end in spans:
+                functions[name] = (program.source, commands[start:end])
+        self.sites = []
+        # numbered per caller across the rounds: the labels of an inlined body are named after its site
+        sites = {}
+        for _ in range(self.max_depth):
+            templates = {}
+            for name, (source, body) in functions.items():
+                template = self.template(name, body, free)
+                if template is not None:
+                    templates[name] = template
+            inlined = False
+            for name, (source, body) in functions.items():
+                new_body, site = [], sites.get(name, 0)
+                for command in body:
+                    template = templates.get(command[1]) if command[0] == CALL else None
+                    n_args = command[2] if template is not None else 0
+                    if (template is None or command[1] == name or template["arguments"] > n_args
+                            or template["inner"] + n_args + template["locals"] + len(template["pointers"]) > len(free)
+                            or template["static"] and functions[command[1]][0] != source):
+                        new_body.append(command)
+                        continue
+                    new_body += self.instantiate(command[1], site, template, n_args, free)
+                    self.sites.append((name, command[1], self.saving(template, n_args)))
+                    site += 1
+                    inlined = True
+                sites[name] = site
+                functions[name] = (source, new_body)
+            if not inlined:
+                break
+        result = []
+        for program, (preamble, names) in zip(programs, files):
+            rewritten = VMProgram(program.source)
+            for opcode, arg, index in preamble + [command for name in names for command in functions[name][1]]:
+                rewritten.append(opcode, rewritten.symbol(arg) if opcode in Inliner.SYMBOLIC else arg, index)
+            result.append(rewritten)
+        return result
+
+    def report(self) -> str:
+        """The inlined call sites with the estimated cycles saved per execution."""
+        lines = [f"inlining: {len(self.sites)} call sites, about {sum(cycles for _, _, cycles in self.sites)} "
+                 f"cycles saved per execution of all of them"]
+        for caller, callee, cycles in self.sites:
+            lines.append(f"  {caller} -> {callee}: {cycles} cycles")
+        return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Hack VM inliner (dry run)")
+    parser.add_argument('input', type=str, help="Path to the directory of the .vm files of the program")
+    parser.add_argument('--max-size', type=int, default=16, help="Largest number of commands of an inlined body")
+    parser.add_argument('--max-depth', type=int, default=2, help="Largest number of nested inlining levels")
+
+    args = parser.parse_args()
+
+    inliner = Inliner(args.max_size, args.max_depth)
+    inliner.inline([VMProgram.from_file(file) for file in sorted(Path(args.input).glob('**/*.vm'))])
+    print(inliner.report())
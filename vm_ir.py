@@ -0,0 +1,249 @@
+import os
+import sys
+import json
+import hashlib
+import argparse
+from array import array
+from pathlib import Path
+
+
+COMMANDS = ("add", "sub", "neg", "eq", "gt", "lt", "and", "or", "not",
+            "push", "pop", "label", "goto", "if-goto", "function", "call", "return")
+(ADD, SUB, NEG, EQ, GT, LT, AND, OR, NOT,
+ PUSH, POP, LABEL, GOTO, IF_GOTO, FUNCTION, CALL, RETURN) = range(len(COMMANDS))
+OPCODES = {name: opcode for opcode, name in enumerate(COMMANDS)}
+
+SEGMENTS = ("constant", "argument", "local", "static", "this", "that", "pointer", "temp")
+(CONSTANT, ARGUMENT, LOCAL, STATIC, THIS, THAT, POINTER, TEMP) = range(len(SEGMENTS))
+SEGMENT_CODES = {name: code for code, name in enumerate(SEGMENTS)}
+
+
+class VMProgram:
+    """
+        Compact intermediate representation of a .vm file, shared by the VM translator and optimizers.
+
+        Every command is parsed once into three parallel arrays: its opcode (an index in `COMMANDS`,
+        the arithmetic commands coming first so that `opcode <= NOT` tells them apart), its first
+        argument (a segment code for push and pop, the index of a label or function name in `symbols`
+        otherwise) and its second argument (segment index, number of local variables or arguments).
+        Unused fields hold 0.
+
+        File layout (.vmir): the magic line, a JSON header line (digest of the source, symbols and
+        number of commands), then the little-endian arrays: opcodes (uint8), arguments and indexes
+        (uint16). `from_file` keeps such files in a cache directory, named by the digest of their
+        source, so that an unchanged file (e.g. of the JACK_OS copied in every project) is parsed once.
+
+        Class Attributes:
+            MAGIC (bytes): First line of a .vmir file.
+            SUFFIX (str): Suffix of .vmir files.
+
+        Instances Attributes:
+            source (str): Name of the source file without suffix, the namespace of its static variables.
+            opcodes (array): Opcode of each command.
+            args (array): First argument of each command.
+            indexes (array): Second argument of each command.
+            symbols (list): The label and function names, in order of first use.
+    """
+
+    MAGIC = b"HACKVMIR 1\n"
+    SUFFIX = ".vmir"
+
+    def __init__(self, source: str = ""):
+        self.source = source
+        self.opcodes = array("B")
+        self.args = array("H")
+        self.indexes = array("H")
+        self.symbols = []
+        self.symbol_ids = {}
+
+    def __len__(self) -> int:
+        return len(self.opcodes)
+
+    def symbol(self, name: str) -> int:
+        """Returns the index of a label or function name, adding it if needed."""
+        index = self.symbol_ids.get(name)
+        if index is None:
+            index = self.symbol_ids[name] = len(self.symbols)
+            self.symbols.append(name)
+        return index
+
+    @staticmethod
+    def preprocessing(lines) -> list:
+        """Removes comments, whitespace and empty lines."""
+        commands = []
+        for line in lines:
+            command = line.split("//")[0].strip()
+            if command:
+                commands.append(command)
+        return commands
+
+    @staticmethod
+    def parse(lines, source: str = ""):
+        """
+        Parses VM code in a single pass.
+
+        Args:
+            lines (Iterable[str]): The lines of the .vm file (comments and whitespace are allowed).
+            source (str): Name of the source file without suffix.
+
+        Returns:
+            VMProgram: The program.
+
+        Raises:
+            SyntaxError: If a command is unknown, or its arguments are missing or invalid.
+        """
+        program = VMProgram(source)
+        opcodes, args, indexes = program.opcodes, program.args, program.indexes
+        for command in VMProgram.preprocessing(lines):
+            tokens = command.split()
+            opcode = OPCODES.get(tokens[0])
+            if opcode is None:
+                raise SyntaxError(f"Unknown command type: {tokens[0]}.")
+            arity = 0 if opcode <= NOT or opcode == RETURN else 1 if LABEL <= opcode <= IF_GOTO else 2
+            if len(tokens) != arity + 1:
+                raise SyntaxError(f"{tokens[0]} takes {arity} argument(s): {command}")
+            arg = index = 0
+            if opcode in (PUSH, POP):
+                arg = SEGMENT_CODES.get(tokens[1], -1)
+                if arg < 0:
+                    raise SyntaxError(f"Unknown memory segment: {command}")
+            elif arity:
+                arg = program.symbol(tokens[1])
+            if arity == 2:
+                if not tokens[2].isdigit() or int(tokens[2]) > 32767:
+                    raise SyntaxError(f"Invalid index (0 to 32767): {command}")
+                index = int(tokens[2])
+            opcodes.append(opcode)
+            args.append(arg)
+            indexes.append(index)
+        return program
+
+    def derive(self):
+        """An empty program of the same source, with a copy of the symbols (the commands of a rewrite)."""
+        program = VMProgram(self.source)
+        program.symbols, program.symbol_ids = list(self.symbols), dict(self.symbol_ids)
+        return program
+
+    def append(self, opcode: int, arg: int = 0, index: int = 0) -> None:
+        self.opcodes.append(opcode)
+        self.args.append(arg)
+        self.indexes.append(index)
+
+    def command(self, i: int) -> str:
+        """The text of the command number `i`."""
+        opcode = self.opcodes[i]
+        if opcode <= NOT or opcode == RETURN:
+            return COMMANDS[opcode]
+        if opcode in (PUSH, POP):
+            return f"{COMMANDS[opcode]} {SEGMENTS[self.args[i]]} {self.indexes[i]}"
+        if opcode in (FUNCTION, CALL):
+            return f"{COMMANDS[opcode]} {self.symbols[self.args[i]]} {self.indexes[i]}"
+        return f"{COMMANDS[opcode]} {self.symbols[self.args[i]]}"
+
+    def commands(self) -> list:
+        return [self.command(i) for i in range(len(self))]
+
+    def functions(self) -> list:
+        """The (name, start, end) of each function, whose commands are `start` to `end` excluded."""
+        starts = [i for i, opcode in enumerate(self.opcodes) if opcode == FUNCTION]
+        return [(self.symbols[self.args[start]], start, end)
+                for start, end in zip(starts, starts[1:] + [len(self)])]
+
+    def select(self, ranges):
+        """A program made of the commands of the given (start, end) ranges, with the same symbols."""
+        program = VMProgram(self.source)
+        program.symbols, program.symbol_ids = self.symbols, self.symbol_ids
+        for start, end in ranges:
+            program.opcodes.extend(self.opcodes[start:end])
+            program.args.extend(self.args[start:end])
+            program.indexes.extend(self.indexes[start:end])
+        return program
+
+    def to_file(self, path: Path) -> None:
+        """Writes the program as a .vm file, in the layout of the compiler's VMWriter."""
+        with open(path, 'w') as file:
+            for i in range(len(self)):
+                tab = "" if self.opcodes[i] in (LABEL, FUNCTION) else "\t"
+                file.write(f"{tab}{self.command(i)}\n")
+
+    def save(self, path: Path, digest: str = "") -> None:
+        header = {"digest": digest, "symbols": self.symbols, "commands": len(self)}
+        with open(path, 'wb') as file:
+            file.write(VMProgram.MAGIC)
+            file.write(json.dumps(header, separators=(",", ":")).encode() + b"\n")
+            for section in (self.opcodes, self.args, self.indexes):
+                if sys.byteorder != "little":
+                    section = array(section.typecode, section)
+                    section.byteswap()
+                section.tofile(file)
+
+    @staticmethod
+    def load(path: Path, source: str = "", digest: str = None):
+        """
+        Loads a .vmir file.
+
+        Raises:
+            ValueError: If the file is not a .vmir file, or not the one of the source with the given digest.
+        """
+        with open(path, 'rb') as file:
+            if file.readline() != VMProgram.MAGIC:
+                raise ValueError(f"The file {path} is not a VM IR file")
+            header = json.loads(file.readline())
+            if digest is not None and header["digest"] != digest:
+                raise ValueError(f"The file {path} does not hold the IR of this source")
+            program = VMProgram(source)
+            for name in header["symbols"]:
+                program.symbol(name)
+            try:
+                for section in (program.opcodes, program.args, program.indexes):
+                    section.fromfile(file, header["commands"])
+                    if sys.byteorder != "little":
+                        section.byteswap()
+            except EOFError:
+                raise ValueError(f"The file {path} is truncated")
+        return program
+
+    @staticmethod
+    def from_file(path: Path, cache_dir: Path = None):
+        """
+        Parses a .vm file, or loads its IR from the cache directory if it was parsed before.
+
+        Args:
+            path (Path): The .vm file.
+            cache_dir (Path): Directory of the .vmir files named by the digest of their source (None: no cache).
+
+        Returns:
+            VMProgram: The program.
+        """
+        path = Path(path)
+        data = path.read_bytes()
+        if cache_dir is None:
+            return VMProgram.parse(data.decode().splitlines(), path.stem)
+        digest = hashlib.sha1(data).hexdigest()
+        cache = Path(cache_dir) / (digest + VMProgram.SUFFIX)
+        try:
+            return VMProgram.load(cache, path.stem, digest)
+        except (OSError, ValueError):
+            pass
+        program = VMProgram.parse(data.decode().splitlines(), path.stem)
+        Path(cache_dir).mkdir(parents=True, exist_ok=True)
+        # written aside then renamed: parallel translations may share the cache
+        temporary = cache.with_suffix(f".{os.getpid()}.tmp")
+        program.save(temporary, digest)
+        os.replace(temporary, cache)
+        return program
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Hack VM intermediate representation")
+    parser.add_argument('inputs', type=str, nargs="+", help=".vm files to parse, or .vmir files to print")
+    parser.add_argument('--cache', type=str, default=None, help="Cache directory of the parsed .vm files")
+
+    args = parser.parse_args()
+
+    for input_file in args.inputs:
+        if Path(input_file).suffix == VMProgram.SUFFIX:
+            print("\n".join(VMProgram.load(input_file).commands()))
+        else:
+            vm_program = VMProgram.from_file(input_file, args.cache)
+            print(f"{input_file}: {len(vm_program)} commands, {len(vm_program.symbols)} symbols")
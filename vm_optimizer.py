@@ -0,0 +1,183 @@
+import argparse
+from pathlib import Path
+
+from vm_ir import VMProgram, OPCODES, SEGMENT_CODES, PUSH, POP
+
+
+class Rule:
+    """
+        Rewrite rule of the `VMOptimizer`: a window of VM commands and its replacement.
+
+        Commands are written as in a .vm file and separated by `;`. A token starting with `$` is a
+        wildcard matching any segment, index, label or function name; a wildcard used twice must match
+        the same token, and keeps its value in the replacement. Command names cannot be wildcards.
+
+        Rules are matched against the (opcode, arg, index) commands of a `vm_ir.VMProgram`: segments
+        and indexes are compiled to their codes, label and function names are compared by name.
+
+        Instances Attributes:
+            name (str): Name of the rule in the hit counts.
+            pattern (list): The commands of the window, as (opcode, arg, index) with wildcards.
+            replacement (list): The commands replacing it, as (opcode, arg, index) with wildcards.
+    """
+
+    def __init__(self, name: str, pattern: str, replacement: str):
+        self.name = name
+        pattern, replacement = Rule.parse(pattern), Rule.parse(replacement)
+        if not pattern or any(command[0][0] == "$" for command in pattern + replacement):
+            raise ValueError(f"Rule {name}: the pattern is empty or a command name is a wildcard")
+        if len(replacement) > len(pattern):
+            raise ValueError(f"Rule {name}: the replacement must not be longer than the pattern")
+        bound = {token for command in pattern for token in command}
+        unbound = [token for command in replacement for token in command if token[0] == "$" and token not in bound]
+        if unbound:
+            raise ValueError(f"Rule {name}: unbound wildcards in the replacement: {', '.join(unbound)}")
+        try:
+            self.pattern = [Rule.compile(command) for command in pattern]
+            self.replacement = [Rule.compile(command) for command in replacement]
+        except (KeyError, ValueError):
+            raise ValueError(f"Rule {name}: unknown command, segment or invalid index")
+
+    @staticmethod
+    def parse(commands: str) -> list:
+        return [tuple(command.split()) for command in commands.split(";") if command.strip()]
+
+    @staticmethod
+    def compile(command: tuple) -> tuple:
+        """The (opcode, arg, index) of a command, whose arg and index may be wildcards or names."""
+        opcode = OPCODES[command[0]]
+        arg = command[1] if len(command) > 1 else 0
+        if opcode in (PUSH, POP) and arg[0] != "$":
+            arg = SEGMENT_CODES[arg]
+        index = command[2] if len(command) > 2 else 0
+        if index and index[0] != "$":
+            index = int(index)
+        return opcode, arg, index
+
+    def match(self, commands: list, symbols: list):
+        """Returns the wildcard bindings if the commands match the pattern, None otherwise."""
+        bindings = {}
+        for (opcode, *expected), command in zip(self.pattern, commands):
+            if opcode != command[0]:
+                return None
+            for token, value in zip(expected, command[1:]):
+                if not isinstance(token, str):
+                    if token != value:
+                        return None
+                elif token[0] == "$":
+                    if bindings.setdefault(token, value) != value:
+                        return None
+                elif symbols[value] != token:
+                    return None
+        return bindings
+
+    def rewrite(self, bindings: dict, program: VMProgram) -> list:
+        """The replacement with the bound values, its label and function names added to the program symbols."""
+        return [(opcode,) + tuple(token if not isinstance(token, str) else bindings[token] if token[0] == "$"
+                                  else program.symbol(token) for token in tokens)
+                for opcode, *tokens in self.replacement]
+
+
+# Every rule holds for any value on the stack: `eq`, `gt` and `lt` push 0 or -1, other values are any
+# 16-bit word (so `not` `if-goto` cannot become a branch on the opposite condition).
+RULES = (
+    Rule("push-pop-same", "push $s $i; pop $s $i", ""),
+    # `true` as the compiler writes it, in the form canceling with `not`
+    Rule("true", "push constant 1; neg", "push constant 0; not"),
+    Rule("not-not", "not; not", ""),
+    Rule("neg-neg", "neg; neg", ""),
+    Rule("add-zero", "push constant 0; add", ""),
+    Rule("sub-zero", "push constant 0; sub", ""),
+    Rule("or-zero", "push constant 0; or", ""),
+    # x != y is x - y != 0
+    Rule("branch-not-equal", "eq; not; if-goto $l", "sub; if-goto $l"),
+    Rule("branch-equal-over-goto", "eq; if-goto $t; goto $f; label $t", "sub; if-goto $f; label $t"),
+    Rule("branch-never", "push constant 0; if-goto $l", ""),
+    Rule("branch-always", "push constant 0; not; if-goto $l", "goto $l"),
+    Rule("goto-next", "goto $l; label $l", "label $l"),
+)
+
+
+class VMOptimizer:
+    """
+        Peephole optimizer rewriting VM code into shorter VM code, driven by a table of `Rule`s.
+
+        Commands are streamed onto an output stack. After each push, the rules whose pattern ends with
+        the name of the pushed command are tried against the top of the stack; a matching window is
+        popped and its replacement streamed again, so that rewrites cascade (`push constant 1` `neg`
+        `not` `if-goto L` disappears). Replacements are never longer than their pattern and the table
+        has no cycle, so the work is linear in the number of commands.
+
+        Instances Attributes:
+            rules (tuple): The rules, tried in order.
+            hits (dict): Rule name -> number of rewrites.
+    """
+
+    def __init__(self, rules=RULES):
+        self.rules = rules
+        self.rules_by_last = {}
+        for rule in rules:
+            # by opcode of the last command
+            self.rules_by_last.setdefault(rule.pattern[-1][0], []).append(rule)
+        self.hits = {rule.name: 0 for rule in rules}
+
+    def optimize(self, program: VMProgram) -> VMProgram:
+        """
+        Rewrites a VM program.
+
+        Args:
+            program (VMProgram): The program.
+
+        Returns:
+            VMProgram: The optimized program, of the same source.
+        """
+        result = program.derive()
+        output = []
+        pending = list(zip(reversed(program.opcodes), reversed(program.args), reversed(program.indexes)))
+        while pending:
+            output.append(pending.pop())
+            for rule in self.rules_by_last.get(output[-1][0], ()):
+                size = len(rule.pattern)
+                if size > len(output):
+                    continue
+                bindings = rule.match(output[-size:], result.symbols)
+                if bindings is not None:
+                    del output[-size:]
+                    pending.extend(reversed(rule.rewrite(bindings, result)))
+                    self.hits[rule.name] += 1
+                    break
+        for command in output:
+            result.append(*command)
+        return result
+
+    def optimize_file(self, source: Path, destination: Path) -> None:
+        self.optimize(VMProgram.from_file(source)).to_file(destination)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Hack VM peephole optimizer")
+    parser.add_argument('input', type=str, help="Path to the input .vm file or directory of .vm files")
+    parser.add_argument('-o', '--output', type=str, default=None,
+                        help="Output .vm file or directory (default: <input>.opt.vm, or the <input>_opt directory)")
+
+    args = parser.parse_args()
+
+    optimizer = VMOptimizer()
+    source = Path(args.input)
+    before = after = 0
+    if source.is_dir():
+        output = Path(args.output) if args.output else source.with_name(source.name + "_opt")
+        jobs = [(file, output / file.relative_to(source)) for file in sorted(source.glob('**/*.vm'))]
+    else:
+        jobs = [(source, Path(args.output) if args.output else source.with_suffix(".opt.vm"))]
+    for file, destination in jobs:
+        destination.parent.mkdir(parents=True, exist_ok=True)
+        with open(file, 'r') as lines:
+            before += len(VMProgram.preprocessing(lines))
+        optimizer.optimize_file(file, destination)
+        with open(destination, 'r') as lines:
+            after += len(VMProgram.preprocessing(lines))
+
+    print(f"{before} -> {after} commands")
+    for name, hits in sorted(optimizer.hits.items(), key=lambda item: -item[1]):
+        print(f"  {hits:>6}  {name}")
@@ -0,0 +1,62 @@
+import shutil
+import argparse
+import tempfile
+from pathlib import Path
+
+from assembler import StreamingAssembler
+from emulator import CPUEmulator
+from VMTranslator import VMTranslator
+
+
+def static_variables(assembler: StreamingAssembler, emulator: CPUEmulator) -> dict:
+    """The values of the numbered static variables (`File.n`) of an assembled program, by name."""
+    return {symbol: emulator.signed(address) for symbol, address in assembler.symbols.items()
+            if symbol.split(".")[-1].isdigit() and symbol not in assembler.labels}
+
+
+def execute(lines: list, max_cycles: int = 10_000_000) -> tuple:
+    """
+    Assembles a program and runs it until it halts, recording the highest stack pointer.
+
+    Returns:
+        tuple: The emulator, the static variables of the program and the highest stack pointer.
+
+    Raises:
+        RuntimeError: If the program did not halt within `max_cycles` cycles.
+    """
+    assembler = StreamingAssembler()
+    emulator = CPUEmulator(assembler.assemble_lines(lines))
+    depth = 0
+    while not emulator.halted():
+        if emulator.cycles >= max_cycles:
+            raise RuntimeError(f"The program did not halt within {max_cycles} cycles (pc={emulator.pc})")
+        emulator.step()
+        depth = max(depth, emulator.ram[0])
+    return emulator, static_variables(assembler, emulator), depth
+
+
+def run(directory, max_cycles: int = 10_000_000, **options) -> tuple:
+    """Translates a copy of a directory of .vm files with the `VMTranslator` options, then executes it."""
+    with tempfile.TemporaryDirectory() as tmp:
+        program = Path(tmp) / Path(directory).name
+        shutil.copytree(directory, program)
+        VMTranslator(str(program), **options)
+        lines = program.with_suffix(".asm").read_text().splitlines()
+    return execute(lines, max_cycles)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Translate and run a Hack VM program on the CPU emulator")
+    parser.add_argument('input', type=str, help="Path to the directory of the .vm files of the program")
+    parser.add_argument('--compact', action="store_true", help="Translate with the compact calling convention")
+    parser.add_argument('--cache-top', action="store_true", help="Translate with top-of-stack caching")
+    parser.add_argument('--tail-calls', action="store_true", help="Translate the calls in tail position as jumps")
+    parser.add_argument('--max-cycles', type=int, default=10_000_000)
+
+    args = parser.parse_args()
+
+    emulator, statics, depth = run(args.input, args.max_cycles, compact=args.compact, cache_top=args.cache_top,
+                                   tail_calls=args.tail_calls)
+    print(f"{emulator.cycles} cycles, highest stack pointer {depth}")
+    for symbol, value in statics.items():
+        print(f"{symbol} = {value}")
@@ -0,0 +1,107 @@
+import argparse
+from pathlib import Path
+
+from vm_ir import VMProgram, CALL
+
+
+class TreeShaker:
+    """
+        Whole-program dead function elimination over the static call graph of the VM code.
+
+        Every function called, directly or not, by a root (`Sys.init`, called by the bootstrap) is kept;
+        the others are dropped. The VM has no function pointers, so the `call` commands are all the
+        edges of the graph. Commands before the first function of a file are kept.
+
+        Instances Attributes:
+            roots (tuple): The functions called from outside the VM code.
+            kept (list): The reachable functions, in order of discovery.
+            dropped (dict): Unreachable function -> reason, in order of definition.
+            commands (int): Number of commands dropped.
+    """
+
+    def __init__(self, roots=("Sys.init",)):
+        self.roots = tuple(roots)
+        self.kept = []
+        self.dropped = {}
+        self.commands = 0
+
+    @staticmethod
+    def call_graph(programs: list) -> dict:
+        """Function -> the functions it calls, in order of first call."""
+        graph = {}
+        for program in programs:
+            for function, start, end in program.functions():
+                callees = graph.setdefault(function, {})
+                for i in range(start, end):
+                    if program.opcodes[i] == CALL:
+                        callees[program.symbols[program.args[i]]] = None
+        return {function: list(callees) for function, callees in graph.items()}
+
+    def shake(self, programs: list) -> list:
+        """
+        Removes the unreachable functions of a whole program.
+
+        Args:
+            programs (list): The `VMProgram` of every file of the program.
+
+        Returns:
+            list: The programs without their unreachable functions (files without any left are kept empty).
+
+        Raises:
+            ValueError: If a root is not defined.
+        """
+        graph = TreeShaker.call_graph(programs)
+        missing = [root for root in self.roots if root not in graph]
+        if missing:
+            raise ValueError(f"Tree shaking: the root function(s) {', '.join(missing)} are not defined")
+        reachable = dict.fromkeys(self.roots)
+        pending = list(reversed(self.roots))
+        while pending:
+            for callee in graph[pending.pop()]:
+                if callee in graph and callee not in reachable:
+                    reachable[callee] = None
+                    pending.append(callee)
+        self.kept = list(reachable)
+
+        callers = {}
+        for function, callees in graph.items():
+            for callee in callees:
+                callers.setdefault(callee, []).append(function)
+        self.dropped = {}
+        self.commands = 0
+        shaken = []
+        for program in programs:
+            functions = program.functions()
+            ranges = [(0, functions[0][1] if functions else len(program))]
+            for function, start, end in functions:
+                if function in reachable:
+                    ranges.append((start, end))
+                    continue
+                self.commands += end - start
+                if function in callers:
+                    self.dropped[function] = f"only called by unreachable {', '.join(callers[function])}"
+                else:
+                    self.dropped[function] = "never called"
+            shaken.append(program.select(ranges))
+        return shaken
+
+    def log(self) -> str:
+        """What was dropped and why."""
+        lines = [f"tree shaking: {len(self.kept)} functions reachable from {', '.join(self.roots)}, "
+                 f"{len(self.dropped)} dropped ({self.commands} commands)"]
+        for function, reason in self.dropped.items():
+            lines.append(f"  {function}: {reason}")
+        return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Hack VM dead function elimination (dry run)")
+    parser.add_argument('input', type=str, help="Path to the directory of the .vm files of the program")
+    parser.add_argument('--roots', type=str, nargs="+", default=["Sys.init"],
+                        help="Functions called from outside the VM code (default: Sys.init)")
+
+    args = parser.parse_args()
+
+    shaker = TreeShaker(args.roots)
+    shaker.shake([VMProgram.from_file(file) for file in sorted(Path(args.input).glob('**/*.vm'))])
+    print(shaker.log())